@@ -0,0 +1,89 @@
+-- Gemeenteprofielen voor de synthetische trainingsdata (ml-model/extract_training_data_v2.py)
+--
+-- Eén rij per gemeente met de 14 CBS percentages waaruit de cases getrokken worden,
+-- berekend in één pass over cbs_kenmerken met een AVG ... FILTER per patroon in plaats
+-- van alle kenmerken-rijen naar Python te halen. Gemeenten zonder cijfer voor een
+-- patroon krijgen dezelfde default als voorheen in pandas.
+--
+-- Installeren / bijwerken:
+--   psql -d schulden -f cbs_gemeente_profielen.sql
+
+CREATE OR REPLACE FUNCTION cbs_gemeente_profielen(
+    p_jaren TEXT[] DEFAULT ARRAY['2023-01', '2024-01']
+)
+RETURNS TABLE (
+    gemeentecode VARCHAR(10),
+    gemeentenaam VARCHAR(100),
+    income_low_pct DOUBLE PRECISION,
+    werkloosheid_pct DOUBLE PRECISION,
+    flexwerk_pct DOUBLE PRECISION,
+    zzp_laaginkomen_pct DOUBLE PRECISION,
+    bijstand_pct DOUBLE PRECISION,
+    ww_pct DOUBLE PRECISION,
+    ao_pct DOUBLE PRECISION,
+    eenouder_pct DOUBLE PRECISION,
+    kinderen_pct DOUBLE PRECISION,
+    jeugdzorg_pct DOUBLE PRECISION,
+    leeftijd_jong_pct DOUBLE PRECISION,
+    leeftijd_mid_pct DOUBLE PRECISION,
+    leeftijd_oud_pct DOUBLE PRECISION
+)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        p.gemeentecode,
+        naam,
+        COALESCE(p.income_low, 30),
+        COALESCE(p.werkloosheid, 45),
+        COALESCE(p.flexwerk, 45),
+        COALESCE(p.zzp_laaginkomen, 30),
+        COALESCE(p.bijstand, 45),
+        COALESCE(p.ww, 45),
+        COALESCE(p.ao, 45),
+        COALESCE(p.eenouder, 15),
+        COALESCE(p.kinderen, 25),
+        COALESCE(p.jeugdzorg, 45),
+        COALESCE(p.leeftijd_jong, 20),
+        COALESCE(p.leeftijd_mid, 45),
+        COALESCE(p.leeftijd_oud, 35)
+    FROM (
+        SELECT
+            k.gemeentecode,
+            -- Een gemeentecode kan onder meer dan één naam voorkomen: een profiel per naam
+            -- (rijen zonder naam tellen mee in de gemiddelden, maar geven geen profiel)
+            array_agg(DISTINCT k.gemeentenaam) FILTER (WHERE k.gemeentenaam IS NOT NULL) AS namen,
+            -- Inkomen
+            AVG(k.percentage) FILTER (WHERE k.label = 'Laag huishoudinkomen')::float8 AS income_low,
+            -- Werk
+            AVG(k.percentage) FILTER (WHERE k.label = 'Werkzoekende in huishouden')::float8 AS werkloosheid,
+            AVG(k.percentage) FILTER (WHERE k.label = 'Flexibel contract in huishouden')::float8 AS flexwerk,
+            AVG(k.percentage) FILTER (WHERE k.label = 'ZZP-er in huishouden en laag huishoudinkomen')::float8 AS zzp_laaginkomen,
+            -- Uitkeringen
+            AVG(k.percentage) FILTER (WHERE k.label = 'Bijstandsuitkering in huishouden')::float8 AS bijstand,
+            AVG(k.percentage) FILTER (WHERE k.label = 'WW-uitkering in huishouden')::float8 AS ww,
+            AVG(k.percentage) FILTER (WHERE k.label = 'AO- of ziektewetuitkering in huishouden')::float8 AS ao,
+            -- Huishouden
+            AVG(k.percentage) FILTER (WHERE k.kenmerken_cat = '4 Eenouderhuishouden')::float8 AS eenouder,
+            AVG(k.percentage) FILTER (WHERE k.label = 'Aantal kinderen in huishouden')::float8 AS kinderen,
+            -- Jeugdzorg
+            AVG(k.percentage) FILTER (WHERE k.label = 'Jeugdhulp, -bescherming en/of -reclassering in huishouden')::float8 AS jeugdzorg,
+            -- Leeftijd
+            AVG(k.percentage) FILTER (WHERE k.label = 'Leeftijd geselecteerd huishoudlid'
+                                        AND k.kenmerken_cat ~ '16 tot 25|25 tot 35')::float8 AS leeftijd_jong,
+            AVG(k.percentage) FILTER (WHERE k.label = 'Leeftijd geselecteerd huishoudlid'
+                                        AND k.kenmerken_cat ~ '35 tot 45|45 tot 55')::float8 AS leeftijd_mid,
+            AVG(k.percentage) FILTER (WHERE k.label = 'Leeftijd geselecteerd huishoudlid'
+                                        AND k.kenmerken_cat ~ '55 tot 65|65 jaar')::float8 AS leeftijd_oud
+        FROM cbs_kenmerken k
+        WHERE k.jaar = ANY(p_jaren)
+            AND k.schuldenaren LIKE '%Met geregistreerde%'
+            AND k.percentage IS NOT NULL
+        GROUP BY k.gemeentecode
+    ) p
+    CROSS JOIN LATERAL unnest(p.namen) AS naam
+    WHERE p.gemeentecode IS NOT NULL
+    ORDER BY p.gemeentecode, naam;
+$$;
+
+COMMENT ON FUNCTION cbs_gemeente_profielen(TEXT[]) IS
+    'Eén rij per gemeente met de 14 CBS percentages voor extract_training_data_v2.py';
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Early-exit benchmark on the v2 test split.
+
+Rebuilds the test split of train_model_v2.py (same partitions, seed and
+stratification) and scores it with the full forest, with early exit, and
+with the cascade from the model metadata (with and without early exit).
+Reports agreement of the recommendation with the full forest, test
+accuracy, average trees per row, the largest probability difference, and
+CPU time per 1000 rows when scored in batches of the given sizes.
+
+Usage:
+    python3 benchmark_early_exit.py [batch_size ...]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from feature_pipeline import SOURCE_COLUMNS, encode_features
+from model_registry import ModelRegistry
+from training_store import load_training_data
+
+
+def cpu_ms_per_1k_rows(score, X: np.ndarray, batch_size: int, repeats: int = 3) -> float:
+    """Best process CPU time over `repeats` runs of scoring X in batches."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.process_time()
+        for offset in range(0, len(X), batch_size):
+            score(X[offset:offset + batch_size])
+        best = min(best, time.process_time() - start)
+    return best * 1000 * 1000 / len(X)
+
+
+def main():
+    batch_sizes = [int(size) for size in sys.argv[1:]] or [1, 64, 1000]
+
+    bundle = ModelRegistry(os.getenv('ML_MODEL_REGISTRY', 'models'), mmap=False).current
+    forest = bundle.flat_model
+
+    training_data = bundle.config.get('training_data') or {}
+    df = load_training_data(SOURCE_COLUMNS + ['recommendation'], training_data.get('filters'))
+    X = encode_features(df)
+    y = bundle.label_encoder.transform(df['recommendation'].values)
+    _, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+
+    full = forest.predict_proba(X_test)
+    settings = [
+        ('full forest', lambda x: (forest.predict_proba(x), np.full(len(x), forest.n_trees))),
+        ('early exit', forest.predict_proba_early_exit),
+    ]
+    cascade = bundle.config.get('cascade')
+    if cascade:
+        trees, threshold = cascade['trees'], cascade['threshold']
+        settings += [
+            (f'cascade {trees}', lambda x: forest.predict_proba_cascade(x, trees, threshold)),
+            (f'cascade {trees} + early', lambda x: forest.predict_proba_cascade(x, trees, threshold, early_exit=True)),
+        ]
+
+    print("=" * 80)
+    print("Early-Exit Benchmark")
+    print("=" * 80)
+    print(f"Model version: {bundle.version}, {forest.n_trees} trees")
+    print(f"Test split: {len(X_test):,} rows")
+    print()
+
+    header = f"{'setting':24s} {'agree':>7s} {'accuracy':>8s} {'trees':>6s} {'max|Δp|':>8s}"
+    header += "".join(f" {f'ms/1k @{size}':>11s}" for size in batch_sizes)
+    print(header)
+    for name, score in settings:
+        probabilities, trees_used = score(X_test)
+        best = probabilities.argmax(axis=1)
+        line = (
+            f"{name:24s} {(best == full.argmax(axis=1)).mean()*100:6.2f}% "
+            f"{(best == y_test).mean()*100:7.2f}% {trees_used.mean():6.1f} "
+            f"{np.abs(probabilities - full).max():8.4f}"
+        )
+        line += "".join(f" {cpu_ms_per_1k_rows(score, X_test, size):11.1f}" for size in batch_sizes)
+        print(line)
+    print()
+    print(f"Early exit only applies to batches of {forest.EARLY_EXIT_MIN_ROWS}+ rows by default "
+          f"(ML_EARLY_EXIT_MIN_ROWS in the API); smaller ones get one pass over the trees.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Peak memory of the CBS extraction, before and after streaming.
+
+Runs every way of building the generator input from cbs_kenmerken in a fresh
+process and reports the CBS records it read, wall time, and peak RSS
+(ru_maxrss) above the RSS after importing pandas:
+
+    v1 read_sql_query     the old path of extract_training_data.py: all
+                          columns of the result set in one object DataFrame
+    v1 streaming          load_features(): server-side cursor, chunks of
+                          CHUNK_ROWS, only the used columns, categoricals
+    v2 read_sql_query     the old path of extract_training_data_v2.py
+    v2 streaming          build_profiles() over read_chunks()
+    v2 cbs_gemeente_profielen()
+
+It also checks that the streaming features equal the old ones.
+
+Usage:
+    python3 benchmark_extraction.py
+"""
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from cbs_config import cbs_dsn
+
+# The queries of extract_training_data.py and extract_training_data_v2.py before streaming
+OLD_V1_QUERY = """
+SELECT jaar, gemeentecode, gemeentenaam, thema, hoofdthema, label, kenmerken_cat, aantal, percentage, schuldenaren
+FROM cbs_kenmerken
+WHERE jaar IN ('2023-01', '2024-01')
+    AND schuldenaren LIKE '%Met geregistreerde%'
+    AND aantal IS NOT NULL
+    AND percentage IS NOT NULL
+ORDER BY gemeentecode, thema, label;
+"""
+OLD_V2_QUERY = """
+SELECT jaar, gemeentecode, gemeentenaam, thema, hoofdthema, label, kenmerken_cat, aantal, percentage, schuldenaren
+FROM cbs_kenmerken
+WHERE jaar IN ('2023-01', '2024-01')
+    AND schuldenaren LIKE '%Met geregistreerde%'
+    AND percentage IS NOT NULL
+"""
+
+MODES = ['v1 read_sql_query', 'v1 streaming', 'v2 read_sql_query', 'v2 streaming', 'v2 cbs_gemeente_profielen()']
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(mode: str, dsn: str):
+    """Build the features of one mode; runs in its own process."""
+    import psycopg2
+    import extract_training_data as v1
+    import extract_training_data_v2 as v2
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    if mode == 'v1 streaming':
+        result = v1.load_features(dsn)
+    elif mode == 'v2 streaming':
+        conn = psycopg2.connect(dsn)
+        try:
+            result = v2.build_profiles(v2.read_chunks(conn, v2.CBS_COLUMNS, v2.CBS_WHERE, (v2.JAREN,)))
+        finally:
+            conn.close()
+    elif mode == 'v2 cbs_gemeente_profielen()':
+        result = v2.load_profiles(dsn)
+    else:
+        conn = psycopg2.connect(dsn)
+        try:
+            df = pd.read_sql_query(OLD_V1_QUERY if mode.startswith('v1') else OLD_V2_QUERY, conn)
+        finally:
+            conn.close()
+        result = v1.build_features([df]) if mode.startswith('v1') else v2.build_profiles([df])
+    seconds = time.perf_counter() - start
+    return seconds, peak_rss_mb() - baseline, result
+
+
+def same_features(old: pd.DataFrame, new: pd.DataFrame) -> bool:
+    if list(old.columns) != list(new.columns) or len(old) != len(new):
+        return False
+    numeric = [name for name in old.columns if pd.api.types.is_float_dtype(old[name])]
+    keys = [name for name in old.columns if name not in numeric]
+    return (
+        (old[keys].astype(str).to_numpy() == new[keys].astype(str).to_numpy()).all()
+        and np.allclose(old[numeric].to_numpy(float), new[numeric].to_numpy(float), rtol=1e-12, equal_nan=True)
+    )
+
+
+def main():
+    dsn = cbs_dsn()
+
+    print("=" * 80)
+    print("CBS Extraction Benchmark")
+    print("=" * 80)
+    print()
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for mode in MODES:
+        # A fresh process per mode, so every peak RSS starts from the same baseline
+        with context.Pool(1) as pool:
+            results[mode] = pool.apply(run, (mode, dsn))
+    print()
+
+    print(f"{'extraction':30s} {'rows out':>9s} {'seconds':>8s} {'peak RSS MB':>12s}")
+    for mode in MODES:
+        seconds, rss, result = results[mode]
+        print(f"{mode:30s} {len(result):9,d} {seconds:8.2f} {rss:12.1f}")
+    print()
+    for old, new in [('v1 read_sql_query', 'v1 streaming'), ('v2 read_sql_query', 'v2 streaming'),
+                     ('v2 read_sql_query', 'v2 cbs_gemeente_profielen()')]:
+        status = "✅ same features" if same_features(results[old][2], results[new][2]) else "❌ features differ"
+        print(f"{new} vs {old}: {status}")
+
+
+if __name__ == "__main__":
+    main()
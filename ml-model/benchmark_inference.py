@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Inference thread benchmark under concurrent single-row load.
+
+Compares the sklearn forest with the n_jobs setting pickled at training time
+(n_jobs=-1 in older artifacts), the same forest with n_jobs=1, and the
+flattened forest used by the API. Each setting is run with several numbers
+of concurrent client threads and reports throughput and p50/p99 latency.
+
+It then sweeps the runtime settings ML_THREADS_PER_REQUEST and
+ML_THREAD_POOL_SIZE through inference_runtime.InferenceRuntime: every
+request is handed to a pool of pool_size threads, as the API does with
+asyncio.to_thread and its sync endpoints, with the native thread pools
+limited and n_jobs set to threads_per_request. threads_per_request only
+changes the sklearn fallback (n_jobs) and BLAS/OpenMP, which the flat forest
+does not use; the pool size bounds how many requests score at once on
+either path.
+
+Usage:
+    python3 benchmark_inference.py [requests_per_setting] [concurrency ...]
+"""
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+
+from inference_runtime import InferenceRuntime
+from model_registry import MODEL_FILE, ModelRegistry
+
+# Runtime settings swept per concurrency level
+THREADS_PER_REQUEST = sorted({1, os.cpu_count() or 1})
+POOL_SIZES = (1, 4, 8)
+
+
+def run(predict, rows: np.ndarray, concurrency: int, pool: ThreadPoolExecutor = None):
+    """
+    Score every row as its own request from `concurrency` client threads,
+    through `pool` (the serving threads) when given.
+    """
+    latencies = []
+
+    def one(i):
+        start = time.perf_counter()
+        if pool is None:
+            predict(rows[i:i + 1])
+        else:
+            pool.submit(predict, rows[i:i + 1]).result()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        list(clients.map(one, range(len(rows))))
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "throughput": len(rows) / duration,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    n_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency_levels = [int(c) for c in sys.argv[2:]] or [1, 4, 16]
+
+    bundle = ModelRegistry(os.getenv('ML_MODEL_REGISTRY', 'models'), mmap=False).current
+    pickled_model = joblib.load(os.path.join(bundle.path, MODEL_FILE))
+    single_thread_model = joblib.load(os.path.join(bundle.path, MODEL_FILE))
+    single_thread_model.n_jobs = 1
+
+    rng = np.random.default_rng(42)
+    rows = bundle.scaler.mean_ + rng.standard_normal((n_requests, len(bundle.feature_names))) * bundle.scaler.scale_
+
+    def sklearn_predict(model):
+        return lambda x: model.predict_proba(bundle.scaler.transform(x))
+
+    settings = [
+        (f"sklearn n_jobs={pickled_model.n_jobs} (pickled)", sklearn_predict(pickled_model)),
+        ("sklearn n_jobs=1", sklearn_predict(single_thread_model)),
+        ("flat forest", bundle.predict_proba),
+    ]
+
+    print("=" * 80)
+    print("Inference Thread Benchmark")
+    print("=" * 80)
+    print(f"Model version: {bundle.version}")
+    print(f"CPU cores: {os.cpu_count()}")
+    print(f"Requests per setting: {n_requests:,}")
+    print()
+    print(f"{'setting':32s} {'threads':>8s} {'req/s':>10s} {'p50 ms':>10s} {'p99 ms':>10s}")
+    print("-" * 74)
+
+    for name, predict in settings:
+        predict(rows[:1])  # warm-up
+        for concurrency in concurrency_levels:
+            result = run(predict, rows, concurrency)
+            print(f"{name:32s} {concurrency:>8d} {result['throughput']:>10.0f} "
+                  f"{result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f}")
+    print()
+
+    print("Runtime settings (ML_THREADS_PER_REQUEST x ML_THREAD_POOL_SIZE)")
+    print(f"{'setting':16s} {'per req':>7s} {'pool':>5s} {'clients':>8s} {'req/s':>10s} {'p50 ms':>10s} {'p99 ms':>10s}")
+    print("-" * 74)
+    for threads_per_request in THREADS_PER_REQUEST:
+        for pool_size in POOL_SIZES:
+            runtime = InferenceRuntime(threads_per_request=threads_per_request, pool_size=pool_size)
+            limiter = runtime.apply_to_process()
+            fallback_model = runtime.apply_to_model(joblib.load(os.path.join(bundle.path, MODEL_FILE)))
+            try:
+                with ThreadPoolExecutor(max_workers=runtime.pool_size) as pool:
+                    for name, predict in [("sklearn fallback", sklearn_predict(fallback_model)),
+                                          ("flat forest", bundle.predict_proba)]:
+                        predict(rows[:1])  # warm-up
+                        for concurrency in concurrency_levels:
+                            result = run(predict, rows, concurrency, pool)
+                            print(f"{name:16s} {threads_per_request:>7d} {pool_size:>5d} {concurrency:>8d} "
+                                  f"{result['throughput']:>10.0f} {result['p50_ms']:>10.2f} {result['p99_ms']:>10.2f}")
+            finally:
+                if limiter is not None:
+                    limiter.restore_original_limits()
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for multi-worker serving of the ML API.
+
+Starts model_api.py with N workers, once with the memory-mapped flat forest
+(ML_MMAP_MODEL=1) and once with a private copy per worker (ML_MMAP_MODEL=0),
+and reports RSS, PSS and private memory per worker. PSS divides shared pages
+over the processes that map them, so it shows what a worker really costs.
+
+Linux only (reads /proc).
+
+Usage:
+    python3 benchmark_serving.py [workers] [port]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+SAMPLE_REQUEST = {
+    "debt_amount": 250,
+    "monthly_income": 1400,
+    "income_source": "BENEFIT_SOCIAL",
+    "other_debts_count": 1
+}
+
+
+def read_memory_kb(pid: int) -> dict:
+    """Read Rss, Pss and private memory (kB) from /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(':'):
+                values[parts[0][:-1]] = int(parts[1]) if parts[1].isdigit() else 0
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(parent: int) -> list:
+    """Direct children of a process, excluding multiprocessing helpers."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == parent and b"resource_tracker" not in cmdline:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def wait_for_health(port: int, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"ML API on port {port} did not become healthy")
+
+
+def warm_up(port: int, requests: int = 200):
+    """Send predictions so every worker has touched the model pages."""
+    body = json.dumps(SAMPLE_REQUEST).encode()
+    for _ in range(requests):
+        req = urllib.request.Request(
+            f"http://127.0.0.1:{port}/predict",
+            data=body,
+            headers={"Content-Type": "application/json"}
+        )
+        urllib.request.urlopen(req, timeout=5).read()
+
+
+def measure(workers: int, port: int, mmap: bool) -> list:
+    env = dict(
+        os.environ,
+        ML_WORKERS=str(workers),
+        ML_API_PORT=str(port),
+        ML_MMAP_MODEL="1" if mmap else "0"
+    )
+    server = subprocess.Popen(
+        [sys.executable, "model_api.py"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_health(port)
+        warm_up(port)
+        time.sleep(1)
+        return [read_memory_kb(pid) for pid in child_pids(server.pid)]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8010
+
+    print("=" * 80)
+    print("ML API Serving Memory Benchmark")
+    print("=" * 80)
+    print(f"Workers: {workers}")
+    print()
+
+    for mmap in (True, False):
+        label = "shared mmap" if mmap else "private copy"
+        stats = measure(workers, port, mmap)
+        if not stats:
+            print(f"{label}: no worker processes found")
+            continue
+
+        print(f"{label}:")
+        print(f"   {'worker':>6s} {'RSS MB':>10s} {'PSS MB':>10s} {'private MB':>12s}")
+        for i, s in enumerate(stats):
+            print(f"   {i:>6d} {s['rss']/1024:>10.1f} {s['pss']/1024:>10.1f} {s['private']/1024:>12.1f}")
+        total_pss = sum(s['pss'] for s in stats) / 1024
+        print(f"   Total PSS: {total_pss:.1f} MB ({total_pss/len(stats):.1f} MB per worker)")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Offline bulk scoring of a CSV or Parquet file of cases.
+
+The input has the PredictionRequest fields as columns (like the Arrow
+endpoint), optionally with gemeentecode for the CBS risk figures from
+municipality_risk.json. It is read in chunks of chunk_rows rows; every chunk is scored
+on a process pool and written as its own part file in the output
+directory:
+
+    scores/
+        _checkpoint.json        input, chunk size and model version of the run
+        part-000000.parquet     row, <passthrough columns>, recommendation,
+        part-000001.parquet     confidence, prob_<CLASS>..., error
+        ...                     (and tier with ML_CASCADE/ML_EARLY_EXIT)
+
+Input columns named like an output column are rejected before scoring.
+
+A part file only appears once it is complete, so an interrupted run is
+resumed by starting the same command again: finished chunks are skipped,
+those at the start of the input without reading their rows.
+Features are derived with the same code as the API, and the whole run is
+scored with one model version.
+
+Usage:
+    python3 bulk_score.py <cases.csv|cases.parquet> <output_dir> [workers] [chunk_rows]
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from feature_pipeline import REQUEST_COLUMNS, REQUEST_ERRORS, arrow_to_columns, derive_feature_matrix, validate_columns
+from model_registry import TIERS, ModelBundle, ModelRegistry, ensure_flat_model
+from municipality_risk import SNAPSHOT_FILE, MunicipalityRiskTable
+
+CHECKPOINT_FILE = '_checkpoint.json'
+
+# Types of the request columns in a CSV input. Without them every column is
+# typed from the first block, and a later block that differs (e.g. after an
+# all-empty first block) fails to convert.
+CSV_COLUMN_TYPES = {
+    name: pa.string() if name in ('income_source', 'age_category')
+    else pa.bool_() if isinstance(default, bool) else pa.float64()
+    for name, default in REQUEST_COLUMNS.items()
+}
+CSV_COLUMN_TYPES['gemeentecode'] = pa.string()
+
+# Columns of the part files besides the passthrough columns (and prob_<CLASS>)
+OUTPUT_COLUMNS = {'row', 'recommendation', 'confidence', 'error', 'tier'}
+
+# Set per worker process by init_worker()
+_bundle = None
+_risk_table = None
+
+
+def check_input_columns(path: str):
+    """Reject passthrough columns that would be overwritten by an output column."""
+    if path.endswith('.parquet'):
+        names = pq.ParquetFile(path).schema_arrow.names
+    else:
+        names = pa_csv.open_csv(path, convert_options=pa_csv.ConvertOptions(column_types=CSV_COLUMN_TYPES)).schema.names
+    clashes = [name for name in names if name not in REQUEST_COLUMNS
+               and (name in OUTPUT_COLUMNS or name.startswith('prob_'))]
+    if clashes:
+        raise ValueError(
+            f"{path} has columns that bulk_score.py writes itself ({', '.join(clashes)}); rename them"
+        )
+
+
+def part_path(output_dir: str, chunk: int) -> str:
+    return os.path.join(output_dir, f"part-{chunk:06d}.parquet")
+
+
+def iter_chunks(path: str, chunk_rows: int, first_chunk: int = 0):
+    """
+    Yield (chunk index, first row, table) with exactly chunk_rows rows per
+    chunk (except the last), from chunk first_chunk on. The rows before it
+    are skipped by offset: Parquet row groups before it are not read, CSV
+    rows are not converted.
+    """
+    skip = first_chunk * chunk_rows
+    offset = 0  # rows passed over before the first batch
+    if path.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(path)
+        metadata = parquet_file.metadata
+        group = 0
+        while group < metadata.num_row_groups and offset + metadata.row_group(group).num_rows <= skip:
+            offset += metadata.row_group(group).num_rows
+            group += 1
+        batches = parquet_file.iter_batches(batch_size=chunk_rows,
+                                            row_groups=range(group, metadata.num_row_groups)) \
+            if group < metadata.num_row_groups else []
+    else:
+        batches = pa_csv.open_csv(path, read_options=pa_csv.ReadOptions(skip_rows_after_names=skip),
+                                  convert_options=pa_csv.ConvertOptions(column_types=CSV_COLUMN_TYPES))
+        offset = skip
+
+    pending, pending_rows, chunk = [], 0, first_chunk
+    for batch in batches:
+        if offset < skip:
+            drop = min(skip - offset, batch.num_rows)
+            offset += drop
+            batch = batch.slice(drop)
+            if not batch.num_rows:
+                continue
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunk_rows:
+            table = pa.Table.from_batches(pending)
+            yield chunk, chunk * chunk_rows, table.slice(0, chunk_rows)
+            rest = table.slice(chunk_rows)
+            pending, pending_rows, chunk = rest.to_batches(), rest.num_rows, chunk + 1
+    if pending_rows:
+        yield chunk, chunk * chunk_rows, pa.Table.from_batches(pending)
+
+
+def init_worker(version: str, path: str, cascade: bool = False, early_exit: bool = False):
+    """
+    Load the model version of the run once per worker (memory-mapped, so
+    shared) and the gemeente risk table from its snapshot.
+    """
+    global _bundle, _risk_table
+    _bundle = ModelBundle(version, path, mmap=True, cascade=cascade, early_exit=early_exit)
+    _risk_table = MunicipalityRiskTable(SNAPSHOT_FILE, dsn=None)
+
+
+def score_chunk(table: pa.Table, first_row: int, output_file: str):
+    """Score one chunk and write its part file. Returns (rows, seconds, pid)."""
+    start = time.perf_counter()
+    columns = arrow_to_columns(table, _risk_table)
+    error = validate_columns(columns)
+    valid = error < 0
+
+    probabilities = np.full((table.num_rows, len(_bundle.class_names)), np.nan)
+    tiers = np.zeros(table.num_rows, dtype=np.int8)
+    if valid.any():
+        features = derive_feature_matrix({name: values[valid] for name, values in columns.items()})
+        probabilities[valid], tiers[valid] = _bundle.predict_tiered(features)
+
+    result = {"row": np.arange(first_row, first_row + table.num_rows)}
+    for name in table.column_names:
+        if name not in REQUEST_COLUMNS:
+            result[name] = table.column(name)
+    result["recommendation"] = pa.DictionaryArray.from_arrays(
+        pa.array(probabilities.argmax(axis=1).astype(np.int8), mask=~valid), pa.array(_bundle.class_names)
+    )
+    result["confidence"] = probabilities.max(axis=1)
+    for index, name in enumerate(_bundle.class_names):
+        result[f"prob_{name}"] = probabilities[:, index]
+    result["error"] = pa.DictionaryArray.from_arrays(pa.array(error, mask=valid), pa.array(REQUEST_ERRORS))
+    if _bundle.tiered:
+        result["tier"] = pa.DictionaryArray.from_arrays(pa.array(tiers, mask=~valid), pa.array(TIERS))
+
+    tmp_file = f"{output_file}.tmp"
+    pq.write_table(pa.table(result), tmp_file)
+    os.replace(tmp_file, output_file)
+    return table.num_rows, time.perf_counter() - start, os.getpid()
+
+
+def load_checkpoint(output_dir: str, run: dict) -> dict:
+    """Create the checkpoint, or check that an existing one belongs to the same run."""
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r') as f:
+            existing = json.load(f)
+        if existing != run:
+            changed = sorted(key for key in run if existing.get(key) != run[key])
+            raise ValueError(
+                f"{output_dir} holds a different run ({', '.join(changed)} changed); "
+                f"use another output directory"
+            )
+        return existing
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(checkpoint_path, 'w') as f:
+        json.dump(run, f, indent=2)
+    return run
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    input_path, output_dir = sys.argv[1], sys.argv[2]
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    chunk_rows = int(sys.argv[4]) if len(sys.argv) > 4 else 100_000
+    check_input_columns(input_path)
+
+    cascade = os.getenv('ML_CASCADE', '0') != '0'
+    early_exit = os.getenv('ML_EARLY_EXIT', '0') != '0'
+    bundle = ModelRegistry(os.getenv('ML_MODEL_REGISTRY', 'models'), mmap=True,
+                           cascade=cascade, early_exit=early_exit).current
+    ensure_flat_model(bundle.path)
+    load_checkpoint(output_dir, {
+        "input": os.path.abspath(input_path),
+        "chunk_rows": chunk_rows,
+        "model_version": bundle.version,
+        "model_signature": list(map(list, bundle.signature[1])),
+        "cascade": bundle.cascade,
+        "early_exit": early_exit,
+        "risk_table_built_at": MunicipalityRiskTable(SNAPSHOT_FILE, dsn=None).built_at,
+    })
+
+    print("=" * 80)
+    print("Bulk Scoring")
+    print("=" * 80)
+    print(f"Input: {input_path}")
+    print(f"Output: {output_dir}/")
+    print(f"Model version: {bundle.version}")
+    print(f"Workers: {workers}, chunk size: {chunk_rows:,} rows")
+    if bundle.cascade is not None:
+        print(f"Cascade: first {bundle.cascade['trees']} trees above confidence {bundle.cascade['threshold']:.3f}")
+    if early_exit:
+        print("Early exit: stop per row once the recommendation is decided")
+    print()
+
+    start = time.perf_counter()
+    # Chunks already scored at the start of the input are skipped without reading them
+    first_chunk = 0
+    while os.path.exists(part_path(output_dir, first_chunk)):
+        first_chunk += 1
+    scored_rows, skipped_chunks = 0, first_chunk
+    busy = {}  # pid -> [rows, seconds]
+    in_flight = set()
+
+    def collect(done):
+        nonlocal scored_rows
+        for future in done:
+            rows, seconds, pid = future.result()
+            scored_rows += rows
+            busy.setdefault(pid, [0, 0.0])
+            busy[pid][0] += rows
+            busy[pid][1] += seconds
+        elapsed = time.perf_counter() - start
+        print(f"  {scored_rows:,} rows scored ({scored_rows / elapsed:,.0f} rows/s)", flush=True)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(bundle.version, bundle.path, cascade, early_exit)) as pool:
+        for chunk, first_row, table in iter_chunks(input_path, chunk_rows, first_chunk):
+            output_file = part_path(output_dir, chunk)
+            if os.path.exists(output_file):
+                skipped_chunks += 1
+                continue
+            # Keep at most two chunks per worker in memory
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight.add(pool.submit(score_chunk, table, first_row, output_file))
+        if in_flight:
+            collect(wait(in_flight).done)
+
+    elapsed = time.perf_counter() - start
+    print()
+    if skipped_chunks:
+        print(f"Resumed: {skipped_chunks} chunks were already scored")
+    print(f"✅ Scored {scored_rows:,} rows in {elapsed:.1f}s ({scored_rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    for pid, (rows, seconds) in sorted(busy.items()):
+        print(f"   worker {pid}: {rows:,} rows, {rows / max(seconds, 1e-9):,.0f} rows/s per core")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Connection settings of the CBS database (cbs_kenmerken).
+
+Shared by the API (municipality_risk.py) and the offline extraction scripts,
+so neither depends on the other for where the database is. The scripts fall
+back to DEFAULT_DSN; the API only uses a database set in ML_CBS_DSN.
+"""
+import os
+from typing import Optional
+
+DEFAULT_DSN = 'dbname=schulden user=marc host=localhost'
+
+
+def cbs_dsn() -> str:
+    """DSN from ML_CBS_DSN, or DEFAULT_DSN."""
+    return os.getenv('ML_CBS_DSN', DEFAULT_DSN)
+
+
+def configured_dsn() -> Optional[str]:
+    """DSN from ML_CBS_DSN, None when it is not set."""
+    return os.getenv('ML_CBS_DSN') or None
@@ -0,0 +1,97 @@
+"""
+Streaming reads of cbs_kenmerken for the training data generators.
+
+pd.read_sql_query() holds the whole result set in memory twice: as psycopg2
+tuples and as object-dtype DataFrame columns of the long, repeated strings
+(thema, label, kenmerken_cat, schuldenaren). read_chunks() selects only the
+columns a caller needs through a server-side cursor and yields DataFrames
+of at most chunk_rows rows, with the strings as categoricals and the
+numbers as float64. Callers aggregate every chunk into GroupedSums, so peak
+memory depends on the chunk size and the number of gemeenten, not on how
+many rows (or years) the table holds.
+"""
+from collections import defaultdict
+from typing import Dict, Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 50_000
+
+# Numeric columns of cbs_kenmerken; DECIMAL is cast to float8 in the query so
+# psycopg2 returns floats instead of Decimal objects
+NUMERIC_COLUMNS = {
+    'aantal', 'percentage', 'ondergrens_aantal', 'bovengrens_aantal',
+    'ondergrens_percentage', 'bovengrens_percentage',
+}
+
+
+def read_chunks(conn, columns: Sequence[str], where: str, params=None,
+                chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    Yield the selected columns of the cbs_kenmerken rows matching `where`
+    in DataFrames of at most chunk_rows rows. `where` uses %s placeholders
+    for `params`. Runs in the connection's transaction.
+    """
+    select = ", ".join(f"{name}::float8" if name in NUMERIC_COLUMNS else name for name in columns)
+    # A named cursor lives on the server, the client only holds one chunk
+    with conn.cursor(name='cbs_kenmerken_chunks') as cursor:
+        cursor.itersize = chunk_rows
+        cursor.execute(f"SELECT {select} FROM cbs_kenmerken WHERE {where}", params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield to_frame(rows, columns)
+
+
+def to_frame(rows, columns: Sequence[str]) -> pd.DataFrame:
+    """DataFrame of fetched rows: numeric columns as float64 (NULL -> NaN), the rest as categoricals."""
+    data = {}
+    for name, values in zip(columns, zip(*rows)):
+        if name in NUMERIC_COLUMNS:
+            data[name] = np.array(values, dtype=np.float64)
+        else:
+            data[name] = pd.Categorical(values)
+    return pd.DataFrame(data, copy=False)
+
+
+class GroupedSums:
+    """
+    Sum and count per group of value columns, accumulated chunk by chunk.
+    Memory is bounded by the number of groups; like a pandas groupby, rows
+    with a missing key are left out and missing values are not counted.
+    """
+
+    def __init__(self, keys: Sequence[str], columns: Sequence[str]):
+        self.keys = list(keys)
+        self.columns = list(columns)
+        self._sums: Dict = defaultdict(lambda: np.zeros(len(self.columns)))
+        self._counts: Dict = defaultdict(lambda: np.zeros(len(self.columns), dtype=np.int64))
+
+    def add(self, frame: pd.DataFrame):
+        if frame.empty:
+            return
+        grouped = frame.groupby(self.keys, observed=True)[self.columns]
+        sums, counts = grouped.sum(), grouped.count()
+        for key, row_sums, row_counts in zip(sums.index, sums.to_numpy(), counts.to_numpy()):
+            self._sums[key] += row_sums
+            self._counts[key] += row_counts
+
+    def _frame(self, values: Dict) -> pd.DataFrame:
+        keys = sorted(values)
+        if len(self.keys) > 1:
+            index = pd.MultiIndex.from_tuples(keys, names=self.keys)
+        else:
+            index = pd.Index(keys, name=self.keys[0])
+        return pd.DataFrame(np.array([values[key] for key in keys]).reshape(len(keys), len(self.columns)),
+                            index=index, columns=self.columns)
+
+    def sum(self) -> pd.DataFrame:
+        """Sum per group (0 when a group has no values, like pandas)."""
+        return self._frame(self._sums)
+
+    def mean(self) -> pd.DataFrame:
+        """Mean per group (NaN when a group has no values)."""
+        counts = self._frame(self._counts)
+        return self.sum() / counts.where(counts > 0)
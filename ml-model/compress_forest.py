@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Compress the trained forest for serving.
+
+Orders the trees of debt_model_v2.joblib so that the first ones agree best
+with the whole forest, then tries every combination of tree count and depth
+cap (merging identical sibling leaves) and prints, per candidate, the node
+count, artifact size, load time, single-row p50/p99 latency and accuracy on
+the v2 test split. The chosen candidate is written as the flattened forest
+that the API and model_registry.py publish use.
+
+Usage:
+    python3 compress_forest.py                      # compare candidates
+    python3 compress_forest.py <trees> <max_depth>  # write that one (max_depth 0 = uncapped)
+"""
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import joblib
+from sklearn.model_selection import train_test_split
+
+from feature_pipeline import SOURCE_COLUMNS, encode_features
+from flat_forest import (
+    FlatForest, calibrate_cascade, compress_forest, evaluate_cascade, export_forest, order_trees, save_forest
+)
+from model_registry import FLAT_MODEL_DIR, LABEL_ENCODER_FILE, METADATA_FILE, MODEL_FILE, SCALER_FILE
+from training_store import load_training_data
+
+TREE_COUNTS = (25, 50, 100, 200)
+DEPTH_CAPS = (None, 12, 10)
+# Training rows used to order the trees
+ORDER_ROWS = 2000
+
+
+def artifact_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def measure(arrays, X_test, y_test, full_best):
+    """Save a candidate to a scratch directory and measure it."""
+    scratch = tempfile.mkdtemp()
+    try:
+        path = os.path.join(scratch, FLAT_MODEL_DIR)
+        save_forest(arrays, path)
+        size = artifact_bytes(path)
+
+        load_seconds = []
+        for _ in range(3):
+            start = time.perf_counter()
+            forest = FlatForest.load(path, mmap=False)
+            load_seconds.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    latencies = []
+    for i in range(min(len(X_test), 500)):
+        start = time.perf_counter()
+        forest.predict_proba(X_test[i:i + 1])
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    best = forest.predict_proba(X_test).argmax(axis=1)
+    return {
+        'trees': forest.n_trees,
+        'max_depth': forest.max_depth,
+        'nodes': len(arrays['feature']),
+        'bytes': size,
+        'load_ms': min(load_seconds) * 1000,
+        'p50_us': statistics.median(latencies) * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+        'test_accuracy': float((best == y_test).mean()),
+        'agreement': float((best == full_best).mean()),
+    }
+
+
+def main():
+    if len(sys.argv) not in (1, 3):
+        print(__doc__)
+        sys.exit(1)
+
+    model = joblib.load(MODEL_FILE)
+    scaler = joblib.load(SCALER_FILE)
+    label_encoder = joblib.load(LABEL_ENCODER_FILE)
+    arrays = export_forest(model, scaler)
+    full = FlatForest(arrays)
+
+    # Same data and split as train_model_v2.py
+    with open(METADATA_FILE, 'r') as f:
+        training_data = json.load(f).get('training_data') or {}
+    df = load_training_data(SOURCE_COLUMNS + ['recommendation'], training_data.get('filters'))
+    X = encode_features(df)
+    y = label_encoder.transform(df['recommendation'].values)
+    X_train, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    # The cascade calibration and report halves of the test split, as in train_model_v2.py
+    X_calib, X_report, y_calib, y_report = train_test_split(
+        X_test, y_test, test_size=0.5, random_state=42, stratify=y_test
+    )
+    full_best = full.predict_proba(X_test).argmax(axis=1)
+
+    print("🌲 Ordering trees by how well they approximate the full forest...")
+    order = order_trees(full, X_train[:ORDER_ROWS])
+    print()
+
+    if len(sys.argv) == 3:
+        trees, max_depth = int(sys.argv[1]), int(sys.argv[2]) or None
+        compressed = compress_forest(arrays, order[:trees], max_depth)
+        result = measure(compressed, X_test, y_test, full_best)
+        save_forest(compressed, FLAT_MODEL_DIR)
+
+        # The cascade was calibrated on the full forest's tree order: calibrate
+        # again on one half of the test split, report on the other
+        compressed_forest = FlatForest(compressed)
+        cascade, calibration_report = calibrate_cascade(compressed_forest, X_calib, y_calib)
+        report = evaluate_cascade(
+            compressed_forest, X_report, y_report, [(row['trees'], row['threshold']) for row in calibration_report[1:]]
+        )
+        if cascade:
+            cascade = next(row for row in report if row['trees'] == cascade['trees'])
+        with open(METADATA_FILE, 'r') as f:
+            metadata = json.load(f)
+        metadata['compression'] = result
+        metadata['cascade'] = dict(cascade, report=report, calibration_report=calibration_report) if cascade else None
+        with open(METADATA_FILE, 'w') as f:
+            json.dump(metadata, f, indent=2)
+
+        print(f"✅ Saved {FLAT_MODEL_DIR}/: {result['trees']} trees, depth {result['max_depth']}, "
+              f"{result['nodes']:,} nodes, {result['bytes'] / 1024:,.0f} KiB")
+        print(f"   Test accuracy {result['test_accuracy']*100:.2f}% "
+              f"({result['agreement']*100:.2f}% agreement with the full forest)")
+        if cascade:
+            print(f"   Cascade recalibrated: first {cascade['trees']} trees above confidence {cascade['threshold']:.3f}")
+        print("   Publish with: python3 model_registry.py publish")
+        return
+
+    print(f"{'trees':>5s} {'depth':>5s} {'nodes':>8s} {'KiB':>7s} {'load ms':>7s} "
+          f"{'p50 µs':>7s} {'p99 µs':>7s} {'accuracy':>8s} {'agree':>7s}")
+    for trees in TREE_COUNTS:
+        if trees > full.n_trees:
+            continue
+        for max_depth in DEPTH_CAPS:
+            row = measure(compress_forest(arrays, order[:trees], max_depth), X_test, y_test, full_best)
+            print(f"{row['trees']:5d} {row['max_depth']:5d} {row['nodes']:8,d} {row['bytes'] / 1024:7,.0f} "
+                  f"{row['load_ms']:7.1f} {row['p50_us']:7.0f} {row['p99_us']:7.0f} "
+                  f"{row['test_accuracy']*100:7.2f}% {row['agreement']*100:6.2f}%")
+    print()
+    print("Write a candidate with: python3 compress_forest.py <trees> <max_depth>  (max_depth 0 = uncapped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,166 +4,160 @@ Extract training data from CBS database for ML model.
 Creates synthetic training examples based on CBS characteristics data.
 """
 
-import psycopg2
 import pandas as pd
 import numpy as np
-from datetime import datetime
-
-# Connect to database
-conn = psycopg2.connect(
-    dbname="schulden",
-    user="marc",
-    host="localhost"
-)
-
-print("Extracting CBS kenmerken data for training...")
-
-# Query to get relevant characteristics that correlate with debt problems
-query = """
-SELECT
-    jaar,
-    gemeentecode,
-    gemeentenaam,
-    thema,
-    hoofdthema,
-    label,
-    kenmerken_cat,
-    aantal,
-    percentage,
-    schuldenaren
-FROM cbs_kenmerken
-WHERE jaar IN ('2023-01', '2024-01')
-    AND schuldenaren LIKE '%Met geregistreerde%'
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+from cbs_extract import GroupedSums, read_chunks
+from cbs_config import DEFAULT_DSN, cbs_dsn
+
+# Themes that predict debt success, and the risk feature of the three used per case
+KEY_THEMES = ['Inkomen en vermogen', 'Werk', 'Sociale zekerheid', 'Demografische kenmerken']
+THEME_RISKS = {
+    'Inkomen en vermogen': 'income_risk',
+    'Werk': 'unemployment_risk',
+    'Sociale zekerheid': 'social_benefit_risk',
+}
+
+# Only the columns and rows the features use; the rows are streamed in chunks
+CBS_COLUMNS = ['jaar', 'gemeentecode', 'gemeentenaam', 'thema', 'aantal', 'percentage']
+CBS_WHERE = """
+    jaar IN ('2023-01', '2024-01')
+    AND schuldenaren LIKE '%%Met geregistreerde%%'
     AND aantal IS NOT NULL
     AND percentage IS NOT NULL
-ORDER BY gemeentecode, thema, label;
+    AND thema = ANY(%s)
 """
 
-df = pd.read_sql_query(query, conn)
-print(f"Loaded {len(df)} CBS records")
-
-# Pivot data to create features per municipality
-print("Creating feature matrix...")
-
-# Focus on key themes that predict debt success
-key_features = df[df['thema'].isin([
-    'Inkomen en vermogen',
-    'Werk',
-    'Sociale zekerheid',
-    'Demografische kenmerken'
-])].copy()
-
-# Create aggregated features per municipality
-features = key_features.groupby(['gemeentecode', 'gemeentenaam', 'jaar']).agg({
-    'aantal': 'sum',
-    'percentage': 'mean'
-}).reset_index()
-
-features.rename(columns={
-    'aantal': 'total_debts',
-    'percentage': 'avg_percentage'
-}, inplace=True)
-
-# Add income features
-income_data = df[df['thema'] == 'Inkomen en vermogen'].groupby(['gemeentecode', 'jaar']).agg({
-    'percentage': 'mean'
-}).reset_index()
-income_data.rename(columns={'percentage': 'income_risk'}, inplace=True)
-
-features = features.merge(income_data, on=['gemeentecode', 'jaar'], how='left')
-
-# Add employment features
-work_data = df[df['thema'] == 'Werk'].groupby(['gemeentecode', 'jaar']).agg({
-    'percentage': 'mean'
-}).reset_index()
-work_data.rename(columns={'percentage': 'unemployment_risk'}, inplace=True)
-
-features = features.merge(work_data, on=['gemeentecode', 'jaar'], how='left')
-
-# Add social security features
-social_data = df[df['thema'] == 'Sociale zekerheid'].groupby(['gemeentecode', 'jaar']).agg({
-    'percentage': 'mean'
-}).reset_index()
-social_data.rename(columns={'percentage': 'social_benefit_risk'}, inplace=True)
-
-features = features.merge(social_data, on=['gemeentecode', 'jaar'], how='left')
-
-print(f"Created feature matrix with {len(features)} municipalities")
-
-# Generate synthetic training examples based on CBS patterns
-print("Generating synthetic training examples...")
-
-np.random.seed(42)
-training_data = []
-
-for _, row in features.iterrows():
-    gemeente = row['gemeentenaam']
-
-    # Generate multiple debt scenarios per municipality
-    for _ in range(10):
-        # Debt amount (skewed towards smaller amounts)
-        debt_amount = np.random.lognormal(mean=3, sigma=1.5)
-        debt_amount = max(10, min(10000, debt_amount))
-
-        # Income (lower income = higher risk)
-        base_income = 1500 if row['income_risk'] > 50 else 2500
-        income = max(800, np.random.normal(base_income, 500))
-
-        # Risk factors
-        has_benefits = np.random.random() < (row['social_benefit_risk'] / 100)
-        unemployed = np.random.random() < (row['unemployment_risk'] / 100)
-
-        # Calculate success probability based on characteristics
-        # Lower debt amount = higher success
-        # Higher income = higher success
-        # Benefits/unemployment = lower success
-
-        debt_to_income_ratio = debt_amount / income
-
-        success_score = 0.7  # Base success rate
-        success_score -= min(0.4, debt_to_income_ratio * 0.3)  # Debt burden impact
-        success_score -= 0.15 if has_benefits else 0
-        success_score -= 0.15 if unemployed else 0
-        success_score += 0.1 if debt_amount < 100 else 0
-        success_score = max(0.1, min(0.95, success_score))
-
-        # Determine recommended action based on success probability
-        if success_score > 0.7 and debt_amount < 500:
-            recommendation = 'FORGIVE'
-        elif success_score < 0.3 or debt_to_income_ratio > 1.0:
-            recommendation = 'REFER_TO_ASSISTANCE'
-        elif has_benefits or unemployed:
-            recommendation = 'PAYMENT_PLAN'
-        else:
-            recommendation = 'REMINDER'
-
-        training_data.append({
-            'debt_amount': round(debt_amount, 2),
-            'monthly_income': round(income, 2),
-            'has_social_benefits': has_benefits,
-            'is_unemployed': unemployed,
-            'debt_to_income_ratio': round(debt_to_income_ratio, 3),
-            'income_risk': row['income_risk'],
-            'unemployment_risk': row['unemployment_risk'],
-            'social_benefit_risk': row['social_benefit_risk'],
-            'municipality': gemeente,
-            'success_probability': round(success_score, 3),
-            'recommendation': recommendation
-        })
-
-training_df = pd.DataFrame(training_data)
-print(f"Generated {len(training_df)} training examples")
-
-# Show distribution
-print("\nRecommendation distribution:")
-print(training_df['recommendation'].value_counts())
-
-print("\nDebt amount statistics:")
-print(training_df['debt_amount'].describe())
-
-# Save training data
-output_file = 'training_data.csv'
-training_df.to_csv(output_file, index=False)
-print(f"\nTraining data saved to {output_file}")
-
-conn.close()
+
+def build_features(chunks) -> pd.DataFrame:
+    """Feature matrix per municipality and year, aggregated over chunks of CBS records."""
+    # Aggregated features per municipality
+    totals = GroupedSums(['gemeentecode', 'gemeentenaam', 'jaar'], ['aantal', 'percentage'])
+    # Income, employment and social security features
+    risks = {theme: GroupedSums(['gemeentecode', 'jaar'], ['percentage']) for theme in THEME_RISKS}
+
+    records = 0
+    for chunk in chunks:
+        chunk = chunk[chunk['thema'].isin(KEY_THEMES)]
+        records += len(chunk)
+        totals.add(chunk)
+        for theme, sums in risks.items():
+            sums.add(chunk[chunk['thema'] == theme])
+    print(f"Aggregated {records:,} CBS records")
+
+    features = pd.concat([totals.sum()['aantal'], totals.mean()['percentage']], axis=1).reset_index()
+    features.rename(columns={
+        'aantal': 'total_debts',
+        'percentage': 'avg_percentage'
+    }, inplace=True)
+
+    for theme, name in THEME_RISKS.items():
+        risk_data = risks[theme].mean().reset_index().rename(columns={'percentage': name})
+        features = features.merge(risk_data, on=['gemeentecode', 'jaar'], how='left')
+    return features
+
+
+def load_features(dsn: str = DEFAULT_DSN) -> pd.DataFrame:
+    """Stream the CBS records in chunks of CHUNK_ROWS rows into build_features()."""
+    if psycopg2 is None:
+        raise RuntimeError("psycopg2 is not installed")
+    conn = psycopg2.connect(dsn)
+    try:
+        return build_features(read_chunks(conn, CBS_COLUMNS, CBS_WHERE, (KEY_THEMES,)))
+    finally:
+        conn.close()
+
+
+def main():
+    print("Extracting CBS kenmerken data for training...")
+
+    # Pivot data to create features per municipality
+    print("Creating feature matrix...")
+    features = load_features(cbs_dsn())
+    print(f"Created feature matrix with {len(features)} municipalities")
+    print()
+
+    # Generate synthetic training examples based on CBS patterns
+    print("Generating synthetic training examples...")
+
+    np.random.seed(42)
+    training_data = []
+
+    for _, row in features.iterrows():
+        gemeente = row['gemeentenaam']
+
+        # Generate multiple debt scenarios per municipality
+        for _ in range(10):
+            # Debt amount (skewed towards smaller amounts)
+            debt_amount = np.random.lognormal(mean=3, sigma=1.5)
+            debt_amount = max(10, min(10000, debt_amount))
+
+            # Income (lower income = higher risk)
+            base_income = 1500 if row['income_risk'] > 50 else 2500
+            income = max(800, np.random.normal(base_income, 500))
+
+            # Risk factors
+            has_benefits = np.random.random() < (row['social_benefit_risk'] / 100)
+            unemployed = np.random.random() < (row['unemployment_risk'] / 100)
+
+            # Calculate success probability based on characteristics
+            # Lower debt amount = higher success
+            # Higher income = higher success
+            # Benefits/unemployment = lower success
+
+            debt_to_income_ratio = debt_amount / income
+
+            success_score = 0.7  # Base success rate
+            success_score -= min(0.4, debt_to_income_ratio * 0.3)  # Debt burden impact
+            success_score -= 0.15 if has_benefits else 0
+            success_score -= 0.15 if unemployed else 0
+            success_score += 0.1 if debt_amount < 100 else 0
+            success_score = max(0.1, min(0.95, success_score))
+
+            # Determine recommended action based on success probability
+            if success_score > 0.7 and debt_amount < 500:
+                recommendation = 'FORGIVE'
+            elif success_score < 0.3 or debt_to_income_ratio > 1.0:
+                recommendation = 'REFER_TO_ASSISTANCE'
+            elif has_benefits or unemployed:
+                recommendation = 'PAYMENT_PLAN'
+            else:
+                recommendation = 'REMINDER'
+
+            training_data.append({
+                'debt_amount': round(debt_amount, 2),
+                'monthly_income': round(income, 2),
+                'has_social_benefits': has_benefits,
+                'is_unemployed': unemployed,
+                'debt_to_income_ratio': round(debt_to_income_ratio, 3),
+                'income_risk': row['income_risk'],
+                'unemployment_risk': row['unemployment_risk'],
+                'social_benefit_risk': row['social_benefit_risk'],
+                'municipality': gemeente,
+                'success_probability': round(success_score, 3),
+                'recommendation': recommendation
+            })
+
+    training_df = pd.DataFrame(training_data)
+    print(f"Generated {len(training_df)} training examples")
+
+    # Show distribution
+    print("\nRecommendation distribution:")
+    print(training_df['recommendation'].value_counts())
+
+    print("\nDebt amount statistics:")
+    print(training_df['debt_amount'].describe())
+
+    # Save training data
+    output_file = 'training_data.csv'
+    training_df.to_csv(output_file, index=False)
+    print(f"\nTraining data saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,353 +1,485 @@
 """
 Enhanced Training Data Generator - Version 2
 Gebruikt meer CBS patronen voor realistischere synthetische data
+
+All cases are drawn at once as NumPy arrays; the success score and
+recommendation rules are array expressions, so ten million cases take
+seconds. Every gemeente has its own random stream derived from SEED and its
+gemeentecode, so blocks of gemeenten are generated on a process pool and
+every gemeente is written as its own file of the Parquet dataset
+training_data_v2/ (see training_store.py), byte-identical for any number of
+workers.
+
+Usage:
+    python3 extract_training_data_v2.py [cases_per_gemeente] [workers]   # default 15, all cores
 """
 
-import psycopg2
+import math
+import os
+import shutil
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict
+
 import pandas as pd
 import numpy as np
-from datetime import datetime
-
-# Database connection
-conn = psycopg2.connect(
-    dbname="schulden",
-    user="marc",
-    host="localhost"
-)
-
-print("=" * 80)
-print("Enhanced Training Data Generator - Version 2")
-print("=" * 80)
-print()
-
-# Query CBS data met meer detail
-query = """
-SELECT
-    jaar,
-    gemeentecode,
-    gemeentenaam,
-    thema,
-    hoofdthema,
-    label,
-    kenmerken_cat,
-    aantal,
-    percentage,
-    schuldenaren
-FROM cbs_kenmerken
-WHERE jaar IN ('2023-01', '2024-01')
-    AND schuldenaren LIKE '%Met geregistreerde%'
-    AND percentage IS NOT NULL
-"""
 
-print("📊 Loading CBS data...")
-df = pd.read_sql_query(query, conn)
-print(f"   Loaded {len(df):,} CBS records")
-print()
-
-# === STAP 1: Extract Gedetailleerde Patronen Per Gemeente ===
-print("🔍 Extracting detailed patterns per municipality...")
-
-gemeenten = df[['gemeentecode', 'gemeentenaam']].drop_duplicates()
-
-# Inkomen patronen
-print("   - Income patterns...")
-income_low = df[df['label'] == 'Laag huishoudinkomen'].groupby('gemeentecode')['percentage'].mean()
-
-# Werk patronen
-print("   - Employment patterns...")
-werkloosheid = df[df['label'] == 'Werkzoekende in huishouden'].groupby('gemeentecode')['percentage'].mean()
-flexwerk = df[df['label'] == 'Flexibel contract in huishouden'].groupby('gemeentecode')['percentage'].mean()
-zzp_laaginkomen = df[df['label'] == 'ZZP-er in huishouden en laag huishoudinkomen'].groupby('gemeentecode')['percentage'].mean()
-
-# Uitkeringen
-print("   - Benefit patterns...")
-bijstand = df[df['label'] == 'Bijstandsuitkering in huishouden'].groupby('gemeentecode')['percentage'].mean()
-ww = df[df['label'] == 'WW-uitkering in huishouden'].groupby('gemeentecode')['percentage'].mean()
-ao = df[df['label'] == 'AO- of ziektewetuitkering in huishouden'].groupby('gemeentecode')['percentage'].mean()
-
-# Huishouden kenmerken
-print("   - Household patterns...")
-eenouder = df[df['kenmerken_cat'] == '4 Eenouderhuishouden'].groupby('gemeentecode')['percentage'].mean()
-kinderen = df[df['label'] == 'Aantal kinderen in huishouden'].groupby('gemeentecode')['percentage'].mean()
-
-# Jeugdzorg (extra risicofactor)
-print("   - Youth care patterns...")
-jeugdzorg = df[df['label'] == 'Jeugdhulp, -bescherming en/of -reclassering in huishouden'].groupby('gemeentecode')['percentage'].mean()
-
-# Leeftijd patronen
-print("   - Age patterns...")
-leeftijd_data = df[df['label'] == 'Leeftijd geselecteerd huishoudlid'].copy()
-leeftijd_jong = leeftijd_data[leeftijd_data['kenmerken_cat'].str.contains('16 tot 25|25 tot 35', na=False)].groupby('gemeentecode')['percentage'].mean()
-leeftijd_mid = leeftijd_data[leeftijd_data['kenmerken_cat'].str.contains('35 tot 45|45 tot 55', na=False)].groupby('gemeentecode')['percentage'].mean()
-leeftijd_oud = leeftijd_data[leeftijd_data['kenmerken_cat'].str.contains('55 tot 65|65 jaar', na=False)].groupby('gemeentecode')['percentage'].mean()
-
-# Combine alle patronen
-features = pd.DataFrame({
-    'gemeentecode': gemeenten['gemeentecode'],
-    'gemeentenaam': gemeenten['gemeentenaam'],
-    'income_low_pct': gemeenten['gemeentecode'].map(income_low).fillna(30),
-    'werkloosheid_pct': gemeenten['gemeentecode'].map(werkloosheid).fillna(45),
-    'flexwerk_pct': gemeenten['gemeentecode'].map(flexwerk).fillna(45),
-    'zzp_laaginkomen_pct': gemeenten['gemeentecode'].map(zzp_laaginkomen).fillna(30),
-    'bijstand_pct': gemeenten['gemeentecode'].map(bijstand).fillna(45),
-    'ww_pct': gemeenten['gemeentecode'].map(ww).fillna(45),
-    'ao_pct': gemeenten['gemeentecode'].map(ao).fillna(45),
-    'eenouder_pct': gemeenten['gemeentecode'].map(eenouder).fillna(15),
-    'kinderen_pct': gemeenten['gemeentecode'].map(kinderen).fillna(25),
-    'jeugdzorg_pct': gemeenten['gemeentecode'].map(jeugdzorg).fillna(45),
-    'leeftijd_jong_pct': gemeenten['gemeentecode'].map(leeftijd_jong).fillna(20),
-    'leeftijd_mid_pct': gemeenten['gemeentecode'].map(leeftijd_mid).fillna(45),
-    'leeftijd_oud_pct': gemeenten['gemeentecode'].map(leeftijd_oud).fillna(35),
-})
-
-print(f"   Created {len(features)} municipality profiles")
-print()
-
-# === STAP 2: Genereer Realistischere Cases ===
-print("🎲 Generating realistic debt cases...")
-print()
-
-np.random.seed(42)
-training_data = []
+try:
+    import psycopg2
+except ImportError:  # generate_cases() does not need the database
+    psycopg2 = None
+
+from cbs_config import DEFAULT_DSN, cbs_dsn
+from cbs_extract import GroupedSums, read_chunks
+from training_store import TRAINING_DATA_DIR, publish_partition, staging_dir, write_gemeente
 
+SEED = 42
 # Meer cases per gemeente voor betere diversiteit
-cases_per_gemeente = 15
-
-for idx, row in features.iterrows():
-    if idx % 100 == 0:
-        print(f"   Processing gemeente {idx}/{len(features)}...")
-
-    gemeente = row['gemeentenaam']
-
-    for case_num in range(cases_per_gemeente):
-        # === Leeftijd (beïnvloedt inkomen en schuld) ===
-        # Normaliseer percentages zodat ze optellen tot 1
-        age_probs = np.array([
-            row['leeftijd_jong_pct'],
-            row['leeftijd_mid_pct'],
-            row['leeftijd_oud_pct']
-        ])
-        age_probs = age_probs / age_probs.sum()  # Normaliseer naar som=1
-
-        age_category = np.random.choice(
-            ['jong', 'mid', 'oud'],
-            p=age_probs
-        )
-
-        # === Schuldbedrag (realistischer verdeeld) ===
-        # Kleine schulden (< €100) komen het meest voor
-        # Grote schulden (> €1000) zijn zeldzaam
-        if np.random.random() < 0.60:  # 60% kleine schulden
-            debt_amount = np.random.lognormal(mean=2.5, sigma=0.8)  # €10-€150
-        elif np.random.random() < 0.30:  # 30% medium schulden
-            debt_amount = np.random.lognormal(mean=4.5, sigma=0.6)  # €150-€1000
-        else:  # 10% grote schulden
-            debt_amount = np.random.lognormal(mean=6.0, sigma=0.8)  # €1000-€5000
-
-        debt_amount = max(10, min(10000, debt_amount))
-
-        # === Inkomen (afhankelijk van leeftijd en gemeente) ===
-        base_income = 2200  # Modaal
-
-        # Leeftijd impact
-        if age_category == 'jong':
-            base_income *= 0.7  # Jonger = lager inkomen
-        elif age_category == 'oud':
-            base_income *= 0.85  # Pensioen = lager inkomen
-
-        # Gemeente risico impact
-        if row['income_low_pct'] > 35:
-            base_income *= 0.75  # Hoog risico gemeente
-        elif row['income_low_pct'] < 25:
-            base_income *= 1.15  # Laag risico gemeente
-
-        income = max(800, np.random.normal(base_income, 400))
-
-        # === Uitkering Type (meerdere types mogelijk) ===
-        has_bijstand = np.random.random() < (row['bijstand_pct'] / 100)
-        has_ww = np.random.random() < (row['ww_pct'] / 100)
-        has_ao = np.random.random() < (row['ao_pct'] / 100)
-
-        # Als uitkering, aanpassen inkomen
-        if has_bijstand:
-            income = min(income, 1300)  # Bijstandsniveau
-        elif has_ww:
-            income = min(income, 1800)  # WW niveau
-        elif has_ao:
-            income = min(income, 1600)  # AO niveau
-
-        has_social_benefits = has_bijstand or has_ww or has_ao
-
-        # === Werk Status ===
-        is_unemployed = has_ww or (np.random.random() < (row['werkloosheid_pct'] / 100))
-        has_flex_work = not is_unemployed and (np.random.random() < (row['flexwerk_pct'] / 100))
-        is_zzp = not is_unemployed and not has_flex_work and (np.random.random() < 0.15)
-
-        # === Huishouden Situatie ===
-        is_single_parent = np.random.random() < (row['eenouder_pct'] / 100)
-        has_children = is_single_parent or (np.random.random() < (row['kinderen_pct'] / 100))
-        num_children = np.random.choice([1, 2, 3], p=[0.5, 0.35, 0.15]) if has_children else 0
-
-        # === Extra Risicofactoren ===
-        has_jeugdzorg = has_children and (np.random.random() < (row['jeugdzorg_pct'] / 100))
-
-        # Aantal andere schulden (gecorreleerd met risicofactoren)
-        other_debts_prob = 0.2
-        if has_social_benefits:
-            other_debts_prob += 0.2
-        if is_unemployed:
-            other_debts_prob += 0.15
-        if has_jeugdzorg:
-            other_debts_prob += 0.15
-        if debt_amount > 500:
-            other_debts_prob += 0.1
-
-        other_debts_count = np.random.poisson(other_debts_prob * 3)
-        other_debts_count = min(5, other_debts_count)
-
-        # === Berekende Features ===
-        debt_to_income_ratio = debt_amount / income
-
-        # === Successkans Berekening (verfijnd) ===
-        success_score = 0.65  # Basis
-
-        # Schuld impact (niet-lineair)
-        if debt_amount < 50:
-            success_score += 0.15
-        elif debt_amount < 100:
-            success_score += 0.10
-        elif debt_amount > 1000:
-            success_score -= 0.20
-
-        # Schuld/inkomen ratio (sterke impact)
-        if debt_to_income_ratio < 0.05:
-            success_score += 0.15
-        elif debt_to_income_ratio < 0.20:
-            success_score += 0.05
-        elif debt_to_income_ratio > 1.0:
-            success_score -= 0.30
-        elif debt_to_income_ratio > 0.5:
-            success_score -= 0.15
-
-        # Sociale factoren
-        if has_bijstand:
-            success_score -= 0.18
-        if has_ww:
-            success_score -= 0.12
-        if has_ao:
-            success_score -= 0.15
-        if is_unemployed:
-            success_score -= 0.10
-
-        # Huishouden factoren
-        if is_single_parent:
-            success_score -= 0.12
-        if num_children >= 2:
-            success_score -= 0.08
-        if has_jeugdzorg:
-            success_score -= 0.15
-
-        # Werk factoren
-        if has_flex_work:
-            success_score -= 0.05  # Minder zekerheid
-        if is_zzp and debt_to_income_ratio > 0.3:
-            success_score -= 0.10  # ZZP met hoge schuld
-
-        # Meerdere schulden
-        success_score -= other_debts_count * 0.06
-
-        # Leeftijd
-        if age_category == 'jong':
-            success_score -= 0.05  # Jonger = meer risico
-        elif age_category == 'oud':
-            success_score += 0.05  # Ouder = stabieler
-
-        # Normaliseer
-        success_score = max(0.05, min(0.95, success_score))
-
-        # === Aanbeveling (verfijnd) ===
-        # Kwijtschelding: kleine schuld + goede kans
-        if debt_amount < 100 and success_score > 0.70:
-            recommendation = 'FORGIVE'
+CASES_PER_GEMEENTE = 15
+# Cases per shard, which bounds the memory of a worker
+SHARD_ROWS = 1_000_000
+JAREN = ['2023-01', '2024-01']
+# Partition of the training data the cases are written to
+PEILJAAR = max(JAREN)
+
+# One row per gemeente with the 14 percentages, aggregated in PostgreSQL
+# (database/cbs_gemeente_profielen.sql)
+PROFILE_QUERY = "SELECT * FROM cbs_gemeente_profielen(%s)"
+
+# Fallback for databases without that function: stream the rows and pivot in pandas
+CBS_COLUMNS = ['gemeentecode', 'gemeentenaam', 'label', 'kenmerken_cat', 'percentage']
+CBS_WHERE = """
+    jaar = ANY(%s)
+    AND schuldenaren LIKE '%%Met geregistreerde%%'
+    AND percentage IS NOT NULL
+"""
 
+# Profile percentage -> default when a gemeente has no figure for it
+PROFILE_DEFAULTS = {
+    'income_low_pct': 30,
+    'werkloosheid_pct': 45,
+    'flexwerk_pct': 45,
+    'zzp_laaginkomen_pct': 30,
+    'bijstand_pct': 45,
+    'ww_pct': 45,
+    'ao_pct': 45,
+    'eenouder_pct': 15,
+    'kinderen_pct': 25,
+    'jeugdzorg_pct': 45,
+    'leeftijd_jong_pct': 20,
+    'leeftijd_mid_pct': 45,
+    'leeftijd_oud_pct': 35,
+}
+
+# String columns are categoricals: one byte per case instead of a string
+AGE_CATEGORIES = ['jong', 'mid', 'oud']
+BENEFIT_TYPES = ['bijstand', 'ww', 'ao', 'none']
+# Lognormal schuldbedrag per klasse: klein, medium, groot
+DEBT_LOG_MEAN = np.array([2.5, 4.5, 6.0])
+DEBT_LOG_SIGMA = np.array([0.8, 0.6, 0.8])
+# In the order the rules are checked, the last one is the default
+RECOMMENDATIONS = ['FORGIVE', 'REFER_TO_ASSISTANCE', 'PAYMENT_PLAN', 'REMINDER']
+
+
+def load_profiles(dsn: str = DEFAULT_DSN) -> pd.DataFrame:
+    """
+    Municipality profiles from cbs_gemeente_profielen(), or pivoted from
+    the cbs_kenmerken rows with build_profiles() when the database does
+    not have that function yet.
+    """
+    if psycopg2 is None:
+        raise RuntimeError("psycopg2 is not installed")
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regprocedure('cbs_gemeente_profielen(text[])') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            profiles = pd.read_sql_query(PROFILE_QUERY, conn, params=(JAREN,))
+            print("   Aggregated in PostgreSQL by cbs_gemeente_profielen()")
+        else:
+            print("   ⚠️  cbs_gemeente_profielen() not found, pivoting the CBS rows in pandas")
+            print("      (install it with: psql -d schulden -f database/cbs_gemeente_profielen.sql)")
+            profiles = build_profiles(read_chunks(conn, CBS_COLUMNS, CBS_WHERE, (JAREN,)))
+    finally:
+        conn.close()
+    # Independent of the row order of the query
+    return profiles.sort_values(['gemeentecode', 'gemeentenaam']).reset_index(drop=True)
+
+
+def profile_masks(chunk: pd.DataFrame) -> Dict[str, pd.Series]:
+    """Rows of a chunk of CBS records that count towards each profile percentage."""
+    label = chunk['label']
+    kenmerken_cat = chunk['kenmerken_cat']
+    leeftijd = label == 'Leeftijd geselecteerd huishoudlid'
+    return {
+        # Inkomen patronen
+        'income_low_pct': label == 'Laag huishoudinkomen',
+        # Werk patronen
+        'werkloosheid_pct': label == 'Werkzoekende in huishouden',
+        'flexwerk_pct': label == 'Flexibel contract in huishouden',
+        'zzp_laaginkomen_pct': label == 'ZZP-er in huishouden en laag huishoudinkomen',
+        # Uitkeringen
+        'bijstand_pct': label == 'Bijstandsuitkering in huishouden',
+        'ww_pct': label == 'WW-uitkering in huishouden',
+        'ao_pct': label == 'AO- of ziektewetuitkering in huishouden',
+        # Huishouden kenmerken
+        'eenouder_pct': kenmerken_cat == '4 Eenouderhuishouden',
+        'kinderen_pct': label == 'Aantal kinderen in huishouden',
+        # Jeugdzorg (extra risicofactor)
+        'jeugdzorg_pct': label == 'Jeugdhulp, -bescherming en/of -reclassering in huishouden',
+        # Leeftijd patronen
+        'leeftijd_jong_pct': leeftijd & kenmerken_cat.str.contains('16 tot 25|25 tot 35', na=False),
+        'leeftijd_mid_pct': leeftijd & kenmerken_cat.str.contains('35 tot 45|45 tot 55', na=False),
+        'leeftijd_oud_pct': leeftijd & kenmerken_cat.str.contains('55 tot 65|65 jaar', na=False),
+    }
+
+
+def build_profiles(chunks) -> pd.DataFrame:
+    """
+    One row per gemeente with the CBS percentages the generator draws from,
+    averaged per gemeente over chunks of CBS records (see cbs_extract.py).
+    """
+    gemeenten = set()
+    sums = {name: GroupedSums(['gemeentecode'], ['percentage']) for name in PROFILE_DEFAULTS}
+    records = 0
+    for chunk in chunks:
+        records += len(chunk)
+        pairs = chunk[['gemeentecode', 'gemeentenaam']].dropna().drop_duplicates()
+        gemeenten.update(zip(pairs['gemeentecode'], pairs['gemeentenaam']))
+        for name, mask in profile_masks(chunk).items():
+            sums[name].add(chunk.loc[mask, ['gemeentecode', 'percentage']])
+    print(f"   Aggregated {records:,} CBS records")
+
+    # Combine alle patronen
+    profiles = pd.DataFrame(sorted(gemeenten), columns=['gemeentecode', 'gemeentenaam'])
+    for name, default in PROFILE_DEFAULTS.items():
+        profiles[name] = profiles['gemeentecode'].map(sums[name].mean()['percentage']).fillna(default)
+    return profiles
+
+
+def gemeente_rng(seed: int, gemeentecode: str, gemeentenaam: str) -> np.random.Generator:
+    """Independent stream for one gemeente, a child of the master seed keyed on the gemeente itself."""
+    key = f"{gemeentecode}|{gemeentenaam}".encode()
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(int.from_bytes(key, 'big'),)))
+
+
+class GemeenteStreams:
+    """
+    The numpy.random.Generator draws generate_cases() makes, taken from one
+    stream per profile row: the cases of a gemeente only depend on its own
+    stream, not on which other gemeenten are generated with it.
+    """
+
+    def __init__(self, profiles: pd.DataFrame, cases_per_gemeente: int, seed: int):
+        self.cases_per_gemeente = cases_per_gemeente
+        self.streams = [
+            gemeente_rng(seed, code, name)
+            for code, name in zip(profiles['gemeentecode'], profiles['gemeentenaam'])
+        ]
+
+    def _check(self, size: int):
+        if size != len(self.streams) * self.cases_per_gemeente:
+            raise ValueError(f"Expected {len(self.streams)} x {self.cases_per_gemeente} draws, got {size}")
+
+    def random(self, size: int) -> np.ndarray:
+        self._check(size)
+        return np.concatenate([stream.random(self.cases_per_gemeente) for stream in self.streams])
+
+    def standard_normal(self, size: int) -> np.ndarray:
+        self._check(size)
+        return np.concatenate([stream.standard_normal(self.cases_per_gemeente) for stream in self.streams])
+
+    def poisson(self, lam: np.ndarray) -> np.ndarray:
+        self._check(len(lam))
+        k = self.cases_per_gemeente
+        return np.concatenate([stream.poisson(lam[i * k:(i + 1) * k]) for i, stream in enumerate(self.streams)])
+
+
+def generate_cases(profiles: pd.DataFrame, cases_per_gemeente: int, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Draw cases_per_gemeente cases for every profile row, grouped by gemeente.
+    rng is a numpy.random.Generator or GemeenteStreams.
+    """
+    n = len(profiles) * cases_per_gemeente
+
+    def per_case(values):
+        # Per-gemeente figures are computed once and repeated for its cases
+        return np.repeat(np.asarray(values, dtype=np.float64), cases_per_gemeente)
+
+    # === Leeftijd (beïnvloedt inkomen en schuld) ===
+    # Inverse CDF over de genormaliseerde percentages
+    age_total = profiles['leeftijd_jong_pct'] + profiles['leeftijd_mid_pct'] + profiles['leeftijd_oud_pct']
+    u = rng.random(n)
+    age_index = (u >= per_case(profiles['leeftijd_jong_pct'] / age_total)).astype(np.int8)
+    age_index += u >= per_case((profiles['leeftijd_jong_pct'] + profiles['leeftijd_mid_pct']) / age_total)
+    is_jong = age_index == 0
+    is_oud = age_index == 2
+
+    # === Schuldbedrag (realistischer verdeeld) ===
+    # 60% klein (€10-€150); van de rest 30% medium (€150-€1000), anders groot (€1000-€5000)
+    small = rng.random(n) < 0.60
+    medium = ~small & (rng.random(n) < 0.30)
+    size = np.where(small, 0, np.where(medium, 1, 2))
+    debt_amount = np.exp(DEBT_LOG_MEAN[size] + DEBT_LOG_SIGMA[size] * rng.standard_normal(n))
+    debt_amount = np.clip(debt_amount, 10, 10000)
+
+    # === Inkomen (afhankelijk van leeftijd en gemeente) ===
+    income_low_pct = per_case(profiles['income_low_pct'])
+    base_income = np.full(n, 2200.0)  # Modaal
+    base_income[is_jong] *= 0.7   # Jonger = lager inkomen
+    base_income[is_oud] *= 0.85   # Pensioen = lager inkomen
+    base_income[income_low_pct > 35] *= 0.75  # Hoog risico gemeente
+    base_income[income_low_pct < 25] *= 1.15  # Laag risico gemeente
+    income = np.maximum(800, base_income + 400 * rng.standard_normal(n))
+
+    # === Uitkering Type (meerdere types mogelijk) ===
+    has_bijstand = rng.random(n) < per_case(profiles['bijstand_pct'] / 100)
+    has_ww = rng.random(n) < per_case(profiles['ww_pct'] / 100)
+    has_ao = rng.random(n) < per_case(profiles['ao_pct'] / 100)
+
+    # Als uitkering, aanpassen inkomen (bijstand > WW > AO)
+    benefit_cap = np.select([has_bijstand, has_ww, has_ao], [1300.0, 1800.0, 1600.0], np.inf)
+    income = np.minimum(income, benefit_cap)
+    has_social_benefits = has_bijstand | has_ww | has_ao
+
+    # === Werk Status ===
+    is_unemployed = has_ww | (rng.random(n) < per_case(profiles['werkloosheid_pct'] / 100))
+    has_flex_work = ~is_unemployed & (rng.random(n) < per_case(profiles['flexwerk_pct'] / 100))
+    is_zzp = ~is_unemployed & ~has_flex_work & (rng.random(n) < 0.15)
+
+    # === Huishouden Situatie ===
+    is_single_parent = rng.random(n) < per_case(profiles['eenouder_pct'] / 100)
+    has_children = is_single_parent | (rng.random(n) < per_case(profiles['kinderen_pct'] / 100))
+    # 1, 2 of 3 kinderen met kans 0.5 / 0.35 / 0.15
+    u = rng.random(n)
+    num_children = (1 + (u >= 0.5) + (u >= 0.85)) * has_children
+
+    # === Extra Risicofactoren ===
+    has_jeugdzorg = has_children & (rng.random(n) < per_case(profiles['jeugdzorg_pct'] / 100))
+
+    # Aantal andere schulden (gecorreleerd met risicofactoren)
+    other_debts_prob = (0.2 + 0.2 * has_social_benefits + 0.15 * is_unemployed
+                        + 0.15 * has_jeugdzorg + 0.1 * (debt_amount > 500))
+    other_debts_count = np.minimum(5, rng.poisson(other_debts_prob * 3))
+
+    # === Berekende Features ===
+    debt_to_income_ratio = debt_amount / income
+
+    # === Successkans Berekening (verfijnd) ===
+    success_score = np.full(n, 0.65)  # Basis
+
+    # Schuld impact (niet-lineair)
+    success_score += np.select([debt_amount < 50, debt_amount < 100, debt_amount > 1000], [0.15, 0.10, -0.20], 0.0)
+
+    # Schuld/inkomen ratio (sterke impact)
+    success_score += np.select(
+        [debt_to_income_ratio < 0.05, debt_to_income_ratio < 0.20, debt_to_income_ratio > 1.0, debt_to_income_ratio > 0.5],
+        [0.15, 0.05, -0.30, -0.15], 0.0,
+    )
+
+    # Sociale factoren
+    success_score -= 0.18 * has_bijstand
+    success_score -= 0.12 * has_ww
+    success_score -= 0.15 * has_ao
+    success_score -= 0.10 * is_unemployed
+
+    # Huishouden factoren
+    success_score -= 0.12 * is_single_parent
+    success_score -= 0.08 * (num_children >= 2)
+    success_score -= 0.15 * has_jeugdzorg
+
+    # Werk factoren
+    success_score -= 0.05 * has_flex_work  # Minder zekerheid
+    success_score -= 0.10 * (is_zzp & (debt_to_income_ratio > 0.3))  # ZZP met hoge schuld
+
+    # Meerdere schulden
+    success_score -= other_debts_count * 0.06
+
+    # Leeftijd
+    success_score -= 0.05 * is_jong  # Jonger = meer risico
+    success_score += 0.05 * is_oud   # Ouder = stabieler
+
+    # Normaliseer
+    success_score = np.clip(success_score, 0.05, 0.95)
+
+    # === Aanbeveling (verfijnd) ===
+    recommendation = np.select([
+        # Kwijtschelding: kleine schuld + goede kans
+        (debt_amount < 100) & (success_score > 0.70),
         # Doorverwijzing: complex of zeer lage kans
-        elif (success_score < 0.25 or
-              debt_to_income_ratio > 1.5 or
-              (has_jeugdzorg and debt_amount > 200) or
-              other_debts_count >= 3):
-            recommendation = 'REFER_TO_ASSISTANCE'
-
+        (success_score < 0.25) | (debt_to_income_ratio > 1.5)
+        | (has_jeugdzorg & (debt_amount > 200)) | (other_debts_count >= 3),
         # Betalingsregeling: kwetsbaar maar kansrijk
-        elif (has_social_benefits or
-              is_single_parent or
-              (0.3 < success_score < 0.70) or
-              (debt_to_income_ratio > 0.3 and success_score > 0.4)):
-            recommendation = 'PAYMENT_PLAN'
-
-        # Standaard invordering: stabiel en overzichtelijk
+        has_social_benefits | is_single_parent | ((success_score > 0.3) & (success_score < 0.70))
+        | ((debt_to_income_ratio > 0.3) & (success_score > 0.4)),
+    ], [0, 1, 2], 3)  # Standaard invordering: stabiel en overzichtelijk
+
+    municipality_codes, municipalities = pd.factorize(profiles['gemeentenaam'])
+    return pd.DataFrame({
+        'debt_amount': debt_amount.round(2),
+        'monthly_income': income.round(2),
+        'has_social_benefits': has_social_benefits,
+        'benefit_type': pd.Categorical.from_codes(np.select([has_bijstand, has_ww, has_ao], [0, 1, 2], 3), BENEFIT_TYPES),
+        'is_unemployed': is_unemployed,
+        'has_flex_work': has_flex_work,
+        'is_zzp': is_zzp,
+        'is_single_parent': is_single_parent,
+        'has_children': has_children,
+        'num_children': num_children,
+        'has_jeugdzorg': has_jeugdzorg,
+        'age_category': pd.Categorical.from_codes(age_index, AGE_CATEGORIES),
+        'debt_to_income_ratio': debt_to_income_ratio.round(3),
+        'other_debts_count': other_debts_count,
+        'income_risk': income_low_pct,
+        'unemployment_risk': per_case(profiles['werkloosheid_pct']),
+        'social_benefit_risk': per_case(profiles['bijstand_pct']),
+        'municipality': pd.Categorical.from_codes(np.repeat(municipality_codes, cases_per_gemeente), municipalities),
+        'success_probability': success_score.round(3),
+        'recommendation': pd.Categorical.from_codes(recommendation, RECOMMENDATIONS),
+    }, copy=False)  # the arrays are fresh, consolidating them into blocks would copy every column
+
+
+def generate_shard(profiles: pd.DataFrame, cases_per_gemeente: int, seed: int, partition: str) -> dict:
+    """
+    Generate the cases of a block of gemeenten, write one Parquet file per
+    gemeente into the partition directory and return the block's summary.
+    """
+    shard = generate_cases(profiles, cases_per_gemeente, GemeenteStreams(profiles, cases_per_gemeente, seed))
+    for index, (code, part) in enumerate(zip(profiles['gemeentecode'], profiles['part'])):
+        start = index * cases_per_gemeente
+        write_gemeente(shard.iloc[start:start + cases_per_gemeente], partition, code, part)
+    return summarize(shard)
+
+
+def summarize(training_df: pd.DataFrame) -> dict:
+    """Counts behind print_statistics(); summaries of shards add up with combine_summaries()."""
+    debt = training_df['debt_amount']
+    income = training_df['monthly_income']
+    success = training_df['success_probability']
+    return {
+        'cases': len(training_df),
+        'municipalities': set(training_df['municipality'].unique()),
+        'debt_lt_100': int((debt < 100).sum()),
+        'debt_100_500': int(((debt >= 100) & (debt < 500)).sum()),
+        'debt_500_1000': int(((debt >= 500) & (debt < 1000)).sum()),
+        'debt_ge_1000': int((debt >= 1000).sum()),
+        'income_lt_1500': int((income < 1500).sum()),
+        'income_1500_2500': int(((income >= 1500) & (income < 2500)).sum()),
+        'income_ge_2500': int((income >= 2500).sum()),
+        'has_social_benefits': int(training_df['has_social_benefits'].sum()),
+        'is_unemployed': int(training_df['is_unemployed'].sum()),
+        'is_single_parent': int(training_df['is_single_parent'].sum()),
+        'has_jeugdzorg': int(training_df['has_jeugdzorg'].sum()),
+        'recommendations': Counter({name: int(count) for name, count in training_df['recommendation'].value_counts().items() if count}),
+        'success_sum': float(success.sum()),
+        'success_min': float(success.min()),
+        'success_max': float(success.max()),
+    }
+
+
+def combine_summaries(summaries) -> dict:
+    combined = dict(summaries[0])
+    for summary in summaries[1:]:
+        for key, value in summary.items():
+            if key == 'municipalities':
+                combined[key] = combined[key] | value
+            elif key == 'success_min':
+                combined[key] = min(combined[key], value)
+            elif key == 'success_max':
+                combined[key] = max(combined[key], value)
+            else:
+                combined[key] = combined[key] + value
+    return combined
+
+
+def print_statistics(summary: dict):
+    cases = summary['cases']
+    print(f"\nDataset Statistics:")
+    print(f"  Total cases: {cases:,}")
+    print(f"  Municipalities: {len(summary['municipalities'])}")
+    print(f"\nDebt Amount Distribution:")
+    print(f"  < €100: {summary['debt_lt_100']:,} ({summary['debt_lt_100'] / cases*100:.1f}%)")
+    print(f"  €100-€500: {summary['debt_100_500']:,}")
+    print(f"  €500-€1000: {summary['debt_500_1000']:,}")
+    print(f"  > €1000: {summary['debt_ge_1000']:,}")
+    print(f"\nIncome Distribution:")
+    print(f"  < €1500: {summary['income_lt_1500']:,} ({summary['income_lt_1500'] / cases*100:.1f}%)")
+    print(f"  €1500-€2500: {summary['income_1500_2500']:,}")
+    print(f"  > €2500: {summary['income_ge_2500']:,}")
+    print(f"\nSocial Factors:")
+    print(f"  Has benefits: {summary['has_social_benefits']:,} ({summary['has_social_benefits'] / cases*100:.1f}%)")
+    print(f"  Unemployed: {summary['is_unemployed']:,} ({summary['is_unemployed'] / cases*100:.1f}%)")
+    print(f"  Single parent: {summary['is_single_parent']:,} ({summary['is_single_parent'] / cases*100:.1f}%)")
+    print(f"  Has jeugdzorg: {summary['has_jeugdzorg']:,} ({summary['has_jeugdzorg'] / cases*100:.1f}%)")
+    print(f"\nRecommendation Distribution:")
+    for recommendation, count in summary['recommendations'].most_common():
+        print(f"  {recommendation}: {count:,} ({count / cases*100:.1f}%)")
+    print(f"\nSuccess Probability:")
+    print(f"  mean {summary['success_sum'] / cases:.3f}, min {summary['success_min']:.3f}, max {summary['success_max']:.3f}")
+
+
+def main():
+    if len(sys.argv) > 3:
+        print(__doc__)
+        sys.exit(1)
+    cases_per_gemeente = int(sys.argv[1]) if len(sys.argv) > 1 else CASES_PER_GEMEENTE
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    print("=" * 80)
+    print("Enhanced Training Data Generator - Version 2")
+    print("=" * 80)
+    print()
+
+    # === STAP 1: Extract Gedetailleerde Patronen Per Gemeente ===
+    print("🔍 Loading detailed CBS patterns per municipality...")
+    profiles = load_profiles(cbs_dsn())
+    print(f"   Created {len(profiles)} municipality profiles")
+    print()
+
+    # === STAP 2: Genereer Realistischere Cases ===
+    # File number per gemeentecode, so both names of a code get their own file
+    profiles['part'] = profiles.groupby('gemeentecode').cumcount()
+    # Contiguous blocks of gemeenten, generated into a staging copy of the
+    # partition: at least one block per worker, at most SHARD_ROWS cases each
+    per_shard = max(1, min(SHARD_ROWS // cases_per_gemeente, math.ceil(len(profiles) / max(1, workers))))
+    blocks = [profiles.iloc[i:i + per_shard] for i in range(0, len(profiles), per_shard)]
+    print(f"🎲 Generating {cases_per_gemeente:,} debt cases per municipality "
+          f"({len(blocks)} shards, {workers} workers)...")
+    start = time.perf_counter()
+    staging = staging_dir(TRAINING_DATA_DIR, PEILJAAR)
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                summaries = list(pool.map(
+                    generate_shard, blocks, repeat(cases_per_gemeente), repeat(SEED), repeat(staging)
+                ))
         else:
-            recommendation = 'REMINDER'
-
-        # === Opslaan ===
-        training_data.append({
-            'debt_amount': round(debt_amount, 2),
-            'monthly_income': round(income, 2),
-            'has_social_benefits': has_social_benefits,
-            'benefit_type': 'bijstand' if has_bijstand else ('ww' if has_ww else ('ao' if has_ao else 'none')),
-            'is_unemployed': is_unemployed,
-            'has_flex_work': has_flex_work,
-            'is_zzp': is_zzp,
-            'is_single_parent': is_single_parent,
-            'has_children': has_children,
-            'num_children': num_children,
-            'has_jeugdzorg': has_jeugdzorg,
-            'age_category': age_category,
-            'debt_to_income_ratio': round(debt_to_income_ratio, 3),
-            'other_debts_count': other_debts_count,
-            'income_risk': row['income_low_pct'],
-            'unemployment_risk': row['werkloosheid_pct'],
-            'social_benefit_risk': row['bijstand_pct'],
-            'municipality': gemeente,
-            'success_probability': round(success_score, 3),
-            'recommendation': recommendation
-        })
-
-print(f"   Generated {len(training_data):,} training examples")
-print()
-
-# === STAP 3: Analyse en Opslaan ===
-print("📈 Analyzing generated data...")
-training_df = pd.DataFrame(training_data)
-
-print(f"\nDataset Statistics:")
-print(f"  Total cases: {len(training_df):,}")
-print(f"  Municipalities: {training_df['municipality'].nunique()}")
-print(f"\nDebt Amount Distribution:")
-print(f"  < €100: {(training_df['debt_amount'] < 100).sum():,} ({(training_df['debt_amount'] < 100).mean()*100:.1f}%)")
-print(f"  €100-€500: {((training_df['debt_amount'] >= 100) & (training_df['debt_amount'] < 500)).sum():,}")
-print(f"  €500-€1000: {((training_df['debt_amount'] >= 500) & (training_df['debt_amount'] < 1000)).sum():,}")
-print(f"  > €1000: {(training_df['debt_amount'] >= 1000).sum():,}")
-print(f"\nIncome Distribution:")
-print(f"  < €1500: {(training_df['monthly_income'] < 1500).sum():,} ({(training_df['monthly_income'] < 1500).mean()*100:.1f}%)")
-print(f"  €1500-€2500: {((training_df['monthly_income'] >= 1500) & (training_df['monthly_income'] < 2500)).sum():,}")
-print(f"  > €2500: {(training_df['monthly_income'] >= 2500).sum():,}")
-print(f"\nSocial Factors:")
-print(f"  Has benefits: {training_df['has_social_benefits'].sum():,} ({training_df['has_social_benefits'].mean()*100:.1f}%)")
-print(f"  Unemployed: {training_df['is_unemployed'].sum():,} ({training_df['is_unemployed'].mean()*100:.1f}%)")
-print(f"  Single parent: {training_df['is_single_parent'].sum():,} ({training_df['is_single_parent'].mean()*100:.1f}%)")
-print(f"  Has jeugdzorg: {training_df['has_jeugdzorg'].sum():,} ({training_df['has_jeugdzorg'].mean()*100:.1f}%)")
-print(f"\nRecommendation Distribution:")
-print(training_df['recommendation'].value_counts())
-print(f"\nSuccess Probability:")
-print(training_df['success_probability'].describe())
-
-# Opslaan
-output_file = 'training_data_v2.csv'
-training_df.to_csv(output_file, index=False)
-print(f"\n✅ Saved to: {output_file}")
-print()
-print("=" * 80)
-print("Klaar! Run nu: python3 train_model_v2.py")
-print("=" * 80)
-
-conn.close()
+            summaries = [generate_shard(block, cases_per_gemeente, SEED, staging) for block in blocks]
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    summary = combine_summaries(summaries)
+    seconds = time.perf_counter() - start
+    print(f"   Generated {summary['cases']:,} training examples in {seconds:.1f}s "
+          f"({summary['cases'] / seconds:,.0f} rows/s)")
+    publish_partition(TRAINING_DATA_DIR, PEILJAAR)
+    print()
+
+    # === STAP 3: Analyse en Opslaan ===
+    print("📈 Analyzing generated data...")
+    print_statistics(summary)
+
+    print(f"\n✅ Saved to: {TRAINING_DATA_DIR}/jaar={PEILJAAR}/")
+    print()
+    print("=" * 80)
+    print("Klaar! Run nu: python3 train_model_v2.py")
+    print("=" * 80)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Feature pipeline for the V2 model, shared by training and all scoring paths.
+
+Everything works on whole columns (NumPy arrays or pandas Series):
+
+- request_columns(): PredictionRequest fields -> the training data schema
+  (benefit flags, benefit_type and the CBS risk percentages of the gemeente,
+  or estimates when the gemeente is unknown)
+- encode_features(): training data schema -> the (N, 20) feature matrix in
+  FEATURE_NAMES order (age and benefit type one-hots)
+
+derive_feature_matrix() chains both for request columns. Request columns
+carry income_source and age_category as codes into INCOME_SOURCES and
+AGE_CATEGORIES; arrow_to_columns() builds them from an Arrow table.
+
+Run this file to check the pipeline against feature_names_v2.json and
+against a row-by-row reference implementation:
+    python3 feature_pipeline.py
+"""
+import json
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:  # only needed for arrow_to_columns()
+    pa = None
+
+# Model input order; must match feature_names_v2.json of the served model
+FEATURE_NAMES = [
+    'debt_amount',
+    'monthly_income',
+    'has_social_benefits',
+    'is_unemployed',
+    'has_flex_work',
+    'is_zzp',
+    'is_single_parent',
+    'has_children',
+    'num_children',
+    'has_jeugdzorg',
+    'debt_to_income_ratio',
+    'other_debts_count',
+    'income_risk',
+    'unemployment_risk',
+    'social_benefit_risk',
+    'age_jong',
+    'age_oud',
+    'benefit_bijstand',
+    'benefit_ww',
+    'benefit_ao',
+]
+# Columns taken as-is from the training data schema
+BASE_FEATURES = FEATURE_NAMES[:15]
+# Training data columns encode_features() reads: the one-hots come from two categories
+SOURCE_COLUMNS = BASE_FEATURES + ['age_category', 'benefit_type']
+
+# Category codes of the request columns (same order as model_api.IncomeSource)
+INCOME_SOURCES = [
+    "BENEFIT_SOCIAL",
+    "BENEFIT_UNEMPLOYMENT",
+    "BENEFIT_DISABILITY",
+    "EMPLOYMENT",
+    "SELF_EMPLOYED",
+    "PENSION",
+    "OTHER",
+]
+AGE_CATEGORIES = ["jong", "mid", "oud"]
+BENEFIT_TYPES = ["none", "bijstand", "ww", "ao"]
+
+_BENEFIT_SOCIAL = INCOME_SOURCES.index("BENEFIT_SOCIAL")
+_BENEFIT_UNEMPLOYMENT = INCOME_SOURCES.index("BENEFIT_UNEMPLOYMENT")
+_BENEFIT_DISABILITY = INCOME_SOURCES.index("BENEFIT_DISABILITY")
+_SELF_EMPLOYED = INCOME_SOURCES.index("SELF_EMPLOYED")
+_AGE_NAMES = np.array(AGE_CATEGORIES)
+_BENEFIT_NAMES = np.array(BENEFIT_TYPES)
+
+# Request columns with their default when absent (None = required)
+REQUEST_COLUMNS = {
+    'debt_amount': None,
+    'monthly_income': None,
+    'income_source': None,
+    'has_children': False,
+    'num_children': 0,
+    'is_single_parent': False,
+    'has_jeugdzorg': False,
+    'other_debts_count': 0,
+    'age_category': "mid",
+}
+REQUEST_ERRORS = [
+    "debt_amount must be > 0",
+    "monthly_income must be > 0",
+    "unknown income_source",
+    "num_children must be >= 0",
+    "other_debts_count must be >= 0",
+]
+
+
+def encode_features(frame) -> np.ndarray:
+    """
+    Build the (N, 20) feature matrix from columns in the training data
+    schema: the 15 BASE_FEATURES plus 'age_category' (jong/mid/oud) and
+    'benefit_type' (none/bijstand/ww/ao) as strings.
+    """
+    age_category = np.asarray(frame['age_category'])
+    benefit_type = np.asarray(frame['benefit_type'])
+    matrix = np.empty((len(age_category), len(FEATURE_NAMES)))
+    for index, name in enumerate(BASE_FEATURES):
+        matrix[:, index] = frame[name]
+    matrix[:, 15] = age_category == 'jong'
+    matrix[:, 16] = age_category == 'oud'
+    matrix[:, 17] = benefit_type == 'bijstand'
+    matrix[:, 18] = benefit_type == 'ww'
+    matrix[:, 19] = benefit_type == 'ao'
+    return matrix
+
+
+def request_columns(columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Map request columns to the training data schema.
+
+    The request only has the income source, so the work and benefit flags
+    follow from it. The CBS risk percentages come from the optional
+    'municipality_risk' column ((N, 3) in municipality_risk.RISK_FEATURES
+    order, NaN rows where the gemeente is unknown) and are otherwise
+    estimated from the income source and the debt burden.
+    """
+    debt_amount = np.asarray(columns['debt_amount'], dtype=np.float64)
+    monthly_income = np.asarray(columns['monthly_income'], dtype=np.float64)
+    income_source = np.asarray(columns['income_source'])
+    other_debts_count = np.asarray(columns['other_debts_count'], dtype=np.float64)
+
+    debt_to_income_ratio = debt_amount / monthly_income
+
+    bijstand = income_source == _BENEFIT_SOCIAL
+    ww = income_source == _BENEFIT_UNEMPLOYMENT
+    ao = income_source == _BENEFIT_DISABILITY
+    self_employed = income_source == _SELF_EMPLOYED
+    has_social_benefits = bijstand | ww | ao
+
+    # CBS risk estimates by income source, raised (up to 95) for a debt
+    # burden above half the monthly income and for more than two other debts
+    many_debts = other_debts_count > 2
+    income_risk = np.minimum(95.0, 30.0 + 45.0 * has_social_benefits
+                             + 20.0 * (debt_to_income_ratio > 0.5) + 10.0 * many_debts)
+    social_benefit_risk = np.minimum(95.0, 20.0 + 60.0 * has_social_benefits + 10.0 * many_debts)
+    unemployment_risk = 15.0 + 70.0 * ww
+
+    # The gemeente's own CBS percentages, as in the training data, where known
+    municipality_risk = columns.get('municipality_risk')
+    if municipality_risk is not None:
+        known = ~np.isnan(municipality_risk[:, 0])
+        income_risk = np.where(known, municipality_risk[:, 0], income_risk)
+        unemployment_risk = np.where(known, municipality_risk[:, 1], unemployment_risk)
+        social_benefit_risk = np.where(known, municipality_risk[:, 2], social_benefit_risk)
+
+    return {
+        'debt_amount': debt_amount,
+        'monthly_income': monthly_income,
+        'has_social_benefits': has_social_benefits,
+        'is_unemployed': ww,
+        'has_flex_work': self_employed,
+        'is_zzp': self_employed,
+        'is_single_parent': columns['is_single_parent'],
+        'has_children': columns['has_children'],
+        'num_children': columns['num_children'],
+        'has_jeugdzorg': columns['has_jeugdzorg'],
+        'debt_to_income_ratio': debt_to_income_ratio,
+        'other_debts_count': other_debts_count,
+        'income_risk': income_risk,
+        'unemployment_risk': unemployment_risk,
+        'social_benefit_risk': social_benefit_risk,
+        'age_category': _AGE_NAMES[columns['age_category']],
+        'benefit_type': _BENEFIT_NAMES[bijstand + 2 * ww + 3 * ao],
+    }
+
+
+def derive_feature_matrix(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Request columns -> (N, 20) feature matrix in FEATURE_NAMES order."""
+    return encode_features(request_columns(columns))
+
+
+def validate_columns(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """Per-row error code into REQUEST_ERRORS, -1 for valid rows (first failing rule wins)."""
+    checks = [
+        ~(columns['debt_amount'] > 0),
+        ~(columns['monthly_income'] > 0),
+        columns['income_source'] < 0,
+        columns['num_children'] < 0,
+        columns['other_debts_count'] < 0,
+    ]
+    error = np.full(len(columns['debt_amount']), -1, dtype=np.int8)
+    for code in reversed(range(len(checks))):
+        error[checks[code]] = code
+    return error
+
+
+def arrow_dictionary(column):
+    """Distinct values (plus None for nulls, last) and per-row indices of a string column."""
+    array = column.combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        array = array.cast(pa.string())
+    encoded = array.dictionary_encode()
+    values = encoded.dictionary.to_pylist() + [None]
+    indices = encoded.indices.fill_null(len(values) - 1).to_numpy(zero_copy_only=False)
+    return values, indices
+
+
+def arrow_codes(column, categories: List[str], default: int) -> np.ndarray:
+    """
+    Map a string column to category codes via its dictionary, not per row.
+    Nulls and values outside categories get `default`.
+    """
+    values, indices = arrow_dictionary(column)
+    lookup = np.array(
+        [categories.index(v) if v in categories else default for v in values[:-1]] + [default],
+        dtype=np.int64
+    )
+    return lookup[indices]
+
+
+def arrow_to_columns(table, risk_table=None) -> Dict[str, np.ndarray]:
+    """
+    Convert an Arrow table with the PredictionRequest fields to request
+    columns. With a MunicipalityRiskTable, an optional 'gemeentecode' column
+    is looked up once per distinct code into 'municipality_risk'.
+    """
+    n = table.num_rows
+    columns = {}
+    for name, default in REQUEST_COLUMNS.items():
+        if name not in table.column_names:
+            if default is None:
+                raise ValueError(f"Missing required column: {name}")
+            if name == 'age_category':
+                columns[name] = np.full(n, AGE_CATEGORIES.index(default))
+            else:
+                columns[name] = np.full(n, default, dtype=np.float64)
+            continue
+
+        column = table.column(name)
+        if name == 'income_source':
+            # Unknown or missing: -1, rejected by validate_columns()
+            columns[name] = arrow_codes(column, INCOME_SOURCES, -1)
+        elif name == 'age_category':
+            # Anything other than jong/oud counts as "mid", as in /predict
+            columns[name] = arrow_codes(column, AGE_CATEGORIES, AGE_CATEGORIES.index("mid"))
+        else:
+            fill = np.nan if default is None else default
+            columns[name] = column.cast(pa.float64()).fill_null(fill).to_numpy()
+
+    if risk_table is not None and 'gemeentecode' in table.column_names:
+        codes, indices = arrow_dictionary(table.column('gemeentecode'))
+        columns['municipality_risk'] = risk_table.lookup(codes)[indices]
+    return columns
+
+
+# === Parity check ===
+
+def reference_row(fields: dict) -> list:
+    """Row-by-row derivation as the API did it per request, used by check()."""
+    source = fields['income_source']
+    ratio = fields['debt_amount'] / fields['monthly_income']
+    benefits = source in ("BENEFIT_SOCIAL", "BENEFIT_UNEMPLOYMENT", "BENEFIT_DISABILITY")
+    unemployed = source == "BENEFIT_UNEMPLOYMENT"
+    income_risk, social_benefit_risk = (75.0, 80.0) if benefits else (30.0, 20.0)
+    unemployment_risk = 85.0 if unemployed else 15.0
+    if ratio > 0.5:
+        income_risk = min(95.0, income_risk + 20)
+    if fields['other_debts_count'] > 2:
+        income_risk = min(95.0, income_risk + 10)
+        social_benefit_risk = min(95.0, social_benefit_risk + 10)
+    return [
+        fields['debt_amount'], fields['monthly_income'], benefits, unemployed,
+        source == "SELF_EMPLOYED", source == "SELF_EMPLOYED",
+        fields['is_single_parent'], fields['has_children'], fields['num_children'],
+        fields['has_jeugdzorg'], ratio, fields['other_debts_count'],
+        income_risk, unemployment_risk, social_benefit_risk,
+        fields['age_category'] == "jong", fields['age_category'] == "oud",
+        source == "BENEFIT_SOCIAL", unemployed, source == "BENEFIT_DISABILITY",
+    ]
+
+
+def check(feature_names_path: str = 'feature_names_v2.json', n: int = 5000) -> bool:
+    """Compare FEATURE_NAMES with the trained model and the pipeline with reference_row()."""
+    ok = True
+    with open(feature_names_path, 'r') as f:
+        trained_names = json.load(f)
+    if trained_names != FEATURE_NAMES:
+        print(f"❌ {feature_names_path} does not match FEATURE_NAMES")
+        ok = False
+    else:
+        print(f"✅ FEATURE_NAMES matches {feature_names_path} ({len(FEATURE_NAMES)} features)")
+
+    rng = np.random.default_rng(0)
+    columns = {
+        'debt_amount': rng.uniform(1, 5000, n).round(2),
+        'monthly_income': rng.uniform(500, 4000, n).round(2),
+        'income_source': rng.integers(0, len(INCOME_SOURCES), n),
+        'has_children': rng.random(n) < 0.5,
+        'num_children': rng.integers(0, 4, n),
+        'is_single_parent': rng.random(n) < 0.2,
+        'has_jeugdzorg': rng.random(n) < 0.1,
+        'other_debts_count': rng.integers(0, 6, n),
+        'age_category': rng.integers(0, len(AGE_CATEGORIES), n),
+    }
+    matrix = derive_feature_matrix(columns)
+    reference = np.array([
+        reference_row({
+            **{name: values[i].item() for name, values in columns.items()},
+            'income_source': INCOME_SOURCES[columns['income_source'][i]],
+            'age_category': AGE_CATEGORIES[columns['age_category'][i]],
+        })
+        for i in range(n)
+    ], dtype=np.float64)
+    mismatches = int((matrix != reference).any(axis=1).sum())
+    if mismatches:
+        print(f"❌ {mismatches:,} of {n:,} rows differ from the row-by-row derivation")
+        ok = False
+    else:
+        print(f"✅ Vectorized derivation matches the row-by-row derivation on {n:,} rows")
+
+    if pa is not None:
+        ok = check_arrow(columns, rng) and ok
+    return ok
+
+
+def check_arrow(columns: Dict[str, np.ndarray], rng: np.random.Generator) -> bool:
+    """
+    The Arrow path (arrow_to_columns) against reference_row(), with unknown
+    and missing age categories and missing optional values: unknown ages
+    count as "mid", nulls get the REQUEST_COLUMNS default.
+    """
+    n = len(columns['debt_amount'])
+    ages = AGE_CATEGORIES + ["young", "MID", None]
+    age_values = [ages[i] for i in rng.integers(0, len(ages), n)]
+    nullable = {name: rng.random(n) < 0.1 for name in ('num_children', 'has_jeugdzorg', 'other_debts_count')}
+    table = pa.table({
+        **{name: pa.array(values, mask=nullable.get(name)) for name, values in columns.items()
+           if name not in ('income_source', 'age_category')},
+        'income_source': [INCOME_SOURCES[code] for code in columns['income_source']],
+        'age_category': age_values,
+    })
+    matrix = derive_feature_matrix(arrow_to_columns(table))
+    reference = np.array([
+        reference_row({
+            **{name: (REQUEST_COLUMNS[name] if name in nullable and nullable[name][i] else values[i].item())
+               for name, values in columns.items()},
+            'income_source': INCOME_SOURCES[columns['income_source'][i]],
+            'age_category': age_values[i],
+        })
+        for i in range(n)
+    ], dtype=np.float64)
+    mismatches = int((matrix != reference).any(axis=1).sum())
+    if mismatches:
+        print(f"❌ {mismatches:,} of {n:,} Arrow rows (unknown/missing values) differ from the row-by-row derivation")
+        return False
+    print(f"✅ Arrow derivation matches the row-by-row derivation on {n:,} rows with unknown/missing values")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check(*sys.argv[1:2]) else 1)
@@ -0,0 +1,577 @@
+"""
+Flattened Random Forest inference engine.
+
+Exports a fitted RandomForestClassifier into a handful of contiguous NumPy
+arrays and evaluates it without going through sklearn's estimator API.
+The StandardScaler is folded into the split thresholds, so raw (unscaled)
+feature rows can be scored directly.
+"""
+
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# Array names stored in the exported artifact
+ARRAY_KEYS = ('feature', 'threshold', 'children', 'value', 'roots', 'delta', 'parent_feature')
+
+
+def fold_thresholds(threshold, mean, scale):
+    """
+    Map split thresholds from scaled space back to raw feature space.
+
+    Algebraically (x - mean) / scale <= t  is  x <= t * scale + mean, but
+    sklearn compares the scaled value after rounding it to float32. To send
+    every row down the same branch as sklearn, this returns for every split
+    the largest float64 x that still goes left, found by bisection around
+    t * scale + mean.
+    """
+    threshold = np.asarray(threshold, dtype=np.float64)
+
+    def goes_left(x):
+        return ((x - mean) / scale).astype(np.float32) <= threshold
+
+    guess = threshold * scale + mean
+    width = (np.abs(guess) + scale) * 1e-6
+    lo, hi = guess - width, guess + width
+    # Widen until lo goes left and hi goes right
+    for _ in range(64):
+        bad_lo = ~goes_left(lo)
+        bad_hi = goes_left(hi)
+        if not (bad_lo.any() or bad_hi.any()):
+            break
+        width = width * 2
+        lo = np.where(bad_lo, guess - width, lo)
+        hi = np.where(bad_hi, guess + width, hi)
+
+    for _ in range(128):
+        mid = lo + (hi - lo) / 2
+        left = goes_left(mid)
+        lo = np.where(left, mid, lo)
+        hi = np.where(left, hi, mid)
+    return lo
+
+
+def export_forest(model, scaler=None):
+    """
+    Flatten a fitted RandomForestClassifier into contiguous arrays.
+
+    All trees are concatenated into one node table. children[node] holds the
+    global (left, right) child indices, and leaves point to themselves so
+    evaluation can run a fixed number of steps without branching. Index
+    arrays are stored as int64 so they can be used for gathers as-is. Leaf
+    values are stored as per-tree class probabilities, which is what
+    predict_proba averages.
+
+    If a fitted StandardScaler is given, it is folded into the thresholds
+    (see fold_thresholds), so rows are scored without scaling them first.
+
+    The per-node contribution arrays of path_deltas() are added as well.
+
+    Returns:
+        Dict with the arrays in ARRAY_KEYS plus 'max_depth'.
+    """
+    features, thresholds, children, values, roots = [], [], [], [], []
+    offset = 0
+    max_depth = 0
+
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        is_leaf = tree.children_left == -1
+        own_index = np.arange(n_nodes) + offset
+
+        feature = np.where(is_leaf, 0, tree.feature).astype(np.int64)
+        threshold = tree.threshold.astype(np.float64)
+        if scaler is not None:
+            threshold = np.where(
+                is_leaf, 0.0,
+                fold_thresholds(threshold, scaler.mean_[feature], scaler.scale_[feature])
+            )
+
+        value = tree.value[:, 0, :].astype(np.float64)
+        value = value / value.sum(axis=1, keepdims=True)
+
+        features.append(feature)
+        thresholds.append(threshold)
+        children.append(np.column_stack([
+            np.where(is_leaf, own_index, tree.children_left + offset),
+            np.where(is_leaf, own_index, tree.children_right + offset)
+        ]).astype(np.int64))
+        values.append(value)
+        roots.append(offset)
+
+        offset += n_nodes
+        max_depth = max(max_depth, tree.max_depth)
+
+    return path_deltas({
+        'feature': np.ascontiguousarray(np.concatenate(features)),
+        'threshold': np.ascontiguousarray(np.concatenate(thresholds)),
+        'children': np.ascontiguousarray(np.concatenate(children)),
+        'value': np.ascontiguousarray(np.concatenate(values)),
+        'roots': np.asarray(roots, dtype=np.int64),
+        'max_depth': int(max_depth),
+    })
+
+
+def path_deltas(arrays):
+    """
+    Add the per-node arrays used for feature contributions.
+
+    delta[node] is value[node] - value[parent]: how much the split in the
+    parent moved the class distribution, credited to parent_feature[node],
+    the parent's split feature. Roots have a zero delta. Summed along a
+    path these give leaf value - root value.
+    """
+    children = arrays['children']
+    nodes = np.arange(len(children))
+    parent = nodes.copy()
+    internal = children[:, 0] != nodes
+    parent[children[internal, 0]] = nodes[internal]
+    parent[children[internal, 1]] = nodes[internal]
+
+    arrays['delta'] = np.ascontiguousarray(arrays['value'] - arrays['value'][parent])
+    arrays['parent_feature'] = np.ascontiguousarray(arrays['feature'][parent])
+    return arrays
+
+
+def save_forest(arrays, path):
+    """
+    Save exported forest arrays as a directory of .npy files.
+
+    Plain .npy files can be memory-mapped read-only, so every API worker
+    maps the same page-cache copy instead of holding its own. The directory
+    is written next to the target and renamed into place, so readers never
+    see a half-written artifact.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path)
+    for key in ARRAY_KEYS:
+        np.save(os.path.join(tmp_path, f"{key}.npy"), arrays[key])
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({'max_depth': int(arrays['max_depth'])}, f)
+
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def compress_forest(arrays, trees=None, max_depth=None):
+    """
+    Shrink exported forest arrays.
+
+    - trees: indices of the trees to keep, in that order (see order_trees)
+    - max_depth: split nodes at this depth become leaves; every node keeps
+      its own class distribution in `value`, so they are leaves as sklearn
+      would have grown them with that max_depth
+    - sibling leaves with identical values are merged into their parent,
+      which does not change any prediction
+
+    Unreachable nodes are dropped. Returns new arrays like export_forest().
+    """
+    feature, threshold, value = arrays['feature'], arrays['threshold'], arrays['value']
+    children = arrays['children']
+    roots = arrays['roots'] if trees is None else arrays['roots'][list(trees)]
+
+    def collapse(node, depth):
+        left, right = children[node]
+        if left == node or (max_depth is not None and depth >= max_depth):
+            return ('leaf', value[node])
+        left, right = collapse(left, depth + 1), collapse(right, depth + 1)
+        if left[0] == right[0] == 'leaf' and np.array_equal(left[1], right[1]):
+            return left
+        return ('split', node, left, right)
+
+    out_feature, out_threshold, out_children, out_value = [], [], [], []
+
+    def emit(item):
+        """Append a collapsed subtree; returns (global index, depth)."""
+        index = len(out_feature)
+        if item[0] == 'leaf':
+            out_feature.append(0)
+            out_threshold.append(0.0)
+            out_children.append((index, index))
+            out_value.append(item[1])
+            return index, 0
+        _, node, left, right = item
+        out_feature.append(feature[node])
+        out_threshold.append(threshold[node])
+        out_children.append(None)
+        out_value.append(value[node])
+        left_index, left_depth = emit(left)
+        right_index, right_depth = emit(right)
+        out_children[index] = (left_index, right_index)
+        return index, 1 + max(left_depth, right_depth)
+
+    new_roots, depth = [], 0
+    for root in roots:
+        index, tree_depth = emit(collapse(int(root), 0))
+        new_roots.append(index)
+        depth = max(depth, tree_depth)
+
+    return path_deltas({
+        'feature': np.asarray(out_feature, dtype=np.int64),
+        'threshold': np.asarray(out_threshold, dtype=np.float64),
+        'children': np.asarray(out_children, dtype=np.int64),
+        'value': np.ascontiguousarray(out_value, dtype=np.float64),
+        'roots': np.asarray(new_roots, dtype=np.int64),
+        'max_depth': int(depth),
+    })
+
+
+def order_trees(forest, X):
+    """
+    Order the trees of a FlatForest so that every prefix approximates the
+    full forest's probabilities on rows X as closely as possible (greedy
+    forward selection on squared error). Returns the tree indices.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    per_tree = forest.value[forest.apply(X)].transpose(1, 0, 2)  # (trees, rows, classes)
+    target = per_tree.mean(axis=0)
+
+    order, remaining = [], list(range(forest.n_trees))
+    sums = np.zeros_like(target)
+    for count in range(1, forest.n_trees + 1):
+        candidates = (sums + per_tree[remaining]) / count
+        error = ((candidates - target) ** 2).sum(axis=(1, 2))
+        best = remaining.pop(int(error.argmin()))
+        order.append(best)
+        sums += per_tree[best]
+    return order
+
+
+class FlatForest:
+    """
+    Evaluator for a forest exported with export_forest().
+
+    All rows and all trees advance one level per step, so scoring a matrix
+    costs max_depth vectorized gathers. Large matrices are processed in row
+    chunks so the per-step working set stays in cache.
+    """
+
+    # Rows per chunk; 512 rows x 200 trees of node indices is ~0.8 MB
+    CHUNK_ROWS = 512
+    # Default minimum rows for per-row early exit: below it one pass over
+    # the trees is cheaper than passes per block, as the cost of a pass is
+    # mostly per depth level, not per tree
+    EARLY_EXIT_MIN_ROWS = 64
+
+    def __init__(self, arrays):
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.children = arrays['children']
+        self.value = arrays['value']
+        self.delta = arrays['delta']
+        self.parent_feature = arrays['parent_feature']
+        self.roots = arrays['roots']
+        self.max_depth = int(arrays['max_depth'])
+        self.n_trees = len(self.roots)
+        self.n_classes = self.value.shape[1]
+        self._flat_children = self.children.reshape(-1)
+
+    @property
+    def left(self):
+        return self.children[:, 0]
+
+    @property
+    def right(self):
+        return self.children[:, 1]
+
+    @classmethod
+    def from_model(cls, model, scaler=None):
+        return cls(export_forest(model, scaler))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a forest saved with save_forest().
+
+        With mmap=True the arrays are mapped read-only from disk and shared
+        through the page cache by all processes that load the same path.
+        """
+        arrays = {}
+        for key in ARRAY_KEYS:
+            array = np.load(os.path.join(path, f"{key}.npy"), mmap_mode='r' if mmap else None)
+            arrays[key] = np.asarray(array)
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            arrays['max_depth'] = json.load(f)['max_depth']
+        return cls(arrays)
+
+    def _apply_chunk(self, X, roots):
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        row_offset = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        node = np.broadcast_to(roots, (n_rows, len(roots)))
+        for _ in range(self.max_depth):
+            feature = np.take(self.feature, node)
+            goes_right = np.take(flat_X, row_offset + feature) > np.take(self.threshold, node)
+            node = np.take(self._flat_children, 2 * node + goes_right)
+        return node
+
+    def _leaf_sum(self, X, roots):
+        """Sum of the leaf probabilities of the trees starting at `roots`, per row."""
+        if len(X) <= self.CHUNK_ROWS:
+            return self.value[self._apply_chunk(X, roots)].sum(axis=1)
+
+        sums = np.empty((len(X), self.n_classes))
+        for start in range(0, len(X), self.CHUNK_ROWS):
+            leaves = self._apply_chunk(X[start:start + self.CHUNK_ROWS], roots)
+            sums[start:start + self.CHUNK_ROWS] = self.value[leaves].sum(axis=1)
+        return sums
+
+    def apply(self, X):
+        """Return the (N, n_trees) global leaf index reached by every row."""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if len(X) <= self.CHUNK_ROWS:
+            return self._apply_chunk(X, self.roots)
+        return np.concatenate([
+            self._apply_chunk(X[start:start + self.CHUNK_ROWS], self.roots)
+            for start in range(0, len(X), self.CHUNK_ROWS)
+        ])
+
+    def predict_proba(self, X):
+        """
+        Average the per-tree leaf probabilities, like predict_proba.
+        Results match sklearn up to float64 summation order (~1e-16).
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        return self._leaf_sum(X, self.roots) / self.n_trees
+
+    def contributions(self, X, n_features=None):
+        """
+        Per-feature contributions to the predicted probabilities, following
+        every row's path through every tree (the treeinterpreter method).
+
+        Returns (bias, contributions): bias is the (n_classes,) average root
+        distribution and contributions is (N, n_features, n_classes), with
+        bias + contributions.sum(axis=1) == predict_proba(X) up to rounding.
+        The precomputed delta/parent_feature arrays make this one traversal
+        plus a bincount per class.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        n_features = n_features or X.shape[1]
+        bias = self.value[self.roots].mean(axis=0)
+        contributions = np.empty((len(X), n_features, self.n_classes))
+
+        for start in range(0, len(X), self.CHUNK_ROWS):
+            chunk = X[start:start + self.CHUNK_ROWS]
+            n_rows = len(chunk)
+            flat_X = chunk.ravel()
+            row_offset = (np.arange(n_rows, dtype=np.intp) * chunk.shape[1])[:, None]
+            row_key = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+            node = np.broadcast_to(self.roots, (n_rows, self.n_trees))
+            keys, steps = [], []
+            for _ in range(self.max_depth):
+                feature = np.take(self.feature, node)
+                goes_right = np.take(flat_X, row_offset + feature) > np.take(self.threshold, node)
+                next_node = np.take(self._flat_children, 2 * node + goes_right)
+                # Leaves point to themselves; only real steps contribute
+                moved = next_node != node
+                keys.append((row_key + np.take(self.parent_feature, next_node))[moved])
+                steps.append(next_node[moved])
+                node = next_node
+
+            keys = np.concatenate(keys)
+            steps = np.concatenate(steps)
+            for c in range(self.n_classes):
+                contributions[start:start + n_rows, :, c] = np.bincount(
+                    keys, weights=self.delta[steps, c], minlength=n_rows * n_features
+                ).reshape(n_rows, n_features)
+        contributions /= self.n_trees
+        return bias, contributions
+
+    def predict_proba_varying(self, X):
+        """
+        predict_proba() for rows that share most of their features, such as
+        a what-if grid around one case.
+
+        Splits on features that are the same in every row are resolved once
+        for the whole forest: each node is mapped to the first node below it
+        that splits on a varying feature (or a leaf), by pointer jumping over
+        the node arrays. Rows then only walk the varying splits, which takes
+        far fewer steps than max_depth. Results equal predict_proba().
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        n_nodes = len(self.feature)
+        nodes = np.arange(n_nodes)
+        varying = np.flatnonzero((X != X[0]).any(axis=0))
+        fixed = ~np.isin(self.feature, varying) & (self.children[:, 0] != nodes)
+
+        # Follow the fixed splits with the shared values of the first row
+        goes_right = (X[0, self.feature] > self.threshold).astype(np.intp)
+        skip = np.where(fixed, self._flat_children[2 * nodes + goes_right], nodes)
+        for _ in range(int(np.ceil(np.log2(self.max_depth + 1)))):
+            skip = skip[skip]
+        children = skip[self.children].reshape(-1)
+
+        # Most (row, tree) pairs reach their leaf after a few varying splits,
+        # so only the pairs that still moved are advanced
+        probabilities = np.empty((len(X), self.n_classes))
+        for start in range(0, len(X), self.CHUNK_ROWS):
+            chunk = X[start:start + self.CHUNK_ROWS]
+            flat_X = chunk.ravel()
+            row_offset = np.repeat(np.arange(len(chunk), dtype=np.intp) * chunk.shape[1], self.n_trees)
+            node = np.tile(skip[self.roots], len(chunk))
+            active = np.flatnonzero(self.children[node, 0] != node)
+            while len(active):
+                current = node[active]
+                feature = np.take(self.feature, current)
+                right = np.take(flat_X, row_offset[active] + feature) > np.take(self.threshold, current)
+                next_node = np.take(children, 2 * current + right)
+                node[active] = next_node
+                active = active[self.children[next_node, 0] != next_node]
+            probabilities[start:start + self.CHUNK_ROWS] = self.value[node.reshape(len(chunk), -1)].sum(axis=1)
+        probabilities /= self.n_trees
+        return probabilities
+
+    def _finish_early(self, X, sums, done, block_trees, max_error, min_rows=None):
+        """
+        Add the trees after the first `done` to `sums` in blocks, and stop
+        for a row as soon as its leading class can no longer be overtaken:
+        every remaining tree adds at most 1 to a class, so the lead over the
+        runner-up must exceed the number of remaining trees. With max_error,
+        all rows also stop once the remaining trees can move a probability
+        by at most that much. Below min_rows rows (EARLY_EXIT_MIN_ROWS when
+        None) the trees up to that point are added in one pass, without the
+        per-row check. Returns (probabilities, trees_used).
+        """
+        last = self.n_trees - int(max_error * self.n_trees) if max_error else self.n_trees
+        last = max(last, done)
+        if len(X) < (self.EARLY_EXIT_MIN_ROWS if min_rows is None else min_rows):
+            if last > done:
+                sums += self._leaf_sum(X, self.roots[done:last])
+            return sums / last, np.full(len(X), last)
+
+        trees_used = np.full(len(X), done)
+        # No row can be decided before more than half of the trees are in
+        first_decidable = self.n_trees // 2 + 1
+        rows = np.arange(len(X))
+        while done < last and len(rows):
+            stop = min(max(done + block_trees, first_decidable), last)
+            sums[rows] += self._leaf_sum(X[rows], self.roots[done:stop])
+            done = stop
+            trees_used[rows] = done
+            top = np.partition(sums[rows], -2, axis=1)
+            rows = rows[top[:, -1] - top[:, -2] <= self.n_trees - done]
+        return sums / trees_used[:, None], trees_used
+
+    def predict_proba_early_exit(self, X, block_trees=20, max_error=0.0, min_rows=None):
+        """
+        predict_proba() that stops evaluating trees for a row once its
+        recommendation is decided. Rows that stopped early get the average
+        over the trees evaluated so far: the recommendation is the same as
+        predict_proba(), the probabilities are approximate (off by at most
+        the share of trees skipped). Calls with fewer than min_rows rows
+        skip the per-row check (see _finish_early()).
+
+        Returns (probabilities, trees_used) with trees_used per row.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        return self._finish_early(X, np.zeros((len(X), self.n_classes)), 0, block_trees, max_error, min_rows)
+
+    def predict_proba_cascade(self, X, first_trees, threshold, early_exit=False, block_trees=20,
+                              min_rows=None):
+        """
+        Two-tier scoring. Every row is scored with the first `first_trees`
+        trees; rows whose top probability reaches `threshold` are answered
+        from those. The other rows also get the remaining trees, added to
+        the same sums, so their result is predict_proba() (up to summation
+        order) without scoring the first trees twice. With early_exit those
+        rows are finished like predict_proba_early_exit().
+
+        Returns (probabilities, trees_used); rows answered by the first tier
+        have trees_used == first_trees.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        sums = self._leaf_sum(X, self.roots[:first_trees])
+        probabilities = sums / first_trees
+        trees_used = np.full(len(X), first_trees)
+        slow = probabilities.max(axis=1) < threshold
+        if slow.any():
+            if early_exit:
+                probabilities[slow], trees_used[slow] = self._finish_early(
+                    X[slow], sums[slow], first_trees, block_trees, 0.0, min_rows
+                )
+            else:
+                rest = self._leaf_sum(X[slow], self.roots[first_trees:])
+                probabilities[slow] = (sums[slow] + rest) / self.n_trees
+                trees_used[slow] = self.n_trees
+        return probabilities, trees_used
+
+
+def calibrate_cascade(forest, X, y=None, tree_counts=(10, 20, 40), min_agreement=0.995):
+    """
+    Pick the cascade setting for a flat forest on held-out calibration rows
+    (not the rows it is reported on, see evaluate_cascade).
+
+    For every number of first-tier trees, the threshold is the lowest
+    confidence at which the cascade's recommendation agrees with the full
+    forest on at least min_agreement of the rows. The chosen setting is the
+    one with the lowest measured scoring time. Returns (chosen, report) with
+    the evaluate_cascade() rows on X.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    full_best = forest.predict_proba(X).argmax(axis=1)
+
+    settings = []
+    for trees in tree_counts:
+        if trees >= forest.n_trees:
+            continue
+        first = forest._leaf_sum(X, forest.roots[:trees]) / trees
+        confidence = first.max(axis=1)
+        agrees = first.argmax(axis=1) == full_best
+
+        # Lowest threshold whose cascade still agrees often enough: rows
+        # below the threshold get the full forest and always agree
+        threshold = 1.0
+        for candidate in np.unique(np.round(confidence, 3)):
+            fast = confidence >= candidate
+            if 1 - (~agrees & fast).mean() >= min_agreement:
+                threshold = float(candidate)
+                break
+        settings.append((trees, threshold))
+
+    report = evaluate_cascade(forest, X, y, settings)
+    chosen = min(report, key=lambda row: row['ms_per_1k_rows'])
+    return (chosen if chosen['threshold'] is not None else None), report
+
+
+def evaluate_cascade(forest, X, y=None, settings=()):
+    """
+    Measure the full forest and every (trees, threshold) cascade setting on
+    X. Every row has trees, threshold (None for the full forest), coverage
+    (share answered by the first tier), agreement with the full forest,
+    accuracy (when y is given) and ms_per_1k_rows.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    full_best = forest.predict_proba(X).argmax(axis=1)
+
+    def ms_per_1k_rows(score, repeats=3):
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            score()
+            seconds.append(time.perf_counter() - start)
+        return min(seconds) * 1000 * 1000 / len(X)
+
+    report = [{
+        'trees': forest.n_trees, 'threshold': None, 'coverage': 0.0, 'agreement': 1.0,
+        'accuracy': float((full_best == y).mean()) if y is not None else None,
+        'ms_per_1k_rows': ms_per_1k_rows(lambda: forest.predict_proba(X)),
+    }]
+    for trees, threshold in settings:
+        probabilities, trees_used = forest.predict_proba_cascade(X, trees, threshold)
+        best = probabilities.argmax(axis=1)
+        report.append({
+            'trees': trees,
+            'threshold': threshold,
+            'coverage': float((trees_used == trees).mean()),
+            'agreement': float((best == full_best).mean()),
+            'accuracy': float((best == y).mean()) if y is not None else None,
+            'ms_per_1k_rows': ms_per_1k_rows(lambda: forest.predict_proba_cascade(X, trees, threshold)),
+        })
+    return report
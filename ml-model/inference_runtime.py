@@ -0,0 +1,65 @@
+"""
+Thread configuration for model inference.
+
+train_model_v2.py fits the forest with n_jobs=-1, and sklearn pickles that
+setting into the artifact: every predict_proba on a loaded model would then
+dispatch to a joblib pool spanning all cores. InferenceRuntime makes the
+serving-side thread budget explicit and applies it when a model is loaded.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # threadpoolctl ships with scikit-learn, but stay optional
+    threadpool_limits = None
+
+
+@dataclass
+class InferenceRuntime:
+    """Thread budget for inference."""
+    threads_per_request: int = 1  # n_jobs of sklearn models and BLAS/OpenMP threads
+    pool_size: int = 8            # worker threads shared by all requests in a process
+
+    @classmethod
+    def from_env(cls) -> "InferenceRuntime":
+        return cls(
+            threads_per_request=int(os.getenv('ML_THREADS_PER_REQUEST', '1')),
+            pool_size=int(os.getenv('ML_THREAD_POOL_SIZE', '8'))
+        )
+
+    def apply_to_model(self, model):
+        """Override the n_jobs that was pickled with a fitted estimator."""
+        if hasattr(model, 'n_jobs'):
+            model.n_jobs = self.threads_per_request
+        return model
+
+    def apply_to_process(self):
+        """
+        Limit native thread pools (BLAS/OpenMP) used by NumPy and sklearn.
+        Returns the threadpoolctl limiter (None without threadpoolctl).
+        """
+        if threadpool_limits is not None:
+            return threadpool_limits(limits=self.threads_per_request)
+        return None
+
+    def apply_to_event_loop(self):
+        """
+        Size the thread pools behind asyncio.to_thread (micro-batching) and
+        FastAPI's sync endpoints. Must be called from inside the running loop.
+        """
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(
+            ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='inference')
+        )
+        try:
+            import anyio.to_thread
+            anyio.to_thread.current_default_thread_limiter().total_tokens = self.pool_size
+        except ImportError:
+            pass
+
+
+runtime = InferenceRuntime.from_env()
@@ -0,0 +1,138 @@
+"""
+Lightweight latency histograms for the ML API.
+
+Histograms are rendered in the Prometheus text exposition format, so the
+/metrics endpoint can be scraped without pulling in prometheus_client.
+Recording is a bisect and two additions under a lock; with the switch off it
+is a single attribute check.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Sequence, Tuple
+
+# Seconds, from 10µs to 10s
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0
+)
+# Rows per batch
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+
+
+class Histogram:
+    """Cumulative-bucket histogram for one label set."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metrics:
+    """Named histograms with labels, rendered as Prometheus text."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+        self._help: Dict[str, str] = {}
+        self._buckets: Dict[str, Sequence[float]] = {}
+        self._lock = threading.Lock()
+
+    def define(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self._help[name] = help_text
+        self._buckets[name] = buckets
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                    key, Histogram(self._buckets.get(name, LATENCY_BUCKETS))
+                )
+        histogram.observe(value)
+
+    def lap(self, endpoint: str, stage: str, start: float) -> float:
+        """Record the time since `start` for a stage and return the current time."""
+        now = time.perf_counter()
+        if self.enabled:
+            self.observe('ml_api_stage_seconds', now - start, endpoint=endpoint, stage=stage)
+        return now
+
+    def render(self) -> str:
+        """Prometheus text exposition of all histograms."""
+        lines = []
+        by_name: Dict[str, list] = {}
+        # Handlers add label sets concurrently: render from a snapshot
+        with self._lock:
+            histograms = list(self._histograms.items())
+        for (name, labels), histogram in sorted(histograms, key=lambda item: item[0]):
+            by_name.setdefault(name, []).append((labels, histogram))
+
+        for name, series in by_name.items():
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                prefix = f"{label_text}," if label_text else ""
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+                cumulative += histogram.counts[-1]
+                lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{name}_sum{suffix} {histogram.sum:.9g}")
+                lines.append(f"{name}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the total time per endpoint, including
+    response serialization. Paths outside `paths` are recorded as "other"
+    to keep the label set bounded.
+    """
+
+    def __init__(self, app, metrics: Metrics, paths: set, name: str = 'ml_api_request_seconds'):
+        self.app = app
+        self.metrics = metrics
+        self.paths = paths
+        self.name = name
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status: Optional[int] = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics.observe(
+                self.name,
+                time.perf_counter() - start,
+                endpoint=scope["path"] if scope["path"] in self.paths else "other",
+                status=str(status or 500)
+            )
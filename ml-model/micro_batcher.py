@@ -0,0 +1,89 @@
+"""
+Async micro-batching for concurrent single-row predictions.
+
+Requests that arrive within a short window are stacked into one feature
+matrix, scored with a single model call and the results are handed back to
+the waiting callers.
+"""
+
+import asyncio
+
+import numpy as np
+
+
+class MicroBatcher:
+    """
+    Collects feature rows from concurrent callers and scores them together.
+
+    A batch is flushed when it holds max_rows rows or when window_ms has
+    passed since its first row arrived, so the extra latency per request is
+    bounded by the window plus the scoring time of one batch.
+    """
+
+    def __init__(self, score, window_ms: float = 2.0, max_rows: int = 64):
+        """
+        Args:
+            score: Function mapping an (N, n_features) matrix to one result per row
+            window_ms: Maximum time to wait for more rows after the first one
+            max_rows: Maximum number of rows per batch
+        """
+        self.score = score
+        self.window = window_ms / 1000.0
+        self.max_rows = max_rows
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, row) -> np.ndarray:
+        """Queue one feature row and wait for its probability vector."""
+        self._ensure_running()
+        future = self._loop.create_future()
+        self._queue.put_nowait((row, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for the first row, then gather more until the window closes."""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.window
+
+        while len(batch) < self.max_rows:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Callers that went away (client disconnect) don't need a result
+            batch = [(row, future) for row, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            try:
+                features = np.array([row for row, _ in batch], dtype=np.float64)
+                probabilities = await asyncio.to_thread(self.score, features)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), probs in zip(batch, probabilities):
+                if not future.done():
+                    future.set_result(probs)
@@ -1,28 +1,137 @@
 """FastAPI service for ML-based debt collection predictions - V2."""
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-import joblib
+from typing import Optional, List, Dict, Any, Literal
 import numpy as np
+import asyncio
 import json
+import os
+import time
 from enum import Enum
 
-# Load model artifacts (V2)
-model = joblib.load('debt_model_v2.joblib')
-scaler = joblib.load('scaler_v2.joblib')
-label_encoder = joblib.load('label_encoder_v2.joblib')
-with open('feature_names_v2.json', 'r') as f:
-    feature_names = json.load(f)
-with open('model_metadata_v2.json', 'r') as f:
-    config = json.load(f)
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from cbs_config import configured_dsn
+from fast_json import FastJSONResponse, dumps
+from flat_forest import FlatForest
+from feature_pipeline import (
+    AGE_CATEGORIES, FEATURE_NAMES, INCOME_SOURCES, REQUEST_ERRORS,
+    arrow_to_columns, derive_feature_matrix, validate_columns
+)
+from inference_runtime import runtime
+from metrics import BATCH_SIZE_BUCKETS, Metrics, MetricsMiddleware
+from micro_batcher import MicroBatcher
+from model_registry import TIERS, ModelRegistry, ensure_flat_model
+from municipality_risk import SNAPSHOT_FILE, MunicipalityRiskTable
+from prediction_cache import PredictionCache
+from shadow_scorer import ShadowScorer
+
+try:
+    import pyarrow as pa
+except ImportError:  # the Arrow endpoint is optional
+    pa = None
+
+# Load model artifacts (V2) from the model registry, or from the working
+# directory when no version has been activated yet
+MODEL_REGISTRY = os.getenv('ML_MODEL_REGISTRY', 'models')
+# Map the flat arrays read-only so all workers share one copy; 0 = private copy
+MMAP_MODEL = os.getenv('ML_MMAP_MODEL', '1') != '0'
+# Answer confident rows from the first trees only (threshold calibrated at
+# training time, see model_metadata_v2.json "cascade"); 0 = full forest only
+CASCADE = os.getenv('ML_CASCADE', '0') != '0'
+# Stop evaluating trees for a row once its recommendation can no longer change
+EARLY_EXIT = os.getenv('ML_EARLY_EXIT', '0') != '0'
+
+# Micro-batching of concurrent /predict calls; ML_BATCH_WINDOW_MS=0 disables it
+BATCH_WINDOW_MS = float(os.getenv('ML_BATCH_WINDOW_MS', '2'))
+BATCH_MAX_ROWS = int(os.getenv('ML_BATCH_MAX_ROWS', '64'))
+
+# Smallest model call that gets the per-row early-exit check; by default no
+# more than ML_BATCH_MAX_ROWS, so full micro-batches qualify
+EARLY_EXIT_MIN_ROWS = int(os.getenv(
+    'ML_EARLY_EXIT_MIN_ROWS', str(min(FlatForest.EARLY_EXIT_MIN_ROWS, BATCH_MAX_ROWS))
+))
+registry = ModelRegistry(MODEL_REGISTRY, mmap=MMAP_MODEL, cascade=CASCADE, early_exit=EARLY_EXIT,
+                         early_exit_min_rows=EARLY_EXIT_MIN_ROWS)
+
+# Shadow scoring: a candidate registry version scores every live batch on a
+# background thread; batches are dropped when ML_SHADOW_QUEUE batches are waiting
+SHADOW_VERSION = os.getenv('ML_SHADOW_VERSION')
+SHADOW_QUEUE = int(os.getenv('ML_SHADOW_QUEUE', '64'))
+shadow = ShadowScorer(registry.load(SHADOW_VERSION), SHADOW_QUEUE) if SHADOW_VERSION else None
+
+# CBS risk percentages per gemeente, from the snapshot file; only with
+# ML_CBS_DSN set they are rebuilt from the database in the background
+# (ML_RISK_REFRESH_SECONDS=0 disables rebuilds)
+CBS_DSN = configured_dsn()
+RISK_REFRESH_SECONDS = float(os.getenv('ML_RISK_REFRESH_SECONDS', '3600' if CBS_DSN else '0'))
+risk_table = MunicipalityRiskTable(SNAPSHOT_FILE, dsn=CBS_DSN)
+
+# Prediction cache keyed on the derived feature vector; ML_CACHE_SIZE=0 disables it
+CACHE_SIZE = int(os.getenv('ML_CACHE_SIZE', '10000'))
+CACHE_TTL_SECONDS = float(os.getenv('ML_CACHE_TTL_SECONDS', '3600'))
+CACHE_QUANTIZE = os.getenv('ML_CACHE_QUANTIZE')  # decimals, unset = exact keys
+
+prediction_cache = (
+    PredictionCache(
+        max_size=CACHE_SIZE,
+        ttl_seconds=CACHE_TTL_SECONDS,
+        quantize=int(CACHE_QUANTIZE) if CACHE_QUANTIZE else None
+    )
+    if CACHE_SIZE > 0 else None
+)
+
+# Per-stage latency histograms on /metrics; ML_METRICS=0 disables recording
+metrics = Metrics(enabled=os.getenv('ML_METRICS', '1') != '0')
+metrics.define('ml_api_request_seconds', 'Total request time per endpoint, including serialization')
+metrics.define('ml_api_stage_seconds', 'Time per processing stage and endpoint')
+metrics.define('ml_api_batch_size', 'Rows per scored batch', BATCH_SIZE_BUCKETS)
+METRIC_PATHS = set()  # filled with the route paths once all endpoints are defined
+
+# Rows per scored chunk on the NDJSON streaming endpoint
+STREAM_CHUNK_ROWS = int(os.getenv('ML_STREAM_CHUNK_ROWS', '1000'))
+STREAM_MAX_LINE_BYTES = 64 * 1024
+
+# Gzip JSON responses above this size for clients that accept it; 0 disables gzip
+GZIP_MIN_BYTES = int(os.getenv('ML_GZIP_MIN_BYTES', '65536'))
+# Streamed and Arrow responses are scored off the event loop; gzip would run on it
+GZIP_SKIP_PATHS = {'/batch-predict/ndjson', '/batch-predict/arrow'}
+
+# Explicit thread budget (ML_THREADS_PER_REQUEST, ML_THREAD_POOL_SIZE)
+runtime.apply_to_process()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    runtime.apply_to_event_loop()
+    yield
+
+class JSONGZipMiddleware:
+    """GZipMiddleware for every path except `skip_paths`, which pass through uncompressed."""
+
+    def __init__(self, app, minimum_size: int, skip_paths: set):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip(scope, receive, send)
 
 app = FastAPI(
     title="Smart Collection ML API V2",
     description="ML-powered debt collection recommendation API with enhanced CBS patterns",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+app.add_middleware(MetricsMiddleware, metrics=metrics, paths=METRIC_PATHS)
+if GZIP_MIN_BYTES > 0:
+    app.add_middleware(JSONGZipMiddleware, minimum_size=GZIP_MIN_BYTES, skip_paths=GZIP_SKIP_PATHS)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -61,6 +170,10 @@ class PredictionRequest(BaseModel):
     other_debts_count: int = Field(default=0, ge=0, description="Number of other debts")
     age_category: Optional[str] = Field(default="mid", description="Age category: jong/mid/oud")
     debt_type: Optional[DebtType] = Field(default=None, description="Type of debt")
+    gemeentecode: Optional[str] = Field(
+        default=None, pattern=r"^GM\d{4}$",
+        description="CBS municipality code (e.g. GM0363); enables the municipality's CBS risk figures"
+    )
 
 class PredictionResponse(BaseModel):
     recommendation: str = Field(..., description="Recommended action")
@@ -69,173 +182,769 @@ class PredictionResponse(BaseModel):
     features_used: Dict[str, Any] = Field(..., description="Input features used")
     ml_model_info: Dict[str, Any] = Field(..., description="Model metadata")
 
+class ActivateRequest(BaseModel):
+    version: str = Field(..., description="Model version directory in the registry")
+
 @app.get("/")
 def root():
+    config = registry.current.config
     return {
         "service": "Smart Collection ML API V2",
         "version": "2.0.0",
         "status": "online",
         "model_accuracy": config.get('test_accuracy', 'N/A'),
-        "model_features": len(feature_names),
+        "model_features": len(registry.current.feature_names),
         "training_examples": config.get('training_size', 'N/A'),
-        "available_actions": list(label_encoder.classes_)
+        "available_actions": list(registry.current.classes),
+        "model_version": registry.current.version
     }
 
 @app.get("/health")
 def health():
     return {"status": "healthy", "version": "2.0.0"}
 
-@app.post("/predict", response_model=PredictionResponse)
-def predict(request: PredictionRequest):
+AGE_CODES = {category: code for code, category in enumerate(AGE_CATEGORIES)}
+
+def requests_to_columns(requests: List[PredictionRequest]) -> Dict[str, np.ndarray]:
+    """Request columns (see feature_pipeline) for validated prediction requests."""
+    return {
+        'debt_amount': np.array([r.debt_amount for r in requests], dtype=np.float64),
+        'monthly_income': np.array([r.monthly_income for r in requests], dtype=np.float64),
+        'income_source': np.array([INCOME_SOURCES.index(r.income_source.value) for r in requests]),
+        'has_children': np.array([r.has_children for r in requests]),
+        'num_children': np.array([r.num_children for r in requests], dtype=np.float64),
+        'is_single_parent': np.array([r.is_single_parent for r in requests]),
+        'has_jeugdzorg': np.array([r.has_jeugdzorg for r in requests]),
+        'other_debts_count': np.array([r.other_debts_count for r in requests], dtype=np.float64),
+        # Anything other than jong/oud counts as "mid"
+        'age_category': np.array([AGE_CODES.get(r.age_category, AGE_CODES["mid"]) for r in requests]),
+        'municipality_risk': risk_table.lookup([r.gemeentecode for r in requests]),
+    }
+
+def describe_features(request: PredictionRequest, row: np.ndarray, cbs_risk: bool = False) -> Dict[str, Any]:
     """
-    Predict the best debt collection action based on citizen characteristics.
-    Uses V2 model with 18 features based on enhanced CBS patterns.
+    Human-readable derived features of one row, echoed in the response.
+    cbs_risk tells whether the risk figures are the gemeente's CBS figures.
     """
-    try:
-        # Calculate derived features
-        debt_to_income_ratio = request.debt_amount / request.monthly_income
-
-        # Map income source to risk factors and detailed categories
-        has_social_benefits = request.income_source in [
-            IncomeSource.BENEFIT_SOCIAL,
-            IncomeSource.BENEFIT_UNEMPLOYMENT,
-            IncomeSource.BENEFIT_DISABILITY
-        ]
-
-        is_unemployed = request.income_source == IncomeSource.BENEFIT_UNEMPLOYMENT
-        has_flex_work = request.income_source == IncomeSource.SELF_EMPLOYED
-        is_zzp = request.income_source == IncomeSource.SELF_EMPLOYED
-
-        # Determine benefit type
-        benefit_bijstand = 1 if request.income_source == IncomeSource.BENEFIT_SOCIAL else 0
-        benefit_ww = 1 if request.income_source == IncomeSource.BENEFIT_UNEMPLOYMENT else 0
-        benefit_ao = 1 if request.income_source == IncomeSource.BENEFIT_DISABILITY else 0
-
-        # Age category encoding
-        age_jong = 1 if request.age_category == "jong" else 0
-        age_oud = 1 if request.age_category == "oud" else 0
-
-        # Estimate CBS risk factors based on income source and debt characteristics
-        if has_social_benefits:
-            income_risk = 75.0
-            social_benefit_risk = 80.0
-        else:
-            income_risk = 30.0
-            social_benefit_risk = 20.0
+    feature = dict(zip(FEATURE_NAMES, row.tolist()))
+    return {
+        "debt_amount": request.debt_amount,
+        "monthly_income": request.monthly_income,
+        "has_social_benefits": bool(feature['has_social_benefits']),
+        "is_unemployed": bool(feature['is_unemployed']),
+        "has_flex_work": bool(feature['has_flex_work']),
+        "is_zzp": bool(feature['is_zzp']),
+        "is_single_parent": request.is_single_parent,
+        "has_children": request.has_children,
+        "num_children": request.num_children,
+        "has_jeugdzorg": request.has_jeugdzorg,
+        "debt_to_income_ratio": round(feature['debt_to_income_ratio'], 3),
+        "other_debts_count": request.other_debts_count,
+        "income_risk": feature['income_risk'],
+        "unemployment_risk": feature['unemployment_risk'],
+        "social_benefit_risk": feature['social_benefit_risk'],
+        "gemeentecode": request.gemeentecode,
+        "risk_source": "cbs" if cbs_risk else "estimate",
+        "age_category": request.age_category,
+        "benefit_type": {
+            "bijstand": int(feature['benefit_bijstand']),
+            "ww": int(feature['benefit_ww']),
+            "ao": int(feature['benefit_ao'])
+        }
+    }
 
-        if is_unemployed:
-            unemployment_risk = 85.0
-        else:
-            unemployment_risk = 15.0
-
-        # Adjust risk based on debt burden
-        if debt_to_income_ratio > 0.5:
-            income_risk = min(95.0, income_risk + 20)
-        if request.other_debts_count > 2:
-            income_risk = min(95.0, income_risk + 10)
-            social_benefit_risk = min(95.0, social_benefit_risk + 10)
-
-        # V2 features (18 total, matching training):
-        # ['debt_amount', 'monthly_income', 'has_social_benefits', 'is_unemployed',
-        #  'has_flex_work', 'is_zzp', 'is_single_parent', 'has_children', 'num_children',
-        #  'has_jeugdzorg', 'debt_to_income_ratio', 'other_debts_count',
-        #  'income_risk', 'unemployment_risk', 'social_benefit_risk',
-        #  'age_jong', 'age_oud', 'benefit_bijstand', 'benefit_ww', 'benefit_ao']
-
-        features = np.array([[
-            request.debt_amount,
-            request.monthly_income,
-            float(has_social_benefits),
-            float(is_unemployed),
-            float(has_flex_work),
-            float(is_zzp),
-            float(request.is_single_parent),
-            float(request.has_children),
-            float(request.num_children),
-            float(request.has_jeugdzorg),
-            debt_to_income_ratio,
-            float(request.other_debts_count),
-            income_risk,
-            unemployment_risk,
-            social_benefit_risk,
-            float(age_jong),
-            float(age_oud),
-            float(benefit_bijstand),
-            float(benefit_ww),
-            float(benefit_ao)
-        ]])
-
-        # Scale features
-        features_scaled = scaler.transform(features)
-
-        # Make prediction
-        prediction = model.predict(features_scaled)
-        probabilities = model.predict_proba(features_scaled)[0]
-        recommended_action = label_encoder.inverse_transform(prediction)[0]
-        confidence = float(probabilities.max())
-
-        # Create probability dict
-        prob_dict = {
-            label: float(prob)
-            for label, prob in zip(label_encoder.classes_, probabilities)
+def derive_features(request: PredictionRequest):
+    """
+    Derive the 20 V2 model features from a prediction request.
+
+    Returns the feature row (in feature_names_v2.json order) and the
+    human-readable features_used dict that is echoed in the response.
+    """
+    columns = requests_to_columns([request])
+    row = derive_feature_matrix(columns)[0]
+    return row, describe_features(request, row, not np.isnan(columns['municipality_risk'][0, 0]))
+
+def score_live(bundle, features: np.ndarray):
+    """
+    Score a feature matrix with a live bundle and hand it to the shadow
+    candidate, if any. Returns (probabilities, tier codes).
+    """
+    start = time.perf_counter()
+    probabilities, tiers = bundle.predict_tiered(features)
+    if shadow is not None:
+        shadow.submit(features, probabilities, time.perf_counter() - start, bundle)
+    return probabilities, tiers
+
+def predict_probabilities(features: np.ndarray):
+    """
+    Score a raw (N, 20) feature matrix with the active model's flattened forest.
+    Returns the (N, n_classes) probability matrix in label_encoder order and
+    the tier ("full", "fast" or "early") that answered each row.
+    """
+    probabilities, tiers = score_live(registry.current, features)
+    return probabilities, [TIERS[tier] for tier in tiers]
+
+def lookup_cache(row):
+    """
+    Look up a feature row in the prediction cache.
+    Returns (key, probabilities); both are None when caching is disabled.
+    """
+    if prediction_cache is None:
+        return None, None
+
+    # Entries from a previous model version are dropped on the first lookup
+    prediction_cache.check_signature(registry.current.signature)
+
+    key = prediction_cache.key(row)
+    return key, prediction_cache.get(key)
+
+def score_micro_batch(features: np.ndarray):
+    """Score one micro-batch of concurrent /predict rows; (probabilities, tier) per row."""
+    start = time.perf_counter()
+    probabilities, tiers = predict_probabilities(features)
+    metrics.lap('micro-batch', 'model', start)
+    metrics.observe('ml_api_batch_size', len(features), endpoint='micro-batch')
+    return list(zip(probabilities, tiers))
+
+batcher = (
+    MicroBatcher(score_micro_batch, window_ms=BATCH_WINDOW_MS, max_rows=BATCH_MAX_ROWS)
+    if BATCH_WINDOW_MS > 0 else None
+)
+
+def build_response(probabilities: np.ndarray, features_used: Dict[str, Any], tier: str = "full") -> PredictionResponse:
+    """
+    Build the API response for one row of predicted probabilities.
+    tier is "full", "fast" (cascade first tier), "early" (early exit) or "cache".
+    """
+    bundle = registry.current
+    config = bundle.config
+
+    # RandomForestClassifier.predict is the argmax of predict_proba
+    recommended_action = bundle.classes[int(np.argmax(probabilities))]
+    confidence = float(probabilities.max())
+
+    # Create probability dict
+    prob_dict = {
+        label: float(prob)
+        for label, prob in zip(bundle.classes, probabilities)
+    }
+
+    return PredictionResponse(
+        recommendation=recommended_action,
+        confidence=confidence,
+        probabilities=prob_dict,
+        features_used=features_used,
+        ml_model_info={
+            "version": config.get('version', '2.0'),
+            "model_version": bundle.version,
+            "accuracy": config.get('test_accuracy', 'N/A'),
+            "cv_mean": config.get('cv_mean', 'N/A'),
+            "cv_std": config.get('cv_std', 'N/A'),
+            "features_count": 20,
+            "training_examples": config.get('training_size', 'N/A'),
+            "cbs_patterns": 14,
+            "tier": tier
         }
+    )
 
-        return PredictionResponse(
-            recommendation=recommended_action,
-            confidence=confidence,
-            probabilities=prob_dict,
-            features_used={
-                "debt_amount": request.debt_amount,
-                "monthly_income": request.monthly_income,
-                "has_social_benefits": has_social_benefits,
-                "is_unemployed": is_unemployed,
-                "has_flex_work": has_flex_work,
-                "is_zzp": is_zzp,
-                "is_single_parent": request.is_single_parent,
-                "has_children": request.has_children,
-                "num_children": request.num_children,
-                "has_jeugdzorg": request.has_jeugdzorg,
-                "debt_to_income_ratio": round(debt_to_income_ratio, 3),
-                "other_debts_count": request.other_debts_count,
-                "income_risk": income_risk,
-                "unemployment_risk": unemployment_risk,
-                "social_benefit_risk": social_benefit_risk,
-                "age_category": request.age_category,
-                "benefit_type": {
-                    "bijstand": benefit_bijstand,
-                    "ww": benefit_ww,
-                    "ao": benefit_ao
-                }
-            },
-            ml_model_info={
-                "version": "2.0",
-                "accuracy": config.get('test_accuracy', 'N/A'),
-                "cv_mean": config.get('cv_mean', 'N/A'),
-                "cv_std": config.get('cv_std', 'N/A'),
-                "features_count": 20,
-                "training_examples": config.get('training_size', 'N/A'),
-                "cbs_patterns": 14
-            }
-        )
+def build_compact(probabilities: np.ndarray, bundle=None, tier: str = "full") -> Dict[str, Any]:
+    """
+    Compact prediction: recommendation, confidence and the probabilities
+    as an array in class order (see "classes" / "available_actions"), plus
+    the answering tier when the cascade or early exit is enabled.
+    """
+    bundle = bundle or registry.current
+    index = int(np.argmax(probabilities))
+    result = {
+        "recommendation": bundle.class_names[index],
+        "confidence": float(probabilities[index]),
+        "probabilities": probabilities
+    }
+    if bundle.tiered:
+        result["tier"] = tier
+    return result
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss/eviction counters of the prediction cache."""
+    if prediction_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **prediction_cache.stats()}
+
+@app.get("/municipalities")
+def municipality_risk_status():
+    """Size, build time and refresh state of the per-gemeente CBS risk table."""
+    return risk_table.status()
+
+@app.get("/models")
+def list_models():
+    """Active model version, rollback target and all versions in the registry."""
+    return registry.status()
+
+@app.post("/models/activate")
+def activate_model(request: ActivateRequest):
+    """
+    Load, warm and swap in a registry version. Live traffic keeps using the
+    current model until the new one is ready; other workers follow within a second.
+    """
+    try:
+        registry.activate(request.version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return registry.status()
+
+@app.post("/models/rollback")
+def rollback_model():
+    """Swap back to the previously active model version."""
+    try:
+        registry.rollback()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return registry.status()
+
+@app.get("/models/shadow")
+def shadow_status():
+    """
+    Agreement of the shadow candidate with the live model (overall and per
+    recommendation), live vs. candidate latency per batch, and dropped batches.
+    """
+    if shadow is None:
+        return {"enabled": False}
+    return {"enabled": True, **shadow.stats()}
+
+@app.post("/models/shadow")
+def start_shadow(request: ActivateRequest):
+    """Shadow-score a registry version from now on (this worker), with fresh statistics."""
+    global shadow
+    try:
+        candidate = registry.load(request.version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    previous, shadow = shadow, ShadowScorer(candidate, SHADOW_QUEUE)
+    if previous is not None:
+        previous.stop()
+    return shadow_status()
+
+@app.delete("/models/shadow")
+def stop_shadow():
+    """Stop shadow scoring."""
+    global shadow
+    previous, shadow = shadow, None
+    if previous is not None:
+        previous.stop()
+    return {"enabled": False}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """
+    Latency histograms in Prometheus text format: total time per endpoint,
+    time per stage (derive_features, cache_lookup, model, build_response;
+    micro_batch_wait for queued /predict rows) and rows per scored batch.
+    The scaler is folded into the flattened forest, so scaling, predict,
+    predict_proba and the label lookup are all part of the "model" and
+    "build_response" stages.
+    """
+    return metrics.render()
+
+def prepare_prediction(request: PredictionRequest):
+    """Refresh model and risk table, derive the feature row and look it up in the cache."""
+    registry.refresh()
+    risk_table.refresh(RISK_REFRESH_SECONDS)
+    t = time.perf_counter()
+    row, features_used = derive_features(request)
+    t = metrics.lap('/predict', 'derive_features', t)
+    key, probabilities = lookup_cache(row)
+    t = metrics.lap('/predict', 'cache_lookup', t)
+    return row, features_used, key, probabilities, t
+
+def finish_prediction(probabilities: np.ndarray, features_used: Dict[str, Any], tier, compact: bool, t: float):
+    """Build the /predict response (full or compact)."""
+    if compact:
+        response = FastJSONResponse(build_compact(probabilities, tier=str(tier)))
+    else:
+        response = build_response(probabilities, features_used, str(tier))
+    metrics.lap('/predict', 'build_response', t)
+    return response
+
+def predict_direct(request: PredictionRequest, compact: bool):
+    """/predict without micro-batching: the whole request on the calling (pool) thread."""
+    row, features_used, key, probabilities, t = prepare_prediction(request)
+    tier = "cache"
+    if probabilities is None:
+        probabilities, tiers = predict_probabilities(np.array([row]))
+        probabilities, tier = probabilities[0], tiers[0]
+        t = metrics.lap('/predict', 'model', t)
+        if key is not None:
+            prediction_cache.put(key, probabilities)
+    return finish_prediction(probabilities, features_used, tier, compact, t)
+
+@app.post("/predict", response_model=PredictionResponse)
+async def predict(request: PredictionRequest, compact: bool = False):
+    """
+    Predict the best debt collection action based on citizen characteristics.
+    Uses V2 model with 20 features based on enhanced CBS patterns.
+
+    Concurrent requests are micro-batched: rows arriving within
+    ML_BATCH_WINDOW_MS (or up to ML_BATCH_MAX_ROWS) are scored together.
+
+    With ?compact=true the response is only recommendation, confidence and
+    a probabilities array in class order, encoded without Pydantic.
+    """
+    try:
+        if batcher is None:
+            # Nothing to wait for: score on the threadpool like a sync endpoint
+            return await asyncio.to_thread(predict_direct, request, compact)
+        row, features_used, key, probabilities, t = prepare_prediction(request)
+        tier = "cache"
+        if probabilities is None:
+            probabilities, tier = await batcher.submit(row)
+            t = metrics.lap('/predict', 'micro_batch_wait', t)
+            if key is not None:
+                prediction_cache.put(key, probabilities)
+        return finish_prediction(probabilities, features_used, tier, compact, t)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
 
 @app.post("/batch-predict")
-def batch_predict(requests: List[PredictionRequest]):
+def batch_predict(requests: List[Dict[str, Any]], compact: bool = False):
     """
     Make predictions for multiple cases at once.
+
+    Every case is validated on its own; invalid cases come back as
+    {"index": i, "error": ...} at their position. Cached cases are answered
+    directly; the rest are scored together as one feature matrix in a
+    single model call.
+
+    With ?compact=true every prediction is {recommendation, confidence,
+    probabilities[]} with the class order given once in "classes".
     """
-    results = []
-    for req in requests:
+    build = (lambda probs, _, tier: build_compact(probs, tier=tier)) if compact else build_response
+    registry.refresh()
+    risk_table.refresh(RISK_REFRESH_SECONDS)
+    t = time.perf_counter()
+    metrics.observe('ml_api_batch_size', len(requests), endpoint='/batch-predict')
+    results: List[Any] = [None] * len(requests)
+    valid = []  # (index, request) of the cases that pass validation
+
+    for i, raw in enumerate(requests):
         try:
-            result = predict(req)
-            results.append(result)
+            valid.append((i, PredictionRequest.model_validate(raw)))
         except Exception as e:
-            results.append({"error": str(e)})
+            results[i] = {"index": i, "error": str(e)}
 
+    positions = []  # rows of the feature matrix that still need the model
+    pending = []  # (index, key, features_used) for those rows
+    if valid:
+        columns = requests_to_columns([req for _, req in valid])
+        matrix = derive_feature_matrix(columns)
+        cbs_risk = ~np.isnan(columns['municipality_risk'][:, 0])
+        for position, ((i, req), row) in enumerate(zip(valid, matrix)):
+            details = None if compact else describe_features(req, row, cbs_risk[position])
+            key, cached = lookup_cache(row)
+            if cached is not None:
+                results[i] = build(cached, details, "cache")
+                continue
+            positions.append(position)
+            pending.append((i, key, details))
+    # Validation, derivation and cache lookups (cache hits included) per batch
+    t = metrics.lap('/batch-predict', 'derive_features', t)
+
+    if positions:
+        try:
+            probabilities, tiers = predict_probabilities(matrix[positions])
+            t = metrics.lap('/batch-predict', 'model', t)
+            for (i, key, features_used), probs, tier in zip(pending, probabilities, tiers):
+                if key is not None:
+                    prediction_cache.put(key, probs)
+                results[i] = build(probs, features_used, str(tier))
+            metrics.lap('/batch-predict', 'build_response', t)
+        except Exception as e:
+            for i, _, _ in pending:
+                results[i] = {"index": i, "error": f"Prediction error: {str(e)}"}
+
+    if compact:
+        return FastJSONResponse({"classes": registry.current.class_names, "predictions": results})
     return {"predictions": results}
 
+# === What-if grid ===
+
+GRID_COUNT_FIELDS = ('num_children', 'other_debts_count')
+GRID_MAX_POINTS = 10_000
+
+class GridAxis(BaseModel):
+    field: Literal['debt_amount', 'monthly_income', 'num_children', 'other_debts_count'] = Field(
+        ..., description="Numeric request field to vary"
+    )
+    start: float = Field(..., description="First value")
+    stop: float = Field(..., description="Last value (inclusive)")
+    steps: int = Field(default=50, ge=1, le=1000, description="Number of evenly spaced values")
+
+    def grid_values(self) -> np.ndarray:
+        values = np.linspace(self.start, self.stop, self.steps)
+        if self.field in GRID_COUNT_FIELDS:
+            # Whole counts only, without repeating a value
+            values = np.round(values)
+            values = values[np.r_[True, np.diff(values) != 0]]
+        return values
+
+class GridRequest(BaseModel):
+    base: PredictionRequest = Field(..., description="Case the grid varies")
+    x: GridAxis
+    y: Optional[GridAxis] = Field(default=None, description="Second axis for a 2D surface")
+
+@app.post("/predict/grid")
+def predict_grid(request: GridRequest):
+    """
+    What-if decision surface: the base case with one or two numeric fields
+    varied over a grid, derived as one feature matrix and scored in one call.
+
+    recommendation (class index into "classes"), confidence and
+    probabilities are nested as [y][x] (or [x] without y). Varying
+    num_children also sets has_children. Always scored with the full
+    forest, so every point equals /predict for that case.
+    """
+    registry.refresh()
+    risk_table.refresh(RISK_REFRESH_SECONDS)
+    t = time.perf_counter()
+    x, y = request.x, request.y
+    if y is not None and y.field == x.field:
+        raise HTTPException(status_code=400, detail="x and y must vary different fields")
+    x_values = x.grid_values()
+    y_values = y.grid_values() if y is not None else None
+    n_points = len(x_values) * (len(y_values) if y is not None else 1)
+    if n_points > GRID_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Grid has {n_points} points, the maximum is {GRID_MAX_POINTS}")
+
+    # Row-major with y as the outer axis, so results reshape to (len(y), len(x))
+    columns = {name: np.repeat(values, n_points, axis=0) for name, values in requests_to_columns([request.base]).items()}
+    if y is None:
+        columns[x.field] = x_values
+    else:
+        columns[x.field] = np.tile(x_values, len(y_values))
+        columns[y.field] = np.repeat(y_values, len(x_values))
+    if 'num_children' in (x.field, y.field if y is not None else None):
+        columns['has_children'] = columns['num_children'] > 0
+    error = validate_columns(columns)
+    if (error >= 0).any():
+        raise HTTPException(status_code=400, detail=f"Grid leaves the valid range: {REQUEST_ERRORS[error[error >= 0][0]]}")
+    features = derive_feature_matrix(columns)
+    t = metrics.lap('/predict/grid', 'derive_features', t)
+
+    bundle = registry.current
+    # Only the varied fields (and what is derived from them) differ per row
+    probabilities = bundle.flat_model.predict_proba_varying(features)
+    t = metrics.lap('/predict/grid', 'model', t)
+    metrics.observe('ml_api_batch_size', n_points, endpoint='/predict/grid')
+
+    shape = (len(y_values), len(x_values)) if y is not None else (len(x_values),)
+    response = FastJSONResponse({
+        "classes": bundle.class_names,
+        "model_version": bundle.version,
+        "x": {"field": x.field, "values": x_values},
+        "y": {"field": y.field, "values": y_values} if y is not None else None,
+        "recommendation": probabilities.argmax(axis=1).reshape(shape),
+        "confidence": probabilities.max(axis=1).reshape(shape),
+        "probabilities": probabilities.reshape(shape + (-1,)),
+    })
+    metrics.lap('/predict/grid', 'build_response', t)
+    return response
+
+# === Explanations ===
+
+def explain_rows(features: np.ndarray, bundle):
+    """
+    Probabilities and per-feature contributions of the full forest.
+    Returns (bias, probabilities, contributions) with contributions shaped
+    (N, n_features, n_classes) and bias + contributions summing to the
+    probabilities.
+    """
+    bias, contributions = bundle.flat_model.contributions(features)
+    return bias, bias + contributions.sum(axis=1), contributions
+
+@app.post("/explain")
+def explain(request: PredictionRequest, top: int = 0):
+    """
+    Why the model recommends what it does for one case.
+
+    Every split on a case's path through a tree shifts the class
+    probabilities; that shift is credited to the split's feature and
+    averaged over the trees. base_value (the average over the training data)
+    plus all contributions equals the probability of the recommendation.
+    Contributions are sorted by size; ?top=N keeps the N largest.
+    """
+    registry.refresh()
+    risk_table.refresh(RISK_REFRESH_SECONDS)
+    t = time.perf_counter()
+    row, features_used = derive_features(request)
+    t = metrics.lap('/explain', 'derive_features', t)
+    bundle = registry.current
+    bias, probabilities, contributions = explain_rows(np.array([row]), bundle)
+    t = metrics.lap('/explain', 'model', t)
+
+    index = int(np.argmax(probabilities[0]))
+    order = np.argsort(-np.abs(contributions[0, :, index]), kind='stable')
+    if top > 0:
+        order = order[:top]
+    response = FastJSONResponse({
+        "recommendation": bundle.class_names[index],
+        "confidence": float(probabilities[0, index]),
+        "probabilities": dict(zip(bundle.class_names, probabilities[0].tolist())),
+        "features_used": features_used,
+        "explanation": {
+            "class": bundle.class_names[index],
+            "base_value": float(bias[index]),
+            "contributions": [
+                {"feature": FEATURE_NAMES[i], "value": float(row[i]), "contribution": float(contributions[0, i, index])}
+                for i in order
+            ],
+        },
+        "model_version": bundle.version,
+    })
+    metrics.lap('/explain', 'build_response', t)
+    return response
+
+@app.post("/batch-explain")
+def batch_explain(requests: List[Dict[str, Any]]):
+    """
+    Explanations for many cases in one vectorized pass.
+
+    Per case: recommendation, confidence and the contributions to the
+    recommended class as an array in "features" order (see /explain);
+    invalid cases come back as {"index": i, "error": ...}.
+    """
+    registry.refresh()
+    risk_table.refresh(RISK_REFRESH_SECONDS)
+    t = time.perf_counter()
+    metrics.observe('ml_api_batch_size', len(requests), endpoint='/batch-explain')
+    results: List[Any] = [None] * len(requests)
+    valid = []
+    for i, raw in enumerate(requests):
+        try:
+            valid.append((i, PredictionRequest.model_validate(raw)))
+        except Exception as e:
+            results[i] = {"index": i, "error": str(e)}
+
+    bundle = registry.current
+    bias = np.zeros(len(bundle.class_names))
+    if valid:
+        features = derive_feature_matrix(requests_to_columns([req for _, req in valid]))
+        t = metrics.lap('/batch-explain', 'derive_features', t)
+        bias, probabilities, contributions = explain_rows(features, bundle)
+        t = metrics.lap('/batch-explain', 'model', t)
+        best = probabilities.argmax(axis=1)
+        for position, (i, _) in enumerate(valid):
+            index = best[position]
+            results[i] = {
+                "index": i,
+                "recommendation": bundle.class_names[index],
+                "confidence": float(probabilities[position, index]),
+                "contributions": contributions[position, :, index],
+            }
+
+    response = FastJSONResponse({
+        "classes": bundle.class_names,
+        "features": FEATURE_NAMES,
+        "base_values": bias,
+        "explanations": results,
+    })
+    metrics.lap('/batch-explain', 'build_response', t)
+    return response
+
+# === Streaming (NDJSON) scoring ===
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose content reads the request body while it streams.
+
+    The default implementation also listens on receive() for a disconnect,
+    which would swallow the body chunks; here a disconnect surfaces as
+    ClientDisconnect from request.stream() instead.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+def score_ndjson_chunk(lines: List[bytes], first_index: int, bundle) -> bytes:
+    """
+    Validate, derive and score one chunk of NDJSON request lines with a
+    single model call. Returns the result lines, in input order.
+    """
+    t = time.perf_counter()
+    results: List[Any] = [None] * len(lines)
+    requests = []
+    offsets = []
+    for offset, line in enumerate(lines):
+        try:
+            requests.append(PredictionRequest.model_validate_json(line))
+            offsets.append(offset)
+        except Exception as e:
+            results[offset] = {"index": first_index + offset, "error": str(e)}
+
+    if requests:
+        features = derive_feature_matrix(requests_to_columns(requests))
+        t = metrics.lap('/batch-predict/ndjson', 'derive_features', t)
+        probabilities, tiers = score_live(bundle, features)
+        t = metrics.lap('/batch-predict/ndjson', 'model', t)
+        for offset, probs, tier in zip(offsets, probabilities, tiers):
+            results[offset] = {"index": first_index + offset, **build_compact(probs, bundle, TIERS[tier])}
+
+    output = b"".join(dumps(result) + b"\n" for result in results)
+    metrics.lap('/batch-predict/ndjson', 'build_response', t)
+    metrics.observe('ml_api_batch_size', len(lines), endpoint='/batch-predict/ndjson')
+    return output
+
+async def stream_ndjson_predictions(body, bundle):
+    """
+    Read request lines as they arrive and yield scored chunks.
+
+    At most one chunk of lines is held at a time. The next chunk is only
+    read after the previous output has been sent, so a slow client slows
+    down reading the upload instead of growing buffers.
+    """
+    buffer = b""
+    lines: List[bytes] = []
+    next_index = 0
+
+    async for data in body:
+        buffer += data
+        *complete, buffer = buffer.split(b"\n")
+        if len(buffer) > STREAM_MAX_LINE_BYTES:
+            yield dumps({"index": next_index + len(lines), "error": "Line too long, stream aborted"}) + b"\n"
+            return
+        lines.extend(line for line in complete if line.strip())
+        while len(lines) >= STREAM_CHUNK_ROWS:
+            chunk, lines = lines[:STREAM_CHUNK_ROWS], lines[STREAM_CHUNK_ROWS:]
+            yield await asyncio.to_thread(score_ndjson_chunk, chunk, next_index, bundle)
+            next_index += len(chunk)
+
+    if buffer.strip():
+        lines.append(buffer)
+    if lines:
+        yield await asyncio.to_thread(score_ndjson_chunk, lines, next_index, bundle)
+
+@app.post("/batch-predict/ndjson")
+async def batch_predict_ndjson(request: Request):
+    """
+    Streaming scoring for inputs of any size.
+
+    The body is NDJSON, one PredictionRequest per line. Lines are scored in
+    chunks of ML_STREAM_CHUNK_ROWS and every result is streamed back as an
+    NDJSON line: {"index", "recommendation", "confidence", "probabilities"}
+    (plus "tier" with ML_CASCADE/ML_EARLY_EXIT) or {"index", "error"}, with index
+    counting the non-empty input lines.
+    The class order of "probabilities" is in the X-Model-Classes header.
+    The whole stream is scored by the model version active at its start.
+    """
+    registry.refresh()
+    risk_table.refresh(RISK_REFRESH_SECONDS)
+    bundle = registry.current
+    return DuplexStreamingResponse(
+        stream_ndjson_predictions(request.stream(), bundle),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={
+            "X-Model-Classes": ",".join(bundle.class_names),
+            "X-Model-Version": bundle.version,
+        }
+    )
+
+# === Columnar (Arrow IPC) scoring ===
+
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+def score_arrow_payload(payload: bytes, bundle) -> bytes:
+    """
+    Read an Arrow IPC request body, score its valid rows with one model
+    call and return the response as an Arrow IPC stream (see
+    batch_predict_arrow). Runs in a worker thread.
+    """
+    t = time.perf_counter()
+    try:
+        table = pa.ipc.open_stream(payload).read_all()
+        columns = arrow_to_columns(table, risk_table)
+    except (pa.ArrowInvalid, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid Arrow payload: {str(e)}")
+    metrics.observe('ml_api_batch_size', table.num_rows, endpoint='/batch-predict/arrow')
+
+    error = validate_columns(columns)
+    valid = error < 0
+    valid_columns = {name: values[valid] for name, values in columns.items()}
+    features = derive_feature_matrix(valid_columns)
+    t = metrics.lap('/batch-predict/arrow', 'derive_features', t)
+
+    n_classes = len(bundle.class_names)
+    probabilities = np.full((table.num_rows, n_classes), np.nan)
+    tiers = np.zeros(table.num_rows, dtype=np.int8)
+    if valid.any():
+        probabilities[valid], tiers[valid] = score_live(bundle, features)
+    t = metrics.lap('/batch-predict/arrow', 'model', t)
+
+    # Invalid rows are all-NaN; they are masked in the recommendation column
+    best = probabilities.argmax(axis=1).astype(np.int8)
+    result = pa.table(
+        {
+            "recommendation": pa.DictionaryArray.from_arrays(
+                pa.array(best, mask=~valid), pa.array(bundle.class_names)
+            ),
+            "confidence": pa.array(probabilities.max(axis=1)),
+            "probabilities": pa.FixedSizeListArray.from_arrays(pa.array(probabilities.ravel()), n_classes),
+            "error": pa.DictionaryArray.from_arrays(
+                pa.array(error, mask=valid), pa.array(REQUEST_ERRORS)
+            ),
+        },
+        metadata={
+            "classes": json.dumps(bundle.class_names),
+            "model_version": bundle.version,
+        }
+    )
+    if bundle.tiered:
+        result = result.append_column("tier", pa.DictionaryArray.from_arrays(
+            pa.array(tiers, mask=~valid), pa.array(TIERS)
+        ))
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, result.schema) as writer:
+        writer.write_table(result)
+    metrics.lap('/batch-predict/arrow', 'build_response', t)
+    return sink.getvalue().to_pybytes()
+
+@app.post("/batch-predict/arrow")
+async def batch_predict_arrow(request: Request):
+    """
+    High-volume columnar scoring.
+
+    The body is an Arrow IPC stream with the PredictionRequest fields as
+    columns (income_source, age_category and gemeentecode as strings).
+    Features are derived on whole columns and scored in one call. The response is an
+    Arrow IPC stream with, per input row:
+    - recommendation: dictionary-encoded string (null for invalid rows)
+    - confidence: float64
+    - probabilities: fixed-size list of float64 in the class order stored
+      in the schema metadata ("classes")
+    - error: dictionary-encoded validation message (null for valid rows)
+    - tier: "full", "fast" or "early" (only with ML_CASCADE or ML_EARLY_EXIT)
+    """
+    if pa is None:
+        raise HTTPException(status_code=501, detail="pyarrow is not installed")
+
+    registry.refresh()
+    risk_table.refresh(RISK_REFRESH_SECONDS)
+    payload = await request.body()
+    # Parsing, deriving and scoring a large table off the event loop, so the
+    # micro-batcher and concurrent /predict calls keep running
+    content = await asyncio.to_thread(score_arrow_payload, payload, registry.current)
+    return Response(content=content, media_type=ARROW_MEDIA_TYPE)
+
+METRIC_PATHS.update(route.path for route in app.routes)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    port = int(os.getenv('ML_API_PORT', '8000'))
+    workers = int(os.getenv('ML_WORKERS', '1'))
+    if workers > 1:
+        # Write the flat artifact once so every worker maps the same files
+        ensure_flat_model(registry.current.path)
+        uvicorn.run("model_api:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Versioned model registry with hot swapping for the ML API.
+
+Layout of the registry directory (default: models/):
+
+    models/
+        ACTIVE                      {"version": "...", "previous": "..."}
+        20251103-214132/
+            debt_model_v2.joblib
+            scaler_v2.joblib
+            label_encoder_v2.joblib
+            feature_names_v2.json
+            model_metadata_v2.json
+            debt_model_v2_flat/
+
+Without a registry (no ACTIVE file) the artifacts in the working directory
+are served as version "local", as before.
+
+Usage:
+    python3 model_registry.py list
+    python3 model_registry.py publish [version]   # copy ./ artifacts into the registry
+    python3 model_registry.py activate <version>
+    python3 model_registry.py rollback
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import joblib
+import numpy as np
+
+from feature_pipeline import FEATURE_NAMES
+from flat_forest import ARRAY_KEYS, FlatForest, export_forest, save_forest
+from inference_runtime import runtime
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = 'debt_model_v2.joblib'
+SCALER_FILE = 'scaler_v2.joblib'
+LABEL_ENCODER_FILE = 'label_encoder_v2.joblib'
+FEATURE_NAMES_FILE = 'feature_names_v2.json'
+METADATA_FILE = 'model_metadata_v2.json'
+FLAT_MODEL_DIR = 'debt_model_v2_flat'
+
+ARTIFACT_FILES = [MODEL_FILE, SCALER_FILE, LABEL_ENCODER_FILE, FEATURE_NAMES_FILE, METADATA_FILE]
+ACTIVE_FILE = 'ACTIVE'
+LOCAL_VERSION = 'local'
+
+# Which trees answered a row, as returned by ModelBundle.predict_tiered:
+# all of them, the cascade's first tier, or an early exit
+TIERS = ['full', 'fast', 'early']
+
+
+def artifact_signature(path: str) -> tuple:
+    """Modification time and size of every model artifact in a directory."""
+    signature = []
+    for name in ARTIFACT_FILES:
+        file_path = os.path.join(path, name)
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def load_model(path: str):
+    """Unpickle the sklearn forest with the serving thread budget applied."""
+    return runtime.apply_to_model(joblib.load(os.path.join(path, MODEL_FILE)))
+
+
+def flat_model_is_fresh(path: str) -> bool:
+    """True when the flat artifact is newer than the forest and has every array."""
+    flat_path = os.path.join(path, FLAT_MODEL_DIR)
+    meta_path = os.path.join(flat_path, 'meta.json')
+    return (os.path.exists(meta_path)
+            and os.path.getmtime(meta_path) >= os.path.getmtime(os.path.join(path, MODEL_FILE))
+            and all(os.path.exists(os.path.join(flat_path, f"{key}.npy")) for key in ARRAY_KEYS))
+
+
+def ensure_flat_model(path: str):
+    """Export the flattened forest to disk unless an up-to-date one exists."""
+    if not flat_model_is_fresh(path):
+        model = load_model(path)
+        scaler = joblib.load(os.path.join(path, SCALER_FILE))
+        save_forest(export_forest(model, scaler), os.path.join(path, FLAT_MODEL_DIR))
+
+
+class ModelBundle:
+    """All artifacts of one model version, loaded and ready to score."""
+
+    def __init__(self, version: str, path: str, mmap: bool = True, cascade: bool = False,
+                 early_exit: bool = False, early_exit_min_rows: Optional[int] = None):
+        self.version = version
+        self.path = path
+        self.signature = (version, artifact_signature(path))
+        self.loaded_at = datetime.now().isoformat()
+
+        self.scaler = joblib.load(os.path.join(path, SCALER_FILE))
+        self.label_encoder = joblib.load(os.path.join(path, LABEL_ENCODER_FILE))
+        self.class_names = [str(label) for label in self.label_encoder.classes_]
+        with open(os.path.join(path, FEATURE_NAMES_FILE), 'r') as f:
+            self.feature_names = json.load(f)
+        if self.feature_names != FEATURE_NAMES:
+            raise ValueError(
+                f"Model version {version} was trained on other features than feature_pipeline.FEATURE_NAMES"
+            )
+        with open(os.path.join(path, METADATA_FILE), 'r') as f:
+            self.config = json.load(f)
+
+        # Flattened forest with the scaler folded into the thresholds. The
+        # sklearn forest is only unpickled when the flat artifact is stale.
+        if flat_model_is_fresh(path):
+            self.flat_model = FlatForest.load(os.path.join(path, FLAT_MODEL_DIR), mmap=mmap)
+        else:
+            model = load_model(path)
+            self.flat_model = FlatForest.from_model(model, self.scaler)
+
+        # First-tier trees and confidence threshold calibrated by training
+        # (see flat_forest.calibrate_cascade); None = always the full forest
+        self.cascade = self.config.get('cascade') if cascade else None
+        # Stop evaluating trees once a row's recommendation is decided, in
+        # calls of at least early_exit_min_rows rows (None = FlatForest default)
+        self.early_exit = early_exit
+        self.early_exit_min_rows = early_exit_min_rows
+        self.tiered = self.cascade is not None or early_exit
+
+    @property
+    def classes(self):
+        return self.label_encoder.classes_
+
+    @property
+    def scoring_mode(self) -> str:
+        """How predict_tiered() scores: 'full', 'cascade', 'early_exit' or 'cascade+early_exit'."""
+        modes = [name for name, on in (('cascade', self.cascade is not None), ('early_exit', self.early_exit)) if on]
+        return '+'.join(modes) or 'full'
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        return self.flat_model.predict_proba(features)
+
+    def predict_tiered(self, features: np.ndarray):
+        """
+        Score through the cascade and/or early exit when enabled. Returns
+        (probabilities, tiers) with per row an index into TIERS; "fast" and
+        "early" probabilities are approximate.
+        """
+        forest = self.flat_model
+        if self.cascade is not None:
+            probabilities, trees_used = forest.predict_proba_cascade(
+                features, self.cascade['trees'], self.cascade['threshold'], early_exit=self.early_exit,
+                min_rows=self.early_exit_min_rows
+            )
+        elif self.early_exit:
+            probabilities, trees_used = forest.predict_proba_early_exit(features, min_rows=self.early_exit_min_rows)
+        else:
+            return self.predict_proba(features), np.zeros(len(features), dtype=np.int8)
+
+        tiers = np.where(trees_used < forest.n_trees, 2, 0).astype(np.int8)
+        if self.cascade is not None:
+            tiers[trees_used == self.cascade['trees']] = 1
+        return probabilities, tiers
+
+    def warm(self, rows: int = 64):
+        """Score a dummy batch so the first live request doesn't pay for page faults."""
+        self.predict_proba(np.zeros((rows, len(self.feature_names))))
+
+
+class ModelRegistry:
+    """
+    Holds the active ModelBundle and swaps it without downtime.
+
+    A new version is loaded and warmed while the old one keeps serving;
+    then the reference is replaced in one assignment. Other API workers pick
+    up the change through the ACTIVE file (see refresh()).
+    """
+
+    def __init__(self, root: str = 'models', local_path: str = '.', mmap: bool = True,
+                 cascade: bool = False, early_exit: bool = False, early_exit_min_rows: Optional[int] = None,
+                 load: bool = True):
+        self.root = root
+        self.local_path = local_path
+        self.mmap = mmap
+        self.cascade = cascade
+        self.early_exit = early_exit
+        self.early_exit_min_rows = early_exit_min_rows
+        self._lock = threading.Lock()
+        self._loading: Optional[str] = None
+        self._checked_at = 0.0
+        self._active_mtime = None
+        self.last_error: Optional[str] = None
+        # load=False: only manage the ACTIVE file and the version directories (the CLI)
+        self.current = self._load(self.active_version()) if load else None
+        self._active_mtime = self._active_file_mtime()
+
+    # === Registry layout ===
+
+    @property
+    def active_path(self) -> str:
+        return os.path.join(self.root, ACTIVE_FILE)
+
+    def _active_file_mtime(self):
+        try:
+            return os.stat(self.active_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _active_record(self) -> Dict[str, Any]:
+        try:
+            with open(self.active_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def active_version(self) -> str:
+        """The version named in ACTIVE ("local" without one)."""
+        return self._active_record().get('version') or LOCAL_VERSION
+
+    def previous_version(self) -> str:
+        """The version that was active before the current one."""
+        previous = self._active_record().get('previous')
+        if not previous:
+            raise ValueError("No previous model version to roll back to")
+        return previous
+
+    def _write_active(self, version: str, previous: Optional[str]):
+        """Atomically point ACTIVE at a version."""
+        tmp_path = f"{self.active_path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': version,
+                'previous': previous,
+                'activated_at': datetime.now().isoformat()
+            }, f, indent=2)
+        os.replace(tmp_path, self.active_path)
+        self._active_mtime = self._active_file_mtime()
+
+    def version_path(self, version: str) -> str:
+        if version == LOCAL_VERSION:
+            return self.local_path
+        return os.path.join(self.root, version)
+
+    def versions(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, MODEL_FILE))
+        )
+
+    def _load(self, version: str) -> ModelBundle:
+        path = self.version_path(version)
+        if not os.path.exists(os.path.join(path, MODEL_FILE)):
+            raise ValueError(f"Unknown model version: {version}")
+        return ModelBundle(version, path, mmap=self.mmap, cascade=self.cascade, early_exit=self.early_exit,
+                           early_exit_min_rows=self.early_exit_min_rows)
+
+    def load(self, version: str) -> ModelBundle:
+        """Load and warm a version without activating it (e.g. as shadow candidate)."""
+        bundle = self._load(version)
+        bundle.warm()
+        return bundle
+
+    # === Swapping ===
+
+    def activate(self, version: str) -> ModelBundle:
+        """
+        Load, warm and swap in a version, then record it in ACTIVE.
+        The current bundle keeps serving until the new one is ready.
+        """
+        with self._lock:
+            bundle = self._load(version)
+            bundle.warm()
+            previous = self.current.version
+            self.current = bundle
+            os.makedirs(self.root, exist_ok=True)
+            self._write_active(version, previous)
+            self.last_error = None
+            logger.info(f"Activated model version {version} (was {previous})")
+            return bundle
+
+    def rollback(self) -> ModelBundle:
+        """Re-activate the version that was active before the current one."""
+        return self.activate(self.previous_version())
+
+    def set_active(self, version: str):
+        """
+        Point ACTIVE at a version without loading it; running API workers
+        load it on their next refresh().
+        """
+        if not os.path.exists(os.path.join(self.version_path(version), MODEL_FILE)):
+            raise ValueError(f"Unknown model version: {version}")
+        os.makedirs(self.root, exist_ok=True)
+        self._write_active(version, self.active_version())
+
+    def refresh(self, interval: float = 1.0):
+        """
+        Follow changes made by other workers or by retraining in place.
+
+        At most once per interval, compare the ACTIVE file (or, in local
+        mode, the artifact files) with what is loaded; on a change, load the
+        new version on a background thread and keep serving meanwhile.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < interval or self._loading is not None:
+            return
+        # Check and claim the swap under the lock, so concurrent callers
+        # start at most one; while a swap or activate() holds it, skip
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if now - self._checked_at < interval or self._loading is not None:
+                return
+            self._checked_at = now
+
+            active_mtime = self._active_file_mtime()
+            if active_mtime != self._active_mtime:
+                self._active_mtime = active_mtime
+                version = self.active_version()
+                if version == self.current.version:
+                    return
+            elif (self.current.version == LOCAL_VERSION
+                  and artifact_signature(self.local_path) != self.current.signature[1]):
+                version = LOCAL_VERSION
+            else:
+                return
+
+            self._loading = version
+        finally:
+            self._lock.release()
+        threading.Thread(target=self._background_swap, args=(version,), daemon=True).start()
+
+    def _background_swap(self, version: str):
+        try:
+            with self._lock:
+                bundle = self._load(version)
+                bundle.warm()
+                self.current = bundle
+                self.last_error = None
+            logger.info(f"Reloaded model version {version}")
+        except Exception as e:
+            self.last_error = f"{version}: {e}"
+            logger.error(f"Reloading model version {version} failed: {e}")
+        finally:
+            self._loading = None
+
+    def status(self) -> Dict[str, Any]:
+        record = self._active_record()
+        return {
+            "active": self.current.version if self.current is not None else self.active_version(),
+            "loaded_at": self.current.loaded_at if self.current is not None else None,
+            "previous": record.get('previous'),
+            "loading": self._loading,
+            "last_error": self.last_error,
+            "versions": self.versions(),
+        }
+
+
+def publish(root: str = 'models', source: str = '.', version: Optional[str] = None) -> str:
+    """Copy the artifacts from a training run into a new registry version."""
+    version = version or datetime.now().strftime('%Y%m%d-%H%M%S')
+    target = os.path.join(root, version)
+    if os.path.exists(target):
+        raise ValueError(f"Model version already exists: {version}")
+
+    tmp_target = f"{target}.tmp-{os.getpid()}"
+    os.makedirs(tmp_target)
+    for name in ARTIFACT_FILES:
+        shutil.copy2(os.path.join(source, name), os.path.join(tmp_target, name))
+    # Keep a compressed flat forest (compress_forest.py) instead of re-exporting
+    if flat_model_is_fresh(source):
+        shutil.copytree(os.path.join(source, FLAT_MODEL_DIR), os.path.join(tmp_target, FLAT_MODEL_DIR))
+    ensure_flat_model(tmp_target)
+    os.rename(tmp_target, target)
+    return version
+
+
+def main():
+    root = os.getenv('ML_MODEL_REGISTRY', 'models')
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+
+    if command == 'publish':
+        version = publish(root, '.', sys.argv[2] if len(sys.argv) > 2 else None)
+        print(f"✅ Published model version {version} in {root}/")
+        print(f"   Activate with: python3 model_registry.py activate {version}")
+    elif command in ('activate', 'rollback', 'list'):
+        # Only the ACTIVE file changes; the API workers load the model
+        registry = ModelRegistry(root, load=False)
+        if command == 'activate':
+            registry.set_active(sys.argv[2])
+        elif command == 'rollback':
+            registry.set_active(registry.previous_version())
+        status = registry.status()
+        print(f"Active: {status['active']} (previous: {status['previous']})")
+        for version in status['versions']:
+            marker = '*' if version == status['active'] else ' '
+            print(f"  {marker} {version}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
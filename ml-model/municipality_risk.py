@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Per-gemeente CBS risk percentages for the API.
+
+Training uses three municipality figures from cbs_kenmerken as features:
+income_risk (Laag huishoudinkomen), unemployment_risk (Werkzoekende in
+huishouden) and social_benefit_risk (Bijstandsuitkering in huishouden),
+averaged over the same years and with the same filters and defaults as
+extract_training_data_v2.py.
+
+The table is an array indexed by the number in the gemeentecode (GM0363 ->
+row 363), so a lookup is one index operation. It is built from the database
+once, saved as a snapshot next to the model, and rebuilt in the background;
+requests never wait for the database.
+
+Usage:
+    python3 municipality_risk.py      # rebuild municipality_risk.json from the database
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Sequence
+
+import numpy as np
+
+try:
+    import psycopg2
+except ImportError:  # the API can still serve from the snapshot
+    psycopg2 = None
+
+from cbs_config import DEFAULT_DSN, cbs_dsn
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = 'municipality_risk.json'
+
+# (feature, cbs_kenmerken label, default when a gemeente has no figure)
+RISK_LABELS = [
+    ('income_risk', 'Laag huishoudinkomen', 30.0),
+    ('unemployment_risk', 'Werkzoekende in huishouden', 45.0),
+    ('social_benefit_risk', 'Bijstandsuitkering in huishouden', 45.0),
+]
+RISK_FEATURES = [feature for feature, _, _ in RISK_LABELS]
+
+# GM0000 - GM9999
+TABLE_SIZE = 10000
+
+RISK_QUERY = """
+SELECT gemeentecode, label, AVG(percentage) AS percentage
+FROM cbs_kenmerken
+WHERE jaar IN ('2023-01', '2024-01')
+    AND schuldenaren LIKE '%%Met geregistreerde%%'
+    AND percentage IS NOT NULL
+    AND label IN ({labels})
+GROUP BY gemeentecode, label
+"""
+
+
+def code_index(code: Optional[str]) -> int:
+    """Row of a gemeentecode like 'GM0363' in the table, -1 if it is not one."""
+    if code and len(code) == 6 and code.startswith('GM') and code[2:].isdigit():
+        return int(code[2:])
+    return -1
+
+
+def query_risks(dsn: str = DEFAULT_DSN) -> Dict[str, list]:
+    """Average risk percentages per gemeente from cbs_kenmerken."""
+    if psycopg2 is None:
+        raise RuntimeError("psycopg2 is not installed")
+    conn = psycopg2.connect(dsn)
+    try:
+        cursor = conn.cursor()
+        labels = [label for _, label, _ in RISK_LABELS]
+        cursor.execute(RISK_QUERY.format(labels=", ".join(["%s"] * len(labels))), labels)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    column = {label: index for index, (_, label, _) in enumerate(RISK_LABELS)}
+    risks: Dict[str, list] = {}
+    for code, label, percentage in rows:
+        values = risks.setdefault(code, [default for _, _, default in RISK_LABELS])
+        values[column[label]] = float(percentage)
+    return risks
+
+
+def save_snapshot(risks: Dict[str, list], path: str = SNAPSHOT_FILE) -> str:
+    """Write the risk percentages atomically; returns the build timestamp."""
+    built_at = datetime.now().isoformat()
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump({'built_at': built_at, 'features': RISK_FEATURES, 'risks': risks}, f)
+    os.replace(tmp_path, path)
+    return built_at
+
+
+class MunicipalityRiskTable:
+    """
+    Array-indexed CBS risk percentages per gemeente, swapped in as a whole on
+    refresh. Without a dsn the table only comes from the snapshot: it never
+    connects, rebuilds or writes the snapshot.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_FILE, dsn: Optional[str] = None):
+        self.path = path
+        self.dsn = dsn
+        self.values = np.full((TABLE_SIZE, len(RISK_LABELS)), np.nan)
+        self.count = 0
+        self.built_at: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self._checked_at = time.monotonic()
+        self._loading = False
+
+        if os.path.exists(path):
+            self._load_snapshot()
+        elif dsn:
+            try:
+                self.rebuild()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"No municipality risk table: {e}")
+
+    def _set(self, risks: Dict[str, list], built_at: str):
+        values = np.full((TABLE_SIZE, len(RISK_LABELS)), np.nan)
+        for code, risk in risks.items():
+            index = code_index(code)
+            if index >= 0:
+                values[index] = risk
+        # One assignment, so lookups see either the old or the new table
+        self.values = values
+        self.count = int((~np.isnan(values[:, 0])).sum())
+        self.built_at = built_at
+
+    def _load_snapshot(self):
+        with open(self.path, 'r') as f:
+            snapshot = json.load(f)
+        self._set(snapshot['risks'], snapshot['built_at'])
+
+    def rebuild(self):
+        """Query the database, swap in the new table and save the snapshot."""
+        risks = query_risks(self.dsn)
+        self._set(risks, save_snapshot(risks, self.path))
+        self.last_error = None
+
+    def refresh(self, interval: float = 3600.0):
+        """At most once per interval, rebuild the table on a background thread."""
+        now = time.monotonic()
+        if not self.dsn or interval <= 0 or self._loading or now - self._checked_at < interval:
+            return
+        self._checked_at = now
+        self._loading = True
+        threading.Thread(target=self._background_rebuild, daemon=True).start()
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+            logger.info(f"Reloaded municipality risk table ({self.count} gemeenten)")
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Reloading municipality risk table failed: {e}")
+        finally:
+            self._loading = False
+
+    def lookup(self, codes: Sequence[Optional[str]]) -> np.ndarray:
+        """(N, 3) risk percentages in RISK_FEATURES order; NaN rows for unknown codes."""
+        indices = np.array([code_index(code) for code in codes], dtype=np.intp)
+        risks = self.values[indices]
+        risks[indices < 0] = np.nan
+        return risks
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "municipalities": self.count,
+            "built_at": self.built_at,
+            "snapshot": self.path,
+            "loading": self._loading,
+            "last_error": self.last_error,
+        }
+
+
+def main():
+    risks = query_risks(cbs_dsn())
+    save_snapshot(risks, SNAPSHOT_FILE)
+    print(f"✅ Saved risk percentages of {len(risks)} gemeenten to {SNAPSHOT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Bounded LRU/TTL cache for model predictions.
+
+Entries are keyed on the derived 20-element feature vector, so requests that
+differ only in fields the model never sees share one entry.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+class PredictionCache:
+    """
+    LRU cache with a time-to-live, keyed on feature rows.
+
+    The cache remembers a signature of the model artifact it was filled
+    with; check_signature() clears it as soon as that signature changes.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl_seconds: float = 3600.0,
+        quantize: Optional[int] = None
+    ):
+        """
+        Args:
+            max_size: Maximum number of cached feature vectors
+            ttl_seconds: Lifetime of an entry (0 = no expiry)
+            quantize: Round features to this many decimals in the key (None = exact)
+        """
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self.quantize = quantize
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._signature = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def key(self, row) -> tuple:
+        """Build the cache key for one feature row."""
+        if self.quantize is None:
+            return tuple(float(v) for v in row)
+        return tuple(round(float(v), self.quantize) for v in row)
+
+    def get(self, key: tuple) -> Optional[np.ndarray]:
+        """Return the cached probabilities for a key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            probabilities, stored_at = entry
+            if self.ttl and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return probabilities
+
+    def put(self, key: tuple, probabilities: np.ndarray):
+        """Store probabilities for a key, evicting the least recently used entry."""
+        probabilities = np.array(probabilities, dtype=np.float64)
+        probabilities.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (probabilities, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def check_signature(self, signature: Any):
+        """Clear the cache when the model artifact signature has changed."""
+        if signature == self._signature:
+            return
+        with self._lock:
+            if self._signature is not None:
+                self._entries.clear()
+                self.invalidations += 1
+            self._signature = signature
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "quantize": self.quantize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,150 @@
+"""
+Shadow scoring of a candidate model on live traffic.
+
+Every feature matrix the live model scores is handed to submit() together
+with the live probabilities. A background thread scores it with the
+candidate and aggregates agreement and latency. The candidate goes through
+predict_tiered() like the live model, so with ML_CASCADE/ML_EARLY_EXIT both
+sides do the same kind of work (each with its own calibrated cascade); the
+report names the scoring mode of either side. submit() never waits: when
+the bounded queue is full the batch is dropped, so the request path only
+pays for one put_nowait().
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowScorer:
+    """Scores live batches with a candidate ModelBundle on a worker thread."""
+
+    def __init__(self, candidate, max_queue: int = 64, latency_window: int = 1000):
+        """
+        Args:
+            candidate: ModelBundle to compare against the live model
+            max_queue: Maximum number of batches waiting for the candidate
+            latency_window: Number of recent batches in the latency percentiles
+        """
+        self.candidate = candidate
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._latency_window = latency_window
+        self._lock = threading.Lock()
+        self._reset(None)
+        # Counted over the scorer's lifetime, also across live versions
+        self.dropped_batches = 0
+        self.dropped_rows = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _reset(self, live_version):
+        self.live_version = live_version
+        self.live_mode = None
+        self.live_classes = None
+        self.started_at = time.time()
+        self.batches = 0
+        self.rows = 0
+        self.agreed = 0
+        self.abs_diff_sum = 0.0
+        self.errors = 0
+        self.confusion = None
+        self.live_seconds: deque = deque(maxlen=self._latency_window)
+        self.candidate_seconds: deque = deque(maxlen=self._latency_window)
+
+    def submit(self, features: np.ndarray, probabilities: np.ndarray, live_seconds: float, live_bundle):
+        """Queue a scored live batch for the candidate, or drop it when the queue is full."""
+        try:
+            self._queue.put_nowait((features, probabilities, live_seconds, live_bundle))
+        except queue.Full:
+            with self._lock:
+                self.dropped_batches += 1
+                self.dropped_rows += len(features)
+
+    def stop(self):
+        """Stop the worker once it finishes the current batch; queued batches are discarded."""
+        self._stopped = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None or self._stopped:
+                return
+            features, probabilities, live_seconds, live_bundle = item
+            try:
+                start = time.perf_counter()
+                candidate_probabilities, _ = self.candidate.predict_tiered(features)
+                candidate_seconds = time.perf_counter() - start
+                self._record(probabilities, candidate_probabilities, live_seconds, candidate_seconds, live_bundle)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                logger.error(f"Shadow scoring with {self.candidate.version} failed: {e}")
+
+    def _record(self, live, candidate, live_seconds, candidate_seconds, live_bundle):
+        # Compare by class name, the candidate may order its classes differently
+        order = [self.candidate.class_names.index(name) for name in live_bundle.class_names]
+        candidate = candidate[:, order]
+        live_best = live.argmax(axis=1)
+        candidate_best = candidate.argmax(axis=1)
+
+        with self._lock:
+            # Agreement only means something against one live version
+            if live_bundle.version != self.live_version:
+                self._reset(live_bundle.version)
+                self.live_mode = live_bundle.scoring_mode
+                self.live_classes = list(live_bundle.class_names)
+                self.confusion = np.zeros((len(order), len(order)), dtype=np.int64)
+            self.batches += 1
+            self.rows += len(live)
+            self.agreed += int((live_best == candidate_best).sum())
+            self.abs_diff_sum += float(np.abs(live - candidate).max(axis=1).sum())
+            np.add.at(self.confusion, (live_best, candidate_best), 1)
+            self.live_seconds.append(live_seconds)
+            self.candidate_seconds.append(candidate_seconds)
+
+    @staticmethod
+    def _percentiles(seconds) -> Dict[str, Any]:
+        if not seconds:
+            return {"p50_ms": None, "p99_ms": None}
+        values = np.fromiter(seconds, dtype=np.float64) * 1000
+        return {"p50_ms": float(np.percentile(values, 50)), "p99_ms": float(np.percentile(values, 99))}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            confusion = None
+            if self.confusion is not None:
+                confusion = {
+                    live: dict(zip(self.live_classes, map(int, row)))
+                    for live, row in zip(self.live_classes, self.confusion)
+                }
+            return {
+                "candidate_version": self.candidate.version,
+                "live_version": self.live_version,
+                # Approximate tiers on either side make probabilities differ slightly
+                "scoring_mode": {"live": self.live_mode, "candidate": self.candidate.scoring_mode},
+                "since": self.started_at,
+                "batches": self.batches,
+                "rows": self.rows,
+                "agreement": self.agreed / self.rows if self.rows else None,
+                "mean_max_abs_diff": self.abs_diff_sum / self.rows if self.rows else None,
+                # live recommendation -> candidate recommendation -> rows
+                "confusion": confusion,
+                "queued_batches": self._queue.qsize(),
+                "dropped_batches": self.dropped_batches,
+                "dropped_rows": self.dropped_rows,
+                "errors": self.errors,
+                "live_latency": self._percentiles(self.live_seconds),
+                "candidate_latency": self._percentiles(self.candidate_seconds),
+            }
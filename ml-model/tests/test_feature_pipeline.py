@@ -0,0 +1,161 @@
+"""
+Feature parity: the API paths derive the same features as the training
+data the model was fitted on (extract_training_data_v2 + encode_features).
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from extract_training_data_v2 import PROFILE_DEFAULTS, generate_cases
+from feature_pipeline import (
+    AGE_CATEGORIES, FEATURE_NAMES, INCOME_SOURCES, REQUEST_COLUMNS, REQUEST_ERRORS,
+    arrow_to_columns, derive_feature_matrix, encode_features, reference_row, validate_columns
+)
+from municipality_risk import MunicipalityRiskTable, save_snapshot
+
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The income source a request gives for each training benefit_type
+INCOME_SOURCE_OF_BENEFIT = {
+    'bijstand': 'BENEFIT_SOCIAL',
+    'ww': 'BENEFIT_UNEMPLOYMENT',
+    'ao': 'BENEFIT_DISABILITY',
+    'none': 'EMPLOYMENT',
+}
+
+
+@pytest.fixture(scope='module')
+def profiles():
+    return pd.DataFrame([
+        {'gemeentecode': 'GM0007', 'gemeentenaam': 'Gemeente 7', **PROFILE_DEFAULTS},
+        {'gemeentecode': 'GM0363', 'gemeentenaam': 'Gemeente 363',
+         **dict(PROFILE_DEFAULTS, income_low_pct=41.5, werkloosheid_pct=12.0, bijstand_pct=22.5)},
+        {'gemeentecode': 'GM0599', 'gemeentenaam': 'Gemeente 599',
+         **dict(PROFILE_DEFAULTS, income_low_pct=18.0, werkloosheid_pct=60.0, bijstand_pct=70.0)},
+    ])
+
+
+@pytest.fixture(scope='module')
+def cases(profiles):
+    return generate_cases(profiles, 3000, np.random.default_rng(0))
+
+
+@pytest.fixture
+def risk_table(profiles, tmp_path):
+    risks = {
+        row.gemeentecode: [row.income_low_pct, row.werkloosheid_pct, row.bijstand_pct]
+        for row in profiles.itertuples()
+    }
+    path = str(tmp_path / 'municipality_risk.json')
+    save_snapshot(risks, path)
+    return MunicipalityRiskTable(path, dsn=None)
+
+
+def random_request_columns(rng: np.random.Generator, n: int) -> dict:
+    return {
+        'debt_amount': rng.uniform(1, 5000, n).round(2),
+        'monthly_income': rng.uniform(500, 4000, n).round(2),
+        'income_source': rng.integers(0, len(INCOME_SOURCES), n),
+        'has_children': rng.random(n) < 0.5,
+        'num_children': rng.integers(0, 4, n),
+        'is_single_parent': rng.random(n) < 0.2,
+        'has_jeugdzorg': rng.random(n) < 0.1,
+        'other_debts_count': rng.integers(0, 6, n),
+        'age_category': rng.integers(0, len(AGE_CATEGORIES), n),
+    }
+
+
+def test_feature_names_match_trained_model():
+    with open(os.path.join(MODEL_DIR, 'feature_names_v2.json'), 'r') as f:
+        assert json.load(f) == FEATURE_NAMES
+
+
+def test_api_features_match_training_data(profiles, cases, risk_table):
+    # A request only carries the income source: keep the training cases
+    # whose work and benefit flags follow from it
+    benefit_type = cases['benefit_type'].astype(str)
+    representable = (~cases['has_flex_work'] & ~cases['is_zzp']
+                     & (cases['is_unemployed'] == (benefit_type == 'ww')))
+    train = cases[representable]
+    assert len(train) > 1000
+
+    code_of = dict(zip(profiles['gemeentenaam'], profiles['gemeentecode']))
+    requests = pa.table({
+        'debt_amount': train['debt_amount'],
+        'monthly_income': train['monthly_income'],
+        'income_source': benefit_type[representable].map(INCOME_SOURCE_OF_BENEFIT),
+        'has_children': train['has_children'],
+        'num_children': train['num_children'],
+        'is_single_parent': train['is_single_parent'],
+        'has_jeugdzorg': train['has_jeugdzorg'],
+        'other_debts_count': train['other_debts_count'],
+        'age_category': train['age_category'].astype(str),
+        'gemeentecode': train['municipality'].astype(str).map(code_of),
+    })
+    api = derive_feature_matrix(arrow_to_columns(requests, risk_table))
+    expected = encode_features(train)
+
+    ratio = FEATURE_NAMES.index('debt_to_income_ratio')
+    others = [index for index in range(len(FEATURE_NAMES)) if index != ratio]
+    np.testing.assert_array_equal(api[:, others], expected[:, others])
+    # The training data stores the ratio rounded to 3 decimals
+    np.testing.assert_allclose(api[:, ratio], expected[:, ratio], rtol=0, atol=1e-3)
+
+
+def test_vectorized_matches_row_by_row():
+    rng = np.random.default_rng(1)
+    columns = random_request_columns(rng, 2000)
+    expected = np.array([
+        reference_row({
+            **{name: values[i].item() for name, values in columns.items()},
+            'income_source': INCOME_SOURCES[columns['income_source'][i]],
+            'age_category': AGE_CATEGORIES[columns['age_category'][i]],
+        })
+        for i in range(2000)
+    ], dtype=np.float64)
+    np.testing.assert_array_equal(derive_feature_matrix(columns), expected)
+
+
+def test_arrow_unknown_and_missing_values():
+    rng = np.random.default_rng(2)
+    n = 2000
+    columns = random_request_columns(rng, n)
+    ages = AGE_CATEGORIES + ['young', 'MID', None]
+    age_values = [ages[i] for i in rng.integers(0, len(ages), n)]
+    nulls = {name: rng.random(n) < 0.1 for name in ('num_children', 'has_jeugdzorg', 'other_debts_count')}
+    table = pa.table({
+        **{name: pa.array(values, mask=nulls.get(name)) for name, values in columns.items()
+           if name not in ('income_source', 'age_category')},
+        'income_source': [INCOME_SOURCES[code] for code in columns['income_source']],
+        'age_category': age_values,
+    })
+    expected = np.array([
+        reference_row({
+            **{name: REQUEST_COLUMNS[name] if name in nulls and nulls[name][i] else values[i].item()
+               for name, values in columns.items()},
+            'income_source': INCOME_SOURCES[columns['income_source'][i]],
+            # Anything other than jong/oud is "mid", as in /predict
+            'age_category': age_values[i] if age_values[i] in ('jong', 'oud') else 'mid',
+        })
+        for i in range(n)
+    ], dtype=np.float64)
+    np.testing.assert_array_equal(derive_feature_matrix(arrow_to_columns(table)), expected)
+
+
+def test_validate_columns_reports_first_failing_rule():
+    table = pa.table({
+        'debt_amount': [100.0, 0.0, 100.0, 100.0, -1.0],
+        'monthly_income': [1000.0, 1000.0, 1000.0, 1000.0, 0.0],
+        'income_source': ['EMPLOYMENT', 'EMPLOYMENT', 'BIJSTAND', None, 'EMPLOYMENT'],
+        'num_children': [0, 0, 0, 0, -1],
+    })
+    error = validate_columns(arrow_to_columns(table))
+    assert error[0] == -1
+    assert REQUEST_ERRORS[error[1]] == "debt_amount must be > 0"
+    assert REQUEST_ERRORS[error[2]] == "unknown income_source"
+    assert REQUEST_ERRORS[error[3]] == "unknown income_source"
+    assert REQUEST_ERRORS[error[4]] == "debt_amount must be > 0"
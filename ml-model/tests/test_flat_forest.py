@@ -0,0 +1,96 @@
+"""
+FlatForest against the sklearn forest it was exported from.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+from extract_training_data_v2 import PROFILE_DEFAULTS, generate_cases
+from feature_pipeline import encode_features
+from flat_forest import FlatForest, export_forest, save_forest
+
+
+def training_matrix(seed, cases_per_gemeente):
+    profiles = pd.DataFrame([
+        {'gemeentecode': 'GM0007', 'gemeentenaam': 'Gemeente 7', **PROFILE_DEFAULTS},
+        {'gemeentecode': 'GM0363', 'gemeentenaam': 'Gemeente 363',
+         **dict(PROFILE_DEFAULTS, income_low_pct=41.5, werkloosheid_pct=12.0, bijstand_pct=22.5)},
+    ])
+    cases = generate_cases(profiles, cases_per_gemeente, np.random.default_rng(seed))
+    return encode_features(cases), cases['recommendation'].cat.codes.to_numpy()
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    X, y = training_matrix(0, 2000)
+    scaler = StandardScaler().fit(X)
+    # Same settings as train_model_v2.py, with fewer trees
+    model = RandomForestClassifier(
+        n_estimators=30, max_depth=15, min_samples_split=5, min_samples_leaf=2,
+        random_state=42, class_weight='balanced', n_jobs=1
+    ).fit(scaler.transform(X), y)
+    X_eval, _ = training_matrix(1, 600)
+    return model, scaler, X_eval
+
+
+@pytest.fixture(scope='module')
+def forest(fitted):
+    model, scaler, _ = fitted
+    return FlatForest.from_model(model, scaler)
+
+
+def test_probabilities_match_sklearn(fitted, forest):
+    model, scaler, X_eval = fitted
+    assert len(X_eval) > FlatForest.CHUNK_ROWS
+    expected = model.predict_proba(scaler.transform(X_eval))
+    for X in (X_eval, X_eval[:1]):
+        probabilities = forest.predict_proba(X)
+        np.testing.assert_allclose(probabilities, expected[:len(X)], rtol=0, atol=1e-12)
+        np.testing.assert_array_equal(probabilities.argmax(axis=1), expected[:len(X)].argmax(axis=1))
+
+
+def test_saved_forest_matches(fitted, forest, tmp_path):
+    model, scaler, X_eval = fitted
+    path = str(tmp_path / 'flat_forest')
+    save_forest(export_forest(model, scaler), path)
+    for mmap in (True, False):
+        loaded = FlatForest.load(path, mmap=mmap)
+        np.testing.assert_array_equal(loaded.predict_proba(X_eval), forest.predict_proba(X_eval))
+
+
+def test_varying_rows_match(fitted, forest):
+    _, _, X_eval = fitted
+    grid = np.repeat(X_eval[:1], 50, axis=0)
+    grid[:, 0] = np.linspace(X_eval[:, 0].min(), X_eval[:, 0].max(), 50)
+    np.testing.assert_allclose(forest.predict_proba_varying(grid), forest.predict_proba(grid),
+                               rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('min_rows', [1, None])
+def test_early_exit_keeps_recommendation(fitted, forest, min_rows):
+    _, _, X_eval = fitted
+    full = forest.predict_proba(X_eval)
+    for X, expected in ((X_eval, full), (X_eval[:8], full[:8])):
+        probabilities, trees_used = forest.predict_proba_early_exit(X, block_trees=5, min_rows=min_rows)
+        np.testing.assert_array_equal(probabilities.argmax(axis=1), expected.argmax(axis=1))
+        assert (trees_used <= forest.n_trees).all()
+    # Rows that ran all trees get the full probabilities
+    probabilities, trees_used = forest.predict_proba_early_exit(X_eval, block_trees=5, min_rows=min_rows)
+    done = trees_used == forest.n_trees
+    np.testing.assert_allclose(probabilities[done], full[done], rtol=0, atol=1e-12)
+
+
+def test_cascade(fitted, forest):
+    _, _, X_eval = fitted
+    full = forest.predict_proba(X_eval)
+    # No row reaches the threshold: every row gets the full forest
+    probabilities, trees_used = forest.predict_proba_cascade(X_eval, 10, threshold=1.1)
+    np.testing.assert_allclose(probabilities, full, rtol=0, atol=1e-12)
+    assert (trees_used == forest.n_trees).all()
+    # Every row reaches it: the first tier alone
+    probabilities, trees_used = forest.predict_proba_cascade(X_eval, 10, threshold=0.0)
+    first_tier = FlatForest({**forest.__dict__, 'roots': forest.roots[:10], 'max_depth': forest.max_depth})
+    np.testing.assert_allclose(probabilities, first_tier.predict_proba(X_eval), rtol=0, atol=1e-12)
+    assert (trees_used == 10).all()
@@ -1,8 +1,18 @@
 """
 Train ML Model - Version 2
 Uses enhanced training data with more CBS patterns
+
+Reads only the feature, label and gemeente columns of the Parquet training
+data (training_store.py), optionally only some partitions.
+
+Usage:
+    python3 train_model_v2.py                                  # all partitions
+    python3 train_model_v2.py jaar=2024-01 gemeentecode=GM0363,GM0599
 """
 
+import sys
+import time
+
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split, cross_val_score
@@ -12,6 +22,16 @@ from sklearn.metrics import classification_report, confusion_matrix
 import joblib
 import json
 
+from feature_pipeline import FEATURE_NAMES, SOURCE_COLUMNS, encode_features
+from flat_forest import FlatForest, calibrate_cascade, evaluate_cascade, export_forest, save_forest
+from training_store import TRAINING_DATA_DIR, load_training_data, parse_filters
+
+try:
+    filters = parse_filters(sys.argv[1:])
+except ValueError as e:
+    print(f"{e}\n{__doc__}")
+    sys.exit(1)
+
 print("=" * 80)
 print("ML Model Training - Version 2")
 print("=" * 80)
@@ -19,14 +39,17 @@ print()
 
 # Load training data
 print("📊 Loading training data V2...")
-df = pd.read_csv('training_data_v2.csv')
-print(f"   Loaded {len(df):,} examples")
-print(f"   Features: {df.columns.tolist()}")
+start = time.perf_counter()
+df = load_training_data(SOURCE_COLUMNS + ['recommendation', 'gemeentecode'], filters)
+print(f"   Loaded {len(df):,} examples from {TRAINING_DATA_DIR}/ in {time.perf_counter() - start:.2f}s")
+if filters:
+    print(f"   Partitions: {filters}")
+print(f"   Columns: {df.columns.tolist()}")
 print()
 
 # Analyze data
 print("📈 Data Distribution:")
-print(f"   Municipalities: {df['municipality'].nunique()}")
+print(f"   Municipalities: {df['gemeentecode'].nunique()}")
 print(f"\n   Debt amounts:")
 print(f"   - Mean: €{df['debt_amount'].mean():.2f}")
 print(f"   - Median: €{df['debt_amount'].median():.2f}")
@@ -40,45 +63,15 @@ for rec, count in df['recommendation'].value_counts().items():
     print(f"   - {rec}: {count:,} ({count/len(df)*100:.1f}%)")
 print()
 
-# Select features for training
-feature_columns = [
-    'debt_amount',
-    'monthly_income',
-    'has_social_benefits',
-    'is_unemployed',
-    'has_flex_work',
-    'is_zzp',
-    'is_single_parent',
-    'has_children',
-    'num_children',
-    'has_jeugdzorg',
-    'debt_to_income_ratio',
-    'other_debts_count',
-    'income_risk',
-    'unemployment_risk',
-    'social_benefit_risk'
-]
-
-# Age category encoding
+# Select features for training: the 15 base columns plus age and benefit
+# type one-hots, built by the same pipeline the API uses
 print("🔧 Encoding categorical features...")
-df['age_jong'] = (df['age_category'] == 'jong').astype(int)
-df['age_oud'] = (df['age_category'] == 'oud').astype(int)
-# age_mid is baseline (both 0)
-
-feature_columns.extend(['age_jong', 'age_oud'])
-
-# Benefit type encoding
-df['benefit_bijstand'] = (df['benefit_type'] == 'bijstand').astype(int)
-df['benefit_ww'] = (df['benefit_type'] == 'ww').astype(int)
-df['benefit_ao'] = (df['benefit_type'] == 'ao').astype(int)
-
-feature_columns.extend(['benefit_bijstand', 'benefit_ww', 'benefit_ao'])
-
+feature_columns = list(FEATURE_NAMES)
 print(f"   Using {len(feature_columns)} features")
 print()
 
 # Prepare data
-X = df[feature_columns].values
+X = encode_features(df)
 y = df['recommendation'].values
 
 # Encode labels
@@ -131,18 +124,21 @@ test_accuracy = (y_pred == y_test).mean()
 print(f"   Accuracy: {test_accuracy*100:.2f}%")
 print()
 
-# Detailed classification report
+# Detailed classification report (all classes, also when a few partitions lack one in the test set)
+class_labels = np.arange(len(label_encoder.classes_))
 print("📋 Classification Report:")
 print(classification_report(
     y_test,
     y_pred,
+    labels=class_labels,
     target_names=label_encoder.classes_,
+    zero_division=0,
     digits=3
 ))
 
 # Confusion Matrix
 print("🔢 Confusion Matrix:")
-cm = confusion_matrix(y_test, y_pred)
+cm = confusion_matrix(y_test, y_pred, labels=class_labels)
 print("Predicted →")
 print("Actual ↓")
 cm_df = pd.DataFrame(
@@ -179,7 +175,9 @@ print()
 # Save model
 print("💾 Saving model artifacts...")
 
-# Save model
+# Save model. n_jobs=-1 is for training only: it is pickled with the model and
+# would make every predict_proba at serving time fan out over all cores.
+model.set_params(n_jobs=1)
 joblib.dump(model, 'debt_model_v2.joblib')
 print("   ✅ Model saved: debt_model_v2.joblib")
 
@@ -191,6 +189,46 @@ print("   ✅ Scaler saved: scaler_v2.joblib")
 joblib.dump(label_encoder, 'label_encoder_v2.joblib')
 print("   ✅ Label encoder saved: label_encoder_v2.joblib")
 
+# Export flattened forest for the API (scaler folded into the thresholds)
+flat_arrays = export_forest(model, scaler)
+save_forest(flat_arrays, 'debt_model_v2_flat')
+flat_proba = FlatForest(flat_arrays).predict_proba(X_test)
+sklearn_proba = model.predict_proba(X_test_scaled)
+print("   ✅ Flattened forest saved: debt_model_v2_flat/")
+print(f"      {len(flat_arrays['feature']):,} nodes, max depth {flat_arrays['max_depth']}")
+print(f"      Max |Δp| vs sklearn: {np.abs(flat_proba - sklearn_proba).max():.2e}")
+print(f"      Argmax agreement: {(flat_proba.argmax(axis=1) == sklearn_proba.argmax(axis=1)).mean()*100:.2f}%")
+
+# Calibrate the optional cascade (ML_CASCADE=1): the first trees answer rows
+# they are confident about, the rest of the forest the others. Thresholds
+# are picked on one half of the test split and reported on the other half,
+# so the served forest keeps all of its training rows.
+def print_cascade_report(report):
+    print(f"   {'trees':>5s} {'threshold':>9s} {'coverage':>8s} {'agreement':>9s} {'accuracy':>8s} {'ms/1k rows':>10s}")
+    for row in report:
+        threshold = f"{row['threshold']:.3f}" if row['threshold'] is not None else '-'
+        print(f"   {row['trees']:5d} {threshold:>9s} {row['coverage']*100:7.1f}% "
+              f"{row['agreement']*100:8.2f}% {row['accuracy']*100:7.2f}% {row['ms_per_1k_rows']:10.2f}")
+
+print()
+X_calib, X_report, y_calib, y_report = train_test_split(
+    X_test, y_test, test_size=0.5, random_state=42, stratify=y_test
+)
+print(f"⚡ Cascade calibration (test split, {len(X_calib):,} rows):")
+flat_model = FlatForest(flat_arrays)
+cascade, calibration_report = calibrate_cascade(flat_model, X_calib, y_calib)
+print_cascade_report(calibration_report)
+print(f"   Other half of the test split ({len(X_report):,} rows):")
+cascade_report = evaluate_cascade(
+    flat_model, X_report, y_report, [(row['trees'], row['threshold']) for row in calibration_report[1:]]
+)
+print_cascade_report(cascade_report)
+if cascade:
+    cascade = next(row for row in cascade_report if row['trees'] == cascade['trees'])
+    print(f"   ✅ Cascade: first {cascade['trees']} trees above confidence {cascade['threshold']:.3f}")
+else:
+    print("   ⚠️  No cascade setting is faster than the full forest")
+
 # Save feature names
 with open('feature_names_v2.json', 'w') as f:
     json.dump(feature_columns, f, indent=2)
@@ -200,6 +238,7 @@ print("   ✅ Feature names saved: feature_names_v2.json")
 metadata = {
     'version': '2.0',
     'training_date': pd.Timestamp.now().isoformat(),
+    'training_data': {'path': TRAINING_DATA_DIR, 'filters': filters},
     'training_samples': len(X_train),
     'test_samples': len(X_test),
     'test_accuracy': float(test_accuracy),
@@ -222,7 +261,8 @@ metadata = {
         'More nuanced success probability calculation',
         'Based on 14 CBS patterns (was 3 in V1)'
     ],
-    'feature_importance_top5': feature_importance.head(5).to_dict('records')
+    'feature_importance_top5': feature_importance.head(5).to_dict('records'),
+    'cascade': dict(cascade, report=cascade_report, calibration_report=calibration_report) if cascade else None
 }
 
 with open('model_metadata_v2.json', 'w') as f:
@@ -249,7 +289,7 @@ if os.path.exists('debt_model.joblib'):
 
     # Compare predictions
     v1_pred = v1_model.predict(X_v1_scaled)
-    v2_pred = model.predict(scaler.transform(df[feature_columns].values))
+    v2_pred = model.predict(scaler.transform(X))
 
     # Map V1 predictions to labels
     v1_pred_labels = v1_encoder.inverse_transform(v1_pred)
@@ -274,6 +314,7 @@ print("=" * 80)
 print()
 print("Next steps:")
 print("  1. Test model: python3 test_model_v2.py")
-print("  2. Update ML API to use V2 model")
-print("  3. Restart backend and test predictions")
+print("  2. Optionally shrink the forest: python3 compress_forest.py")
+print("  3. Publish: python3 model_registry.py publish")
+print("  4. Activate without restart: python3 model_registry.py activate <version>")
 print()
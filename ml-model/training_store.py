@@ -0,0 +1,167 @@
+"""
+Partitioned Parquet store of the V2 training data.
+
+extract_training_data_v2.py writes the generated cases to TRAINING_DATA_DIR
+as a hive-partitioned dataset with one file per gemeente:
+
+    training_data_v2/
+        _common_metadata                       SCHEMA
+        _metadata                              SCHEMA + row group statistics of every file
+        jaar=2024-01/gemeentecode=GM0363/part-0.parquet
+        ...
+
+A gemeentecode that occurs under two names has part-0 and part-1. jaar is
+the latest CBS year the profiles were built from; regenerating replaces
+only the partition of that year. Every column chunk has min/max statistics
+in its footer, and _metadata collects all footers, so a reader plans a
+scan from one file and skips row groups and partitions that a filter rules
+out.
+
+load_training_data() reads only the columns it is asked for, memory-mapped,
+as categoricals for the string columns. Filters are DNF lists as in
+pyarrow.parquet, e.g. [('jaar', '=', '2024-01'), ('gemeentecode', 'in', [...])],
+and parse_filters() builds them from command line arguments such as
+`jaar=2024-01 gemeentecode=GM0363,GM0599`.
+"""
+import os
+import shutil
+from typing import List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+TRAINING_DATA_DIR = 'training_data_v2'
+COMPRESSION = 'zstd'
+
+PARTITION_COLUMNS = ['jaar', 'gemeentecode']
+
+# Columns of generate_cases(), in order; the partition columns live in the paths
+_CATEGORY = pa.dictionary(pa.int32(), pa.string())
+SCHEMA = pa.schema([
+    ('debt_amount', pa.float64()),
+    ('monthly_income', pa.float64()),
+    ('has_social_benefits', pa.bool_()),
+    ('benefit_type', _CATEGORY),
+    ('is_unemployed', pa.bool_()),
+    ('has_flex_work', pa.bool_()),
+    ('is_zzp', pa.bool_()),
+    ('is_single_parent', pa.bool_()),
+    ('has_children', pa.bool_()),
+    ('num_children', pa.int64()),
+    ('has_jeugdzorg', pa.bool_()),
+    ('age_category', _CATEGORY),
+    ('debt_to_income_ratio', pa.float64()),
+    ('other_debts_count', pa.int64()),
+    ('income_risk', pa.float64()),
+    ('unemployment_risk', pa.float64()),
+    ('social_benefit_risk', pa.float64()),
+    ('municipality', _CATEGORY),
+    ('success_probability', pa.float64()),
+    ('recommendation', _CATEGORY),
+])
+
+
+def partition_dir(root: str, jaar: str) -> str:
+    return os.path.join(root, f"jaar={jaar}")
+
+
+def staging_dir(root: str, jaar: str) -> str:
+    """Where a run writes the partition of jaar; readers skip names starting with '.'."""
+    return os.path.join(root, f".jaar={jaar}.tmp")
+
+
+def write_gemeente(cases: pd.DataFrame, partition: str, gemeentecode: str, part: int = 0):
+    """
+    Write the cases of one gemeente with SCHEMA as
+    partition/gemeentecode=<code>/part-<part>.parquet. part numbers the
+    names a gemeentecode occurs under.
+    """
+    cases = cases.assign(municipality=cases['municipality'].cat.remove_unused_categories())
+    table = pa.Table.from_pandas(cases, schema=SCHEMA, preserve_index=False)
+    directory = os.path.join(partition, f"gemeentecode={gemeentecode}")
+    os.makedirs(directory, exist_ok=True)
+    pq.write_table(table, os.path.join(directory, f"part-{part}.parquet"),
+                   compression=COMPRESSION, write_statistics=True)
+
+
+def publish_partition(root: str, jaar: str):
+    """Replace the partition of jaar with its staging directory and rewrite the dataset metadata."""
+    target = partition_dir(root, jaar)
+    old = f"{staging_dir(root, jaar)}.old"
+    if os.path.exists(target):
+        os.rename(target, old)
+    os.rename(staging_dir(root, jaar), target)
+    shutil.rmtree(old, ignore_errors=True)
+    write_metadata(root)
+
+
+def data_files(root: str) -> List[str]:
+    """Paths of the data files relative to root, sorted, skipping hidden and metadata files."""
+    paths = []
+    for directory, subdirs, files in os.walk(root):
+        subdirs[:] = sorted(name for name in subdirs if not name.startswith(('.', '_')))
+        relative = os.path.relpath(directory, root)
+        paths += [os.path.normpath(os.path.join(relative, name)) for name in sorted(files)
+                  if name.endswith('.parquet') and not name.startswith(('.', '_'))]
+    return paths
+
+
+def write_metadata(root: str):
+    """Write _common_metadata (the schema) and _metadata (the footers of all data files)."""
+    pq.write_metadata(SCHEMA, os.path.join(root, '_common_metadata'))
+    metadata = None
+    for path in data_files(root):
+        footer = pq.read_metadata(os.path.join(root, path))
+        footer.set_file_path(path.replace(os.sep, '/'))
+        if metadata is None:
+            metadata = footer
+        else:
+            metadata.append_row_groups(footer)
+    tmp_file = os.path.join(root, '_metadata.tmp')
+    if metadata is None:
+        pq.write_metadata(SCHEMA, tmp_file)
+    else:
+        metadata.write_metadata_file(tmp_file)
+    os.replace(tmp_file, os.path.join(root, '_metadata'))
+
+
+def open_dataset(root: str = TRAINING_DATA_DIR) -> ds.Dataset:
+    """The dataset from its _metadata file, or by listing the directories when that is missing."""
+    filesystem = fs.LocalFileSystem(use_mmap=True)
+    # Partition values as dictionaries: a code per row instead of a string
+    partitioning = ds.HivePartitioning.discover(infer_dictionary=True)
+    root = os.path.abspath(root)
+    metadata = os.path.join(root, '_metadata')
+    if os.path.exists(metadata):
+        return ds.parquet_dataset(metadata, filesystem=filesystem, partitioning=partitioning)
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"{root} not found, run extract_training_data_v2.py first")
+    return ds.dataset(root, format='parquet', filesystem=filesystem, partitioning=partitioning)
+
+
+def load_training_data(columns: Optional[Sequence[str]] = None, filters=None,
+                       root: str = TRAINING_DATA_DIR) -> pd.DataFrame:
+    """
+    Read the training data as a DataFrame: only `columns` (all when None;
+    partition columns come out as categoricals), only the partitions and
+    row groups matching `filters`.
+    """
+    dataset = open_dataset(root)
+    expression = pq.filters_to_expression(filters) if filters else None
+    table = dataset.to_table(columns=list(columns) if columns is not None else None, filter=expression)
+    return table.to_pandas()
+
+
+def parse_filters(args: Sequence[str]) -> Optional[list]:
+    """`<partition column>=value[,value...]` arguments -> DNF filters (None without arguments)."""
+    filters = []
+    for arg in args:
+        column, sep, values = arg.partition('=')
+        if not sep or column not in PARTITION_COLUMNS:
+            raise ValueError(f"Expected jaar=<jaar> or gemeentecode=<code>[,<code>...], got {arg!r}")
+        values = values.split(',')
+        filters.append((column, '=', values[0]) if len(values) == 1 else (column, 'in', values))
+    return filters or None